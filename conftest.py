@@ -7,6 +7,10 @@ import cProfile
 import pstats
 import yaml
 import re
+import time
+import hashlib
+import threading
+import http.server
 from moto import mock_aws
 import boto3
 
@@ -15,6 +19,7 @@ import boto3
 import crds
 from crds.core import log, utils
 from crds.core import config as crds_config
+from crds.client import proxy
 
 # ==============================================================================
 HERE = os.path.abspath(os.path.dirname(__file__) or ".")
@@ -296,6 +301,166 @@ def hst_serverless_state(crds_shared_group_cache):
     cfg.cleanup()
 
 
+@fixture(scope='function')
+def hst_offline_state(default_shared_state, hst_data, tmp_path, monkeypatch):
+    """Compute hst bestrefs locally from the test mappings using a cached server config,
+    without a CRDS server or shared cache.
+    """
+    config_path = tmp_path / "config"
+    config_path.mkdir()
+    (config_path / "server_config").write_text(repr({
+        "observatory" : "hst", "operational_context" : "hst.pmap", "edit_context" : "hst.pmap",
+        "build_context" : "hst.pmap", "latest_context" : "hst.pmap", "bad_files_list" : [],
+        "connected" : True, "force_remote_mode" : 0, "status" : "server", "mappings" : [],
+        "effective_mode" : "local", "last_synced" : "2026-01-01 00:00:00",
+    }))
+    for var, value in [("CRDS_PATH", str(tmp_path / "cache")), ("CRDS_MAPPATH_SINGLE", hst_data),
+                       ("CRDS_CFGPATH_SINGLE", str(config_path)), ("CRDS_IGNORE_CHECKSUM", "1"),
+                       ("CRDS_SERVER_URL", "https://hst-crds.stsci.edu"), ("CRDS_MODE", "local")]:
+        monkeypatch.setenv(var, value)
+    utils.clear_function_caches()
+    yield default_shared_state
+    utils.clear_function_caches()
+
+class StandInServer(http.server.ThreadingHTTPServer):
+    """Local HTTP server standing in for the CRDS server.   It serves the server_config
+    and files of directory `served`,  optionally delaying each GET by `delay` seconds,
+    and answers JSON RPC calls of the methods in dict `rpc_methods`,  batched if
+    `batches` is True,  counting requests in `posts`.   It honors Range
+    requests if `ranges` is True,  and drops the connection after sending the number
+    of bytes in dict `interrupts` for the next GET of each file it names.   It records
+    the most concurrent GETs seen in `max_active`,  the number of client connections in
+    `connections`,  and the (path, Range header) of each GET in `gets`.
+    """
+    daemon_threads = True
+
+    def __init__(self, served):
+        self.served = served
+        self.metadata = {}
+        self.rpc_methods = {}
+        self.delay = 0
+        self.ranges = True
+        self.interrupts = {}
+        self.gets = []
+        self.batches = True
+        self.posts = 0
+        self.active = self.max_active = self.connections = 0
+        self.lock = threading.Lock()
+        super().__init__(("127.0.0.1", 0), StandInHandler)
+        self.url = f"http://127.0.0.1:{self.server_address[1]}/"
+        self.write_config()
+
+    def add_file(self, name, data, sha1sum=None):
+        """Serve `data` as file `name`,  described to clients with `sha1sum` or its real sha1sum."""
+        (self.served / name).write_bytes(data)
+        self.metadata[name] = {"size" : str(len(data)), "sha1sum" : sha1sum or hashlib.sha1(data).hexdigest()}
+        self.write_config()
+
+    def write_config(self):
+        (self.served / "server_config").write_text(repr({
+            "observatory" : "hst", "operational_context" : "hst.pmap", "edit_context" : "hst.pmap",
+            "build_context" : "hst.pmap", "bad_files_list" : [], "force_remote_mode" : 0, "mappings" : [],
+            "download_metadata" : self.metadata,
+        }))
+
+class StandInHandler(http.server.SimpleHTTPRequestHandler):
+
+    protocol_version = "HTTP/1.1"
+    disable_nagle_algorithm = True
+
+    def __init__(self, request, client_address, server):
+        super().__init__(request, client_address, server, directory=str(server.served))
+
+    def handle(self):
+        with self.server.lock:
+            self.server.connections += 1
+        super().handle()
+
+    def do_POST(self):
+        calls = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+        with self.server.lock:
+            self.server.posts += 1
+        if not isinstance(calls, list):
+            response = self.rpc(calls)
+        elif self.server.batches:
+            response = [self.rpc(call) for call in calls]
+        else:
+            response = {"result" : None, "error" : {"message" : "Invalid request."}, "id" : None}
+        body = json.dumps(response).encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        with self.server.lock:
+            self.server.active += 1
+            self.server.max_active = max(self.server.max_active, self.server.active)
+        try:
+            time.sleep(self.server.delay)
+            name = self.path.lstrip("/")
+            with self.server.lock:
+                self.server.gets.append((self.path, self.headers.get("Range")))
+                interrupt = self.server.interrupts.pop(name, None)
+            if interrupt is not None or (self.server.ranges and self.headers.get("Range")):
+                self.send_file_part(name, interrupt)
+            else:
+                super().do_GET()
+        finally:
+            with self.server.lock:
+                self.server.active -= 1
+
+    def rpc(self, call):
+        """Return the JSON RPC response to decoded `call`."""
+        try:
+            response = {"result" : self.server.rpc_methods[call["method"]](*call["params"]), "error" : None}
+        except Exception as exc:
+            response = {"result" : None, "error" : {"message" : repr(exc)}}
+        response["id"] = call["id"]
+        return response
+
+    def send_file_part(self, name, interrupt):
+        """Send the requested Range of file `name`,  dropping the connection after `interrupt` bytes."""
+        data = (self.server.served / name).read_bytes()
+        start = 0
+        if self.server.ranges and self.headers.get("Range"):
+            start = int(self.headers["Range"].split("=")[1].split("-")[0])
+            self.send_response(206)
+            self.send_header("Content-Range", f"bytes {start}-{len(data)-1}/{len(data)}")
+        else:
+            self.send_response(200)
+        self.send_header("Content-Length", str(len(data) - start))
+        self.end_headers()
+        if interrupt is None:
+            self.wfile.write(data[start:])
+        else:
+            self.wfile.write(data[start:start + interrupt])
+            self.close_connection = True
+
+    def log_message(self, *args):
+        pass
+
+@fixture(scope='function')
+def hst_download_server(default_shared_state, tmp_path, monkeypatch):
+    """Download hst files into a temporary cache from a StandInServer."""
+    served = tmp_path / "served"
+    served.mkdir()
+    server = StandInServer(served)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    for var, value in [("CRDS_PATH", str(tmp_path / "cache")), ("CRDS_REF_SUBDIR_MODE", "flat"),
+                       ("CRDS_SERVER_URL", "https://hst-crds.stsci.edu"), ("CRDS_MODE", "local"),
+                       ("CRDS_CONFIG_URI", server.url), ("CRDS_REFERENCE_URI", server.url),
+                       ("CRDS_DOWNLOAD_PLUGIN", ""), ("CRDS_CLIENT_RETRY_COUNT", "1")]:
+        monkeypatch.setenv(var, value)
+    utils.clear_function_caches()
+    yield server
+    proxy.close_http_session()
+    server.shutdown()
+    server.server_close()
+    utils.clear_function_caches()
+
 @fixture()
 def hst_persistent_state(test_cache):
     cfg = ConfigState(
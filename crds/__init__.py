@@ -15,6 +15,8 @@ warnings.filterwarnings(
 __all__ = [
     "getrecommendations",
     "getreferences",
+    "getrecommendations_many",
+    "getreferences_many",
     "assign_bestrefs",
     "get_pickled_mapping",
     "get_symbolic_mapping",
@@ -38,6 +40,7 @@ from .core.exceptions import *
 from .core.constants import ALL_OBSERVATORIES, INSTRUMENT_KEYWORDS
 
 from .core.heavy_client import getreferences, getrecommendations
+from .core.heavy_client import getreferences_many, getrecommendations_many
 from .core.heavy_client import get_symbolic_mapping, get_pickled_mapping
 from .core.heavy_client import get_context_name
 
@@ -17,7 +17,7 @@ import numpy as np
 
 import crds
 
-from crds.core import pysh, log, config, utils, rmap, cmdline
+from crds.core import pysh, log, config, utils, rmap, cmdline, uses_index
 from crds.core.exceptions import InvalidFormatError, ValidationError, MissingKeywordError, MappingInsertionError
 from crds.core import reftypes
 
@@ -500,6 +500,10 @@ def find_governing_rmap(context, reference):
     """Given mapping `context`,  return the loaded rmap which governs `reference`.   Typically this will
     be the rmap which contains the predecessor to `reference`,  not `reference` itself.
     """
+    if config.USES_INDEX and isinstance(context, str) and config.is_mapping(context):
+        governing_rmap = find_indexed_governing_rmap(context, reference)
+        if governing_rmap is not None:
+            return governing_rmap
     mapping = rmap.asmapping(context, cached=True)
     instrument, filekind = mapping.locate.get_file_properties(reference)
     if mapping.name.endswith(".pmap"):
@@ -517,6 +521,25 @@ def find_governing_rmap(context, reference):
         reference, governing_rmap.name, mapping.name))
     return governing_rmap
 
+def find_indexed_governing_rmap(context, reference):
+    """Return the loaded rmap which governs `reference` found using the uses index of
+    the CRDS cache,  loading only that rmap rather than all of `context`.   Returns None
+    if `context` isn't indexed or has no rmap for the instrument and type of `reference`.
+    """
+    observatory = utils.file_to_observatory(context)
+    closure = uses_index.get_uses_index(observatory).closure(context)
+    if closure is None:
+        return None
+    locator = utils.get_locator_module(observatory)
+    properties = locator.get_file_properties(reference)
+    governing = [name for name in closure
+                 if name.endswith(".rmap") and locator.get_file_properties(name) == properties]
+    if len(governing) != 1:
+        return None
+    log.verbose("Reference '{}' corresponds to rmap '{}' in context '{}'".format(
+        reference, governing[0], os.path.basename(context)))
+    return rmap.get_cached_mapping(governing[0])
+
 # ============================================================================
 
 def table_mode_dictionary(generic_name, tab, mode_keys):
@@ -7,11 +7,14 @@ import os.path
 import base64
 import re
 import zlib
+import hashlib
 import html
 import importlib.metadata
 from urllib import request
 import ast
 import subprocess
+import threading
+import concurrent.futures
 
 # ==============================================================================
 
@@ -38,6 +41,7 @@ __all__ = [
     "get_server_info",
     "get_cached_server_info",  # deprecated
     "cache_references",
+    "cache_references_many",
 
     "set_crds_server",
     "get_crds_server",
@@ -560,12 +564,16 @@ def get_dataset_headers_unlimited(context, ids):
     `header` will be returned as a string / error message.
     """
     max_ids_per_rpc = get_server_info().get("max_headers_per_rpc", 500)
-    for i in range(0, len(ids), max_ids_per_rpc):
+    batch_size = max(config.RPC_BATCH_SIZE.get(), 1)
+    context = os.path.basename(context)
+    for i in range(0, len(ids), max_ids_per_rpc * batch_size):
         log.verbose("Dumping dataset headers", i, "of", len(ids), verbosity=20)
-        id_slice = ids[i: i + max_ids_per_rpc]
-        header_slice = get_dataset_headers_by_id(context, id_slice)
-        for item in header_slice.items():
-            yield item
+        with S._batch() as batch:
+            header_slices = [batch.get_dataset_headers_by_id(context, ids[j: j + max_ids_per_rpc], None)
+                             for j in range(i, min(i + max_ids_per_rpc * batch_size, len(ids)), max_ids_per_rpc)]
+        for header_slice in header_slices:
+            for item in header_slice.result().items():
+                yield item
 
 
 def get_affected_datasets(observatory, old_context=None, new_context=None):
@@ -700,6 +708,31 @@ def file_progress(activity, name, path, bytes, bytes_so_far, total_bytes, nth_fi
         total_bytes=utils.human_format_number(total_bytes).strip())
 
 
+class DownloadProgress:
+    """Aggregate progress of downloading `total_files` files of `total_bytes`,  shared
+    by the threads of a concurrent download.
+    """
+    def __init__(self, total_files, total_bytes):
+        self.total_files = total_files
+        self.total_bytes = total_bytes
+        self.nth_file = 0
+        self.bytes_so_far = 0
+        self._lock = threading.Lock()
+
+    def start(self, activity, name, path, bytes):
+        """Count the start of `activity` on file `name`,  returning its progress message."""
+        with self._lock:
+            message = file_progress(activity, name, path, bytes, self.bytes_so_far, self.total_bytes,
+                                    self.nth_file, self.total_files)
+            self.nth_file += 1
+        return message
+
+    def add_bytes(self, bytes):
+        """Count `bytes` more bytes as transferred."""
+        with self._lock:
+            self.bytes_so_far += bytes
+
+
 # ==============================================================================
 
 
@@ -767,33 +800,52 @@ class FileCacher:
         return int(self.info_map[os.path.basename(name)]["size"])
 
     def download_files(self, downloads, localpaths):
-        """Serial file-by-file download."""
+        """Download files `downloads` to `localpaths`,  using CRDS_DOWNLOAD_JOBS threads.
+
+        Returns the number of bytes downloaded.
+        """
         download_metadata = get_download_metadata()
         self.info_map = {}
         for filename in downloads:
             self.info_map[filename] = download_metadata.get(filename, "NOT FOUND unknown to server")
         if config.writable_cache_or_verbose("Readonly cache, skipping download of (first 5):", repr(downloads[:5]),
                                             verbosity=70):
-            bytes_so_far = 0
-            total_files = len(downloads)
-            total_bytes = get_total_bytes(self.info_map)
-            for nth_file, name in enumerate(downloads):
-                try:
-                    if "NOT FOUND" in self.info_map[name]:
-                        raise CrdsDownloadError("file is not known to CRDS server.")
-                    bytes, path = self.catalog_file_size(name), localpaths[name]
-                    log.info(
-                        file_progress("Fetching", name, path, bytes, bytes_so_far, total_bytes, nth_file, total_files))
-                    self.download(name, path)
-                    bytes_so_far += os.stat(path).st_size
-                except Exception as exc:
-                    if self.raise_exceptions:
+            progress = DownloadProgress(len(downloads), get_total_bytes(self.info_map))
+            jobs = min(max(config.DOWNLOAD_JOBS.get(), 1), len(downloads))
+            if jobs == 1:
+                for name in downloads:
+                    self.download_with_progress(name, localpaths[name], progress)
+            else:
+                log.verbose("Downloading", len(downloads), "files using", jobs, "threads.")
+                with concurrent.futures.ThreadPoolExecutor(jobs) as pool:
+                    futures = [pool.submit(self.download_with_progress, name, localpaths[name], progress)
+                               for name in downloads]
+                    try:
+                        for future in concurrent.futures.as_completed(futures):
+                            future.result()
+                    except BaseException:  # stop starting downloads,  let running downloads finish or clean up
+                        for future in futures:
+                            future.cancel()
                         raise
-                    else:
-                        log.error("Failure downloading file", repr(name), ":", str(exc))
-            return bytes_so_far
+            return progress.bytes_so_far
         return 0
 
+    def download_with_progress(self, name, localpath, progress):
+        """Download file `name` to `localpath`,  reporting and counting it in DownloadProgress `progress`.
+        Failures are raised or logged as errors depending on `raise_exceptions`.
+        """
+        try:
+            if "NOT FOUND" in self.info_map[name]:
+                raise CrdsDownloadError("file is not known to CRDS server.")
+            log.info(progress.start("Fetching", name, localpath, self.catalog_file_size(name)))
+            self.download(name, localpath)
+            progress.add_bytes(os.stat(localpath).st_size)
+        except Exception as exc:
+            if self.raise_exceptions:
+                raise
+            else:
+                log.error("Failure downloading file", repr(name), ":", str(exc))
+
     def download(self, name, localpath):
         """Download a single file."""
         # This code is complicated by the desire to blow away failed downloads.  For the specific
@@ -827,16 +879,60 @@ class FileCacher:
         """Download and verify file `name` under context `pipeline_context` to `localpath`."""
         if config.get_download_plugin():
             self.plugin_download(name, localpath)
+            self.verify_file(name, localpath)
         else:
-            generator = self.get_data_http(name)
-            self.generator_download(generator, localpath)
-        self.verify_file(name, localpath)
+            self.http_download(name, localpath)
+
+    def http_download(self, name, localpath):
+        """Download file `name` to `localpath` by way of `localpath`.part,  which is renamed
+        to `localpath` once verified.   A .part file left by an interrupted or failed attempt
+        is resumed from its current size,  using an HTTP Range request if the server supports
+        them.   A .part file which fails verification is removed so the next attempt starts over.
+        """
+        partpath = localpath + ".part"
+        offset = self.resume_offset(name, partpath)
+        generator = self.get_data_http(name, offset)
+        sha1sum = self.generator_download(generator, partpath, offset)
+        try:
+            self.verify_file(name, partpath, sha1sum)
+        except Exception:
+            self.remove_file(partpath)
+            raise
+        os.replace(partpath, localpath)
 
-    def generator_download(self, generator, localpath):
-        """Read all bytes from `generator` until file is downloaded to `localpath.`"""
-        with open(localpath, "wb+") as outfile:
+    def resume_offset(self, name, partpath):
+        """Return the byte offset from which to resume downloading `name` into `partpath`,
+        0 to start over.
+        """
+        try:
+            offset = os.stat(partpath).st_size
+        except FileNotFoundError:
+            return 0
+        if offset >= self.catalog_file_size(name):
+            return 0
+        if offset:
+            log.verbose("Resuming download of", repr(name), "at byte", offset)
+        return offset
+
+    def generator_download(self, generator, localpath, offset=0):
+        """Read all bytes from `generator` until file is downloaded to `localpath.`
+        If `offset` is non-zero,  append to the first `offset` bytes already in `localpath`.
+
+        Returns the sha1sum of the downloaded file computed as it is written,  or None
+        if CRDS_DOWNLOAD_CHECKSUMS is False.
+        """
+        xsum = hashlib.sha1() if config.get_checksum_flag() else None
+        with open(localpath, "r+b" if offset else "wb+") as outfile:
+            if xsum is not None:
+                while outfile.tell() < offset:
+                    xsum.update(outfile.read(min(offset - outfile.tell(), config.CRDS_CHECKSUM_BLOCK_SIZE)))
+            outfile.seek(offset)
+            outfile.truncate()
             for data in generator:
                 outfile.write(data)
+                if xsum is not None:
+                    xsum.update(data)
+        return xsum.hexdigest() if xsum is not None else None
 
     def plugin_download(self, filename, localpath):
         """Run an external program defined by CRDS_DOWNLOAD_PLUGIN to download filename to localpath. 
@@ -877,14 +973,17 @@ class FileCacher:
         log.verbose("Calling", repr(s3_get_cmd), verbosity=80)
         result = subprocess.run(s3_get_cmd, encoding="utf-8")
 
-    def get_data_http(self, filename):
-        """Yield the data returned from `filename` of `pipeline_context` in manageable chunks."""
+    def get_data_http(self, filename, offset=0):
+        """Yield the data returned from `filename` of `pipeline_context` in manageable chunks,
+        starting at byte `offset`.
+        """
         url = self.get_url(filename)
         try:
-            infile = request.urlopen(url)
+            infile = self.open_url(url, offset)
+            read = getattr(infile, "read1", infile.read)   # read1 returns data received before a failure
             file_size = utils.human_format_number(self.catalog_file_size(filename)).strip()
             stats = utils.TimingStats()
-            data = infile.read(config.CRDS_DATA_CHUNK_SIZE)
+            data = read(config.CRDS_DATA_CHUNK_SIZE)
             while data:
                 stats.increment("bytes", len(data))
                 status = stats.status("bytes")
@@ -892,7 +991,7 @@ class FileCacher:
                 log.verbose("Transferred HTTP", repr(url), bytes_so_far, "/", file_size, "bytes at", status[1],
                             verbosity=20)
                 yield data
-                data = infile.read(config.CRDS_DATA_CHUNK_SIZE)
+                data = read(config.CRDS_DATA_CHUNK_SIZE)
         except Exception as exc:
             raise CrdsDownloadError(
                 "Failed downloading", srepr(filename),
@@ -903,12 +1002,49 @@ class FileCacher:
             except UnboundLocalError:  # maybe the open failed.
                 pass
 
+    def open_url(self, url, offset=0):
+        """Return a file-like object reading the contents of `url` from byte `offset`.   HTTP
+        URLs are read over the pooled keep-alive connections shared with JSON RPC calls,
+        requesting only the bytes from `offset` on.   When the server ignores the Range
+        request,  the first `offset` bytes of the full contents are skipped.
+        """
+        if not url.startswith(("http://", "https://")):
+            infile = request.urlopen(url)
+            partial = False
+        else:
+            headers = {"Range" : f"bytes={offset}-", "Accept-Encoding" : "identity"} if offset else {}
+            response = proxy.get_http_session().get(url, stream=True, headers=headers)
+            try:
+                response.raise_for_status()
+            except Exception:
+                response.close()
+                raise
+            response.raw.decode_content = True
+            infile = response.raw
+            partial = response.status_code == 206
+            if partial and not response.headers.get("Content-Range", "").startswith(f"bytes {offset}-"):
+                response.close()
+                raise CrdsDownloadError("Server returned unrequested range",
+                                        srepr(response.headers.get("Content-Range")), "for", srepr(url))
+            if offset and not partial:
+                log.verbose("Server does not support Range requests for", repr(url), ",  downloading all of it.")
+        if offset and not partial:
+            while offset:
+                data = infile.read(min(offset, config.CRDS_DATA_CHUNK_SIZE))
+                if not data:
+                    break
+                offset -= len(data)
+        return infile
+
     def get_url(self, filename):
         """Return the URL used to fetch `filename` of `pipeline_context`."""
         return get_flex_uri(filename, self.observatory)
 
-    def verify_file(self, filename, localpath):
-        """Check that the size and checksum of downloaded `filename` match the server."""
+    def verify_file(self, filename, localpath, sha1sum=None):
+        """Check that the size and checksum of downloaded `filename` match the server.
+        `sha1sum` is the checksum computed while downloading `localpath`,  if None
+        `localpath` is read to compute it.
+        """
         remote_info = self.info_map[filename]
         local_length = os.stat(localpath).st_size
         original_length = int(remote_info["size"])
@@ -920,7 +1056,7 @@ class FileCacher:
             log.verbose("Skipping sha1sum with CRDS_DOWNLOAD_CHECKSUMS=False")
         elif remote_info["sha1sum"] not in ["", "none"]:
             original_sha1sum = remote_info["sha1sum"]
-            local_sha1sum = utils.checksum(localpath)
+            local_sha1sum = sha1sum or utils.checksum(localpath)
             if original_sha1sum != local_sha1sum:
                 raise CrdsDownloadError(
                     "downloaded file", srepr(filename),
@@ -1039,6 +1175,32 @@ def cache_references(pipeline_context, bestrefs, ignore_cache=False, parameters=
 
     return refs
 
+def cache_references_many(pipeline_context, bestrefs_list, ignore_cache=False, parameters_list=None):
+    """Batch form of cache_references() for a list of `bestrefs` dictionaries,  nominally
+    one per dataset,  which caches the union of the references they name at once.
+
+    Optional `parameters_list` gives the matching parameters of each `bestrefs`,  used
+    like the `parameters` of cache_references() to locate references in instrument
+    subdirectories,  so references are cached together per instrument.
+
+    Returns:   [ { reference_keyword :  reference_local_filepath ... }, ... ]
+    """
+    if parameters_list is None:
+        parameters_list = [None] * len(bestrefs_list)
+    wanted = {}    # { instrument : (parameters, [reference, ...]) }
+    for bestrefs, parameters in zip(bestrefs_list, parameters_list):
+        instrument = utils.header_to_instrument(parameters or {}, default="UNDEFINED")
+        wanted.setdefault(instrument, (parameters, []))[1].extend(_get_cache_filelist_and_report_errors(bestrefs))
+    localrefs = {}
+    for parameters, names in wanted.values():
+        names = sorted(set(names))
+        if config.S3_RETURN_URI:
+            localrefs.update({name: get_flex_uri(name) for name in names})
+        else:
+            localrefs.update(FileCacher(pipeline_context, ignore_cache, raise_exceptions=False,
+                                        parameters=parameters).get_local_files(names)[0])
+    return [_squash_unicode_in_bestrefs(bestrefs, localrefs) for bestrefs in bestrefs_list]
+
 
 def _get_cache_filelist_and_report_errors(bestrefs):
     """Compute the list of files to download based on the `bestrefs` dictionary,
@@ -7,6 +7,7 @@ import uuid
 import json
 import time
 import os
+import threading
 
 from urllib import request
 import html
@@ -35,6 +36,55 @@ init_urlopen()
 
 # ============================================================================
 
+# JSON RPC calls and file downloads share one pool of keep-alive HTTP connections
+# per process,  so repeated calls skip TCP and TLS connection setup.
+
+_HTTP_SESSION = None
+_HTTP_SESSION_PID = None
+_HTTP_SESSION_USED = 0.0
+_HTTP_SESSION_LOCK = threading.Lock()
+
+def get_http_session():
+    """Return the requests.Session which pools the keep-alive HTTP connections of
+    this process,  thread safe.  The session is replaced when it has gone unused for
+    CRDS_HTTP_IDLE_TIMEOUT seconds,  since servers close idle connections,  or when
+    it was created before this process forked.
+    """
+    global _HTTP_SESSION, _HTTP_SESSION_PID, _HTTP_SESSION_USED
+    with _HTTP_SESSION_LOCK:
+        now = time.monotonic()
+        if _HTTP_SESSION is not None:
+            if _HTTP_SESSION_PID != os.getpid():
+                _HTTP_SESSION = None    # connections belong to the parent process
+            elif now - _HTTP_SESSION_USED >= config.HTTP_IDLE_TIMEOUT.get():
+                _HTTP_SESSION.close()
+                _HTTP_SESSION = None
+        if _HTTP_SESSION is None:
+            _HTTP_SESSION = _new_http_session()
+            _HTTP_SESSION_PID = os.getpid()
+        _HTTP_SESSION_USED = now
+        return _HTTP_SESSION
+
+def _new_http_session():
+    """Return a new requests.Session keeping CRDS_HTTP_POOL_SIZE connections per host."""
+    import requests
+    session = requests.Session()
+    pool_size = max(config.HTTP_POOL_SIZE.get(), 1)
+    adapter = requests.adapters.HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+def close_http_session():
+    """Close the pooled HTTP connections of this process."""
+    global _HTTP_SESSION
+    with _HTTP_SESSION_LOCK:
+        if _HTTP_SESSION is not None and _HTTP_SESSION_PID == os.getpid():
+            _HTTP_SESSION.close()
+        _HTTP_SESSION = None
+
+# ============================================================================
+
 def apply_with_retries(func, *pars, **keys):
     """Apply function func() as f(*pargs, **keys) and return the result. Retry on any exception as defined in config.py"""
     retries = config.get_client_retry_count()
@@ -95,6 +145,17 @@ class CheckingProxy:
         return self.__class__.__name__ + "(url='%s', version='%s')" % \
             (self.__service_url, self.__version)
 
+    def _batch(self):
+        """Return a ServiceBatch context manager which collects the JSON RPC calls made
+        on it and sends them to the server in one request when the with block exits:
+
+        with S._batch() as batch:
+            info_map = batch.get_file_info_map("jwst", files, fields)
+            context = batch.get_default_context("jwst")
+        info_map.result(), context.result()
+        """
+        return ServiceBatch(self.__service_url, self.__version)
+
 class ServiceCallBinding:
     """When called,  ServiceCallBinding issues a JSONRPC call to the associated
     service URL.
@@ -152,8 +213,11 @@ class ServiceCallBinding:
         if not isinstance(parameters, bytes):
             parameters = parameters.encode("utf-8")
         try:
-            channel = request.urlopen(url, parameters, timeout=timeout)
-            return channel.read().decode("utf-8")
+            response = get_http_session().post(
+                url, data=parameters, timeout=timeout,
+                headers={"Content-Type" : "application/x-www-form-urlencoded"})
+            response.raise_for_status()
+            return response.content.decode("utf-8")
         except Exception as exc:
             raise exceptions.ServiceError("CRDS jsonrpc failure " + repr(self.__service_name) + " " + str(exc)) from exc
 
@@ -182,6 +246,144 @@ class ServiceCallBinding:
 
 # ============================================================================
 
+# Service URLs which rejected a JSON RPC batch,  their batched calls are made one at a time.
+_BATCH_REJECTED = set()
+
+class ServiceBatch:
+    """ServiceBatch records calls to undefined methods as BatchedCall's,  and when its
+    with block exits sends them as one JSON RPC 2.0 batch request.   If the server
+    rejects the batch,  the calls are made one at a time instead.
+
+    XXX NOTE: Always underscore new methods,  as for CheckingProxy.
+    """
+    def __init__(self, service_url, version='1.0'):
+        self.__version = str(version)
+        self.__service_url = service_url
+        self.__calls = []
+
+    def __getattr__(self, name):
+        """Return a callable which records a call to JSONRPC method `name`."""
+        binding = ServiceCallBinding(self.__service_url, name, self.__version)
+        def record(*args, **kwargs):
+            call = BatchedCall(binding, name, args, kwargs)
+            self.__calls.append(call)
+            return call
+        return record
+
+    def __repr__(self):
+        return self.__class__.__name__ + "(url='%s', calls=%d)" % \
+            (self.__service_url, len(self.__calls))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self._send()
+
+    def _send(self):
+        """Make the recorded calls,  as a batch unless the server has rejected batches."""
+        calls, self.__calls = self.__calls, []
+        if not calls:
+            return
+        url = self.__service_url
+        if url not in _BATCH_REJECTED and "serverless" not in url and "server-less" not in url:
+            try:
+                replies = self._call_batch(calls)
+            except exceptions.BatchRejectedError as exc:
+                log.verbose("CRDS JSON RPC batch rejected by", repr(url), ", calling one at a time:", str(exc))
+                _BATCH_REJECTED.add(url)
+            except Exception as exc:
+                for call in calls:
+                    call._fail(exc)
+                return
+            else:
+                for call in calls:
+                    call._resolve(replies[call.id])
+                return
+        for call in calls:
+            call._call()
+
+    def _call_batch(self, calls):
+        """Send `calls` as one JSON RPC 2.0 batch,  retried like single calls,  and return
+        { id : reply, ... }.   Raise BatchRejectedError if the server refuses the batch,
+        i.e. replies with an HTTP client error or anything but a reply for every call.
+        """
+        batch = [{"jsonrpc" : "2.0", "method" : call.name, "params" : call.params, "id" : call.id}
+                 for call in calls]
+        log.verbose("CRDS JSON RPC batch", [call.name for call in calls], "-->")
+        binding = ServiceCallBinding(self.__service_url, "batch", self.__version)
+        try:
+            response = apply_with_retries(binding._call_service, json.dumps(batch), self.__service_url)
+        except exceptions.ServiceError as exc:
+            status = getattr(getattr(exc.__cause__, "response", None), "status_code", None)
+            if status is not None and (400 <= status < 500 or status == 501):
+                raise exceptions.BatchRejectedError(str(exc)) from exc
+            raise
+        try:
+            replies = json.loads(response)
+        except ValueError as exc:
+            raise exceptions.BatchRejectedError("Invalid JSON RPC batch response: " + response[:200]) from exc
+        if not isinstance(replies, list):
+            raise exceptions.BatchRejectedError("Invalid JSON RPC batch response: " + response[:200])
+        replies = { reply.get("id") : reply for reply in replies if isinstance(reply, dict) }
+        missing = [call.id for call in calls if call.id not in replies]
+        if missing:
+            raise exceptions.BatchRejectedError("JSON RPC batch response is missing ids " + repr(missing))
+        return replies
+
+class BatchedCall:
+    """The pending result of a call to JSONRPC method `name` recorded by a ServiceBatch,
+    available from result() after the batch's with block exits.
+    """
+    def __init__(self, binding, name, args, kwargs):
+        self.binding = binding
+        self.name = name
+        self.args = args
+        self.kwargs = kwargs
+        self.params = kwargs if len(kwargs) else args
+        self.id = message_id()
+        self._done = False
+        self._result = None
+        self._exception = None
+
+    def __repr__(self):
+        return self.__class__.__name__ + "(method='%s', id='%s')" % (self.name, self.id)
+
+    def _resolve(self, reply):
+        """Set the result or exception of this call from its batch `reply`."""
+        error = reply.get("error")
+        if error:
+            message = error.get("message", str(error)) if isinstance(error, dict) else str(error)
+            self._exception = self.binding.classify_exception(html.unescape(message))
+        else:
+            self._result = crds_decode(reply.get("result"))
+        self._done = True
+
+    def _fail(self, exc):
+        """Set the exception of this call to `exc`,  the failure of its whole batch."""
+        self._exception = exc
+        self._done = True
+
+    def _call(self):
+        """Make this call by itself,  keeping its result or exception."""
+        try:
+            self._result = self.binding(*self.args, **self.kwargs)
+        except Exception as exc:
+            self._exception = exc
+        self._done = True
+
+    def result(self):
+        """Return the result of this call,  or raise its exception."""
+        if not self._done:
+            raise exceptions.ServiceError(
+                "Result of JSON RPC " + repr(self.name) + " requested before its batch was sent.")
+        if self._exception is not None:
+            raise self._exception
+        return self._result
+
+# ============================================================================
+
 # These operate transparently in the proxy and are optionally used by the server.
 #
 # This makes a new client with crds_decoder compatible with both encoding and
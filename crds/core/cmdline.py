@@ -802,6 +802,7 @@ class ContextsScript(Script):
         log.verbose("Getting and checking specified mappings.", verbosity=55)
 
         # Based on the specified mappings,  identify the  mappings they refer to
+        rmap.preload_mappings(mappings, ignore_cache=self.args.ignore_cache)
         mapping_closure = set()
         for mapping in mappings:
             with log.warn_on_exception("Failed loading context", repr(mapping)):
@@ -539,6 +539,10 @@ def get_crds_picklepath(observatory):
     """Return the directory name where CRDS stores pickles for `observatory`."""
     return _std_cache_path(observatory, "CRDS_PICKLEPATH", "pickles")
 
+def get_crds_rmap_store_path(observatory):
+    """Return the directory name where CRDS stores rmap selectors pickled by checksum for `observatory`."""
+    return os.path.join(get_crds_picklepath(observatory), "rmap_store")
+
 def locate_pickle(mapping, observatory=None):
     """Return the absolute path where reference `ref` should be located."""
     if os.path.dirname(mapping):
@@ -547,12 +551,98 @@ def locate_pickle(mapping, observatory=None):
         observatory = mapping_to_observatory(mapping)
     return os.path.join(get_crds_picklepath(observatory), mapping + ".pkl")
 
+def locate_context_image(mapping, observatory=None):
+    """Return the absolute path of the binary context image of `mapping`."""
+    if observatory is None:
+        observatory = mapping_to_observatory(mapping)
+    return os.path.join(get_crds_picklepath(observatory), os.path.basename(mapping) + ".img")
+
+def locate_match_index(mapping, observatory=None):
+    """Return the absolute path of the pickled reference match index of `mapping`."""
+    if observatory is None:
+        observatory = mapping_to_observatory(mapping)
+    return os.path.join(get_crds_picklepath(observatory), os.path.basename(mapping) + ".matches.pkl")
+
 USE_PICKLED_CONTEXTS = BooleanConfigItem("CRDS_USE_PICKLED_CONTEXTS", False,
     "When True,  CRDS contexts should be loaded from a pickled version if possible.")
 
 AUTO_PICKLE_CONTEXTS = BooleanConfigItem("CRDS_AUTO_PICKLE_CONTEXTS", False,
     "When True, CRDS contexts should be automatically pickled and cached after loading.")
 
+PICKLE_SHARDS = StrConfigItem("CRDS_PICKLE_SHARDS", "none",
+    "Layout of saved context pickles:  'none' for a single pickle,  'imap' for a small index plus one pickle per "
+    "instrument loaded on first use,  'rmap' to also split instruments into one pickle per rmap.",
+    valid_values=["none", "imap", "rmap"], lower=True, ini_section="performance")
+
+CACHE_MAPPING_CHECKSUMS = BooleanConfigItem("CRDS_CACHE_MAPPING_CHECKSUMS", False,
+    "When True,  the checksums of verified mapping files are recorded in the CRDS config directory keyed by path,  "
+    "size,  modification time,  and inode,  and unchanged mapping files skip checksum verification when loaded.",
+    ini_section="performance")
+
+FORCE_MAPPING_CHECKSUMS = BooleanConfigItem("CRDS_FORCE_MAPPING_CHECKSUMS", False,
+    "When True,  mapping checksums are always fully verified,  ignoring recorded checksums of unchanged files.",
+    ini_section="performance")
+
+MAPPING_LOAD_JOBS = IntConfigItem("CRDS_MAPPING_LOAD_JOBS", 1,
+    "Number of processes used to parse rmaps when many mappings are loaded at once,  as for crds sync --all,  "
+    "crds uses,  and regenerating context pickles.  0 uses one process per core.",
+    ini_section="performance")
+
+DOWNLOAD_JOBS = IntConfigItem("CRDS_DOWNLOAD_JOBS", 1,
+    "Number of threads which download files concurrently when syncing many files,  as for crds sync.",
+    ini_section="performance")
+
+SERVE_SOCKET = StrConfigItem("CRDS_SERVE_SOCKET", "none",
+    "Path of the Unix domain socket of a local 'crds serve' daemon which getreferences() and getrecommendations() "
+    "call instead of computing best references in process,  or 'none'.",
+    ini_section="performance")
+
+SERVE_TIMEOUT = IntConfigItem("CRDS_SERVE_TIMEOUT", 600,
+    "Seconds to wait for a 'crds serve' daemon to answer before computing best references in process.  "
+    "0 waits forever.",
+    ini_section="performance")
+
+USES_INDEX = BooleanConfigItem("CRDS_USES_INDEX", False,
+    "When True,  crds uses,  crds matches,  and certify find the mappings which refer to files using a sqlite3 "
+    "index in the CRDS config directory,  updated by crds sync,  rather than loading every mapping.",
+    ini_section="performance")
+
+CONTEXT_IMAGES = BooleanConfigItem("CRDS_CONTEXT_IMAGES", False,
+    "When True,  contexts are saved and loaded as memory mapped binary images instead of pickles,  so that processes "
+    "loading the same context share one copy of it and only decode the rmaps they use.",
+    ini_section="performance")
+
+COMPILE_RMAPS = BooleanConfigItem("CRDS_COMPILE_RMAPS", False,
+    "When True, rmap selector trees are compiled into specialized Python lookup code,  saved with context pickles.",
+    ini_section="performance")
+
+CACHE_MAXSIZE = IntConfigItem("CRDS_CACHE_MAXSIZE", 0,
+    "Default maximum number of results kept by each function cached with @utils.cached,  least recently used "
+    "results are evicted first.  0 is unbounded.",
+    ini_section="performance")
+
+CACHE_MAXBYTES = IntConfigItem("CRDS_CACHE_MAXBYTES", 0,
+    "Default maximum approximate bytes of results kept by each function cached with @utils.cached,  least recently "
+    "used results are evicted first.  0 is unbounded.",
+    ini_section="performance")
+
+BESTREFS_MEMO_SIZE = IntConfigItem("CRDS_BESTREFS_MEMO_SIZE", 1000,
+    "Maximum number of best reference results memoized per rmap,  keyed on lookup parameters.  0 disables.",
+    ini_section="performance")
+
+FAST_MAPPING_READER = BooleanConfigItem("CRDS_FAST_MAPPING_READER", True,
+    "When True, mappings are read by a dedicated parser for the mapping subset of Python,  when False they're verified and exec'ed.",
+    ini_section="performance")
+
+RMAP_STORE = BooleanConfigItem("CRDS_RMAP_STORE", False,
+    "When True, cached and pickled rmaps with identical contents share one selector in memory,  and saved "
+    "context pickles refer to rmap selectors stored once by checksum under <pickles>/rmap_store.",
+    ini_section="performance")
+
+LAZY_RMAPS = BooleanConfigItem("CRDS_LAZY_RMAPS", False,
+    "When True, only rmap headers are parsed at load time,  selectors are parsed on first use.",
+    ini_section="performance")
+
 # -------------------------------------------------------------------------------------
 
 FORCE_COMPLETE_LOAD = BooleanConfigItem("CRDS_FORCE_COMPLETE_LOAD", False,
@@ -787,6 +877,20 @@ CLIENT_TIMEOUT = IntConfigItem(
 def get_client_timeout_seconds():
     return CLIENT_TIMEOUT.get()
 
+HTTP_POOL_SIZE = IntConfigItem("CRDS_HTTP_POOL_SIZE", 10,
+    "Maximum number of idle keep-alive connections per host kept for reuse by JSON RPC calls and file downloads.",
+    ini_section="performance")
+
+RPC_BATCH_SIZE = IntConfigItem("CRDS_RPC_BATCH_SIZE", 4,
+    "Number of segmented JSON RPC calls,  e.g. dataset header dumps,  sent to the server in one batch request.  "
+    "1 sends each call by itself.",
+    ini_section="performance")
+
+HTTP_IDLE_TIMEOUT = IntConfigItem("CRDS_HTTP_IDLE_TIMEOUT", 30,
+    "Seconds pooled keep-alive HTTP connections may go unused before they are closed rather than reused.  "
+    "0 opens new connections for every request.",
+    ini_section="performance")
+
 def enable_retries(retry_count=20, delay_seconds=10):
     """Set reasonable defaults for CRDS retries"""
     CLIENT_RETRY_COUNT.set(retry_count)
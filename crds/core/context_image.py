@@ -0,0 +1,330 @@
+"""Defines a compact binary "context image" of the closure of a CRDS context which
+is memory mapped read-only when loaded,  so that every process on a host which
+loads the same context shares one page cache copy of it instead of unpickling a
+private copy.
+
+An image consists of flat buffers:
+
+- a header of counts and a byte order mark
+
+- a string table of UTF-8 strings addressed by index
+
+- an int32 cell array holding the tagged values of every mapping header,  comment,
+  and selector in prefix order,  including the selections of rmap Match and
+  UseAfter tables,  with strings referred to by string table index
+
+- an entry table locating each mapping by name within the cell array
+
+Loading an image only builds the mapping objects of contexts and the headers of
+rmaps as they are accessed.   The selector of each rmap is decoded from the
+shared buffers and instantiated on first use,  so processes only hold private
+copies of the rmaps they actually use.
+
+>>> import os.path
+>>> path = os.path.join(os.path.dirname(__file__), "..", "..", "test", "data", "hst", "hst_cos_flatfile.rmap")
+>>> image = ContextImage.from_bytes(dumps_image(path))
+>>> flatfile = image.load(path)
+>>> flatfile.selector_is_loaded()
+False
+>>> flatfile.reference_names()
+['v2e20129l_flat.fits', 'v3n1816ml_flat.fits', 'v4s17227l_flat.fits']
+"""
+import sys
+import mmap
+import array
+import struct
+
+from . import config, log, utils, rmap, selectors, mapping_reader
+from . import exceptions as crexc
+
+# ===================================================================
+
+MAGIC = b"CRDSIMG1"
+BYTE_ORDER_MARK = 0x01020304
+
+HEADER = struct.Struct("=8sIIII")   # magic,  byte order mark,  #strings,  #cells,  #entries
+
+# Each entry is:  name string,  header cell,  selector cell,  end cell,  checksum string.
+# The header is followed by the comment,  the selector by the next entry.
+ENTRY_SIZE = 5
+
+# Value tags of the cell array,  each followed by the cells listed.
+NONE, TRUE, FALSE = 0, 1, 2
+STR = 3         # string index
+INT = 4         # int32 value
+BIGINT = 5      # string index of repr()
+FLOAT = 6       # string index of repr()
+TUPLE = 7       # count,  items...
+LIST = 8        # count,  items...
+DICT = 9        # count,  key,  value,  ...
+SELECTOR = 10   # string index of SELECTORS name,  dict or list of selections
+
+PARAMETERS_NAMES = { parameters : name for (name, parameters) in selectors.SELECTORS.items() }
+
+MAPPING_CLASSES = {
+    "pipeline" : rmap.PipelineContext,
+    "instrument" : rmap.InstrumentContext,
+    "reference" : rmap.ReferenceMapping,
+}
+
+# ===================================================================
+
+class _ImageWriter:
+    """Accumulates the string table,  cells,  and entries of a context image."""
+
+    def __init__(self):
+        self.string_index = {}
+        self.strings = []
+        self.cells = array.array("i")
+        self.entries = array.array("i")
+        self.names = set()
+
+    def string(self, value):
+        """Return the string table index of `value`,  adding it if needed."""
+        index = self.string_index.get(value)
+        if index is None:
+            index = self.string_index[value] = len(self.strings)
+            self.strings.append(value.encode("utf-8"))
+        return index
+
+    def encode(self, value):
+        """Append the cells of mapping `value` to the cell array."""
+        cells = self.cells
+        if value is None:
+            cells.append(NONE)
+        elif value is True:
+            cells.append(TRUE)
+        elif value is False:
+            cells.append(FALSE)
+        elif isinstance(value, str):
+            cells.extend((STR, self.string(value)))
+        elif isinstance(value, int):
+            if -2**31 <= value < 2**31:
+                cells.extend((INT, value))
+            else:
+                cells.extend((BIGINT, self.string(repr(value))))
+        elif isinstance(value, float):
+            cells.extend((FLOAT, self.string(repr(value))))
+        elif isinstance(value, (tuple, list)):
+            cells.extend((TUPLE if isinstance(value, tuple) else LIST, len(value)))
+            for item in value:
+                self.encode(item)
+        elif isinstance(value, dict):
+            cells.extend((DICT, len(value)))
+            for key, item in value.items():
+                self.encode(key)
+                self.encode(item)
+        elif isinstance(value, selectors.Parameters):
+            cells.extend((SELECTOR, self.string(PARAMETERS_NAMES[type(value)])))
+            selections = value.selections
+            self.encode(selections if isinstance(selections, list) else dict(selections))
+        else:
+            raise crexc.FileFormatError("Can't store value", repr(value), "in a context image.")
+
+    def add_mapping(self, name, observatory):
+        """Add the mapping `name` and the closure of mappings it refers to."""
+        if name in self.names:
+            return
+        self.names.add(name)
+        text = utils.get_uri_content(config.locate_mapping(name, observatory))
+        namespace = mapping_reader.read_mapping(text)
+        checksum = rmap.Mapping._get_checksum(text)
+        rmap.Mapping._verify_checksum(name, namespace["header"], checksum)
+        header_cell = len(self.cells)
+        self.encode(namespace["header"])
+        self.encode(namespace.get("comment", None))
+        selector_cell = len(self.cells)
+        self.encode(namespace["selector"])
+        self.entries.extend((self.string(name), header_cell, selector_cell, len(self.cells),
+                             self.string(checksum)))
+        if isinstance(namespace["selector"], dict):
+            for nested in namespace["selector"].values():
+                if nested not in rmap.MappingSelectionsDict.special_values_set:
+                    self.add_mapping(nested, observatory)
+
+    def dumps(self):
+        """Return the bytes of the image."""
+        offsets = array.array("I", [0])
+        for encoded in self.strings:
+            offsets.append(offsets[-1] + len(encoded))
+        return b"".join([
+            HEADER.pack(MAGIC, BYTE_ORDER_MARK, len(self.strings), len(self.cells), len(self.names)),
+            offsets.tobytes(),
+            self.cells.tobytes(),
+            self.entries.tobytes(),
+        ] + self.strings)
+
+def dumps_image(mapping, observatory=None):
+    """Return the bytes of the context image of `mapping` and all the mappings
+    it refers to,  read from the CRDS cache.
+    """
+    writer = _ImageWriter()
+    writer.add_mapping(mapping, observatory)
+    return writer.dumps()
+
+# ===================================================================
+
+class ContextImage:
+    """A context image loaded from a buffer,  nominally a read-only memory map
+    of an image file.   load() returns mappings whose nested mappings and rmap
+    selectors are decoded from the image on first use.
+    """
+    def __init__(self, buffer, path=None):
+        self.path = path
+        self._buffer = buffer
+        view = memoryview(buffer)
+        if len(view) < HEADER.size:
+            raise crexc.FileFormatError("Context image", repr(path), "is truncated.")
+        magic, order, nstrings, ncells, nentries = HEADER.unpack_from(view)
+        if magic != MAGIC or order != BYTE_ORDER_MARK:
+            raise crexc.FileFormatError("Context image", repr(path), "has an unsupported format or byte order.")
+        position = HEADER.size
+        self._offsets = view[position:position + 4*(nstrings + 1)].cast("I")
+        position += 4*(nstrings + 1)
+        self._cells = view[position:position + 4*ncells].cast("i")
+        position += 4*ncells
+        entries = view[position:position + 4*ENTRY_SIZE*nentries].cast("i")
+        position += 4*ENTRY_SIZE*nentries
+        self._blob = view[position:]
+        if len(self._blob) != self._offsets[-1]:
+            raise crexc.FileFormatError("Context image", repr(path), "is truncated.")
+        self._strings = [None] * nstrings
+        self._entries = {
+            self.string(entries[i]) : tuple(entries[i+1:i+ENTRY_SIZE])
+            for i in range(0, len(entries), ENTRY_SIZE)
+        }
+
+    @classmethod
+    def from_file(cls, path):
+        """Memory map the image file at `path` read-only and return its ContextImage."""
+        with open(path, "rb") as handle:
+            return cls(mmap.mmap(handle.fileno(), 0, access=mmap.ACCESS_READ), path)
+
+    @classmethod
+    def from_bytes(cls, image):
+        """Return the ContextImage of the bytes `image`,  mainly for testing."""
+        return cls(image)
+
+    def __repr__(self):
+        return self.__class__.__name__ + "(" + repr(self.path) + ")"
+
+    def __getstate__(self):
+        """Mappings loaded from files pickle with the path of their image,  not its contents."""
+        if self.path is None:
+            return { "buffer" : bytes(self._buffer) }
+        return { "path" : self.path }
+
+    def __setstate__(self, state):
+        if "path" in state:
+            self.__dict__ = ContextImage.from_file(state["path"]).__dict__
+        else:
+            self.__init__(state["buffer"])
+
+    def mapping_names(self):
+        """Return the names of all mappings in the image."""
+        return sorted(self._entries)
+
+    def string(self, index):
+        """Return string `index` of the string table,  decoding it once."""
+        value = self._strings[index]
+        if value is None:
+            value = self._strings[index] = sys.intern(
+                str(self._blob[self._offsets[index]:self._offsets[index+1]], "utf-8"))
+        return value
+
+    def decode(self, start, end):
+        """Return the list of values stored in cells `start` through `end`."""
+        cells = self._cells[start:end].tolist()
+        values = []
+        position = 0
+        while position < len(cells):
+            value, position = self._decode(cells, position)
+            values.append(value)
+        return values
+
+    def _decode(self, cells, position):
+        """Return (value, next_position) for the value stored at `position` of `cells`."""
+        tag = cells[position]
+        if tag == STR:
+            return self.string(cells[position+1]), position + 2
+        elif tag == INT:
+            return cells[position+1], position + 2
+        elif tag == TUPLE or tag == LIST:
+            count, position = cells[position+1], position + 2
+            items = []
+            for _i in range(count):
+                item, position = self._decode(cells, position)
+                items.append(item)
+            return (tuple(items) if tag == TUPLE else items), position
+        elif tag == DICT:
+            count, position = cells[position+1], position + 2
+            items = {}
+            for _i in range(count):
+                key, position = self._decode(cells, position)
+                items[key], position = self._decode(cells, position)
+            return items, position
+        elif tag == SELECTOR:
+            name = self.string(cells[position+1])
+            selections, position = self._decode(cells, position + 2)
+            return selectors.SELECTORS[name](selections), position
+        elif tag == NONE:
+            return None, position + 1
+        elif tag == TRUE:
+            return True, position + 1
+        elif tag == FALSE:
+            return False, position + 1
+        elif tag == BIGINT:
+            return int(self.string(cells[position+1])), position + 2
+        elif tag == FLOAT:
+            return float(self.string(cells[position+1])), position + 2
+        raise crexc.FileFormatError("Context image", repr(self.path), "has invalid tag", tag, "at cell", position)
+
+    def load(self, name, **keys):
+        """Return a new Mapping for `name` loaded from this image.   The nested mappings
+        of contexts are also loaded from this image when they are first accessed.
+        """
+        try:
+            header_cell, selector_cell, end_cell, checksum = self._entries[name]
+        except KeyError:
+            raise crexc.MappingError("Mapping", repr(name), "is not in context image", repr(self.path)) from None
+        keys.pop("comment", None)
+        keys["loader"] = self.load
+        with log.augment_exception("Can't load", repr(name), "from context image", repr(self.path),
+                                   exception_class=crexc.MappingError):
+            header, comment = self.decode(header_cell, selector_cell)
+            header = rmap.LowerCaseDict(header)
+            cls = MAPPING_CLASSES[header["mapping"].lower()]
+            checksum = self.string(checksum)
+            if cls is rmap.ReferenceMapping:
+                selector = ImageSelector(self, selector_cell, end_cell, name,
+                                         checksum if config.RMAP_STORE else None)
+            else:
+                selector = cls._instantiate(self.decode(selector_cell, end_cell)[0], header)
+            mapping = cls(name, header, selector, comment=comment, **keys)
+        mapping._content_checksum = checksum
+        return mapping
+
+class ImageSelector(rmap.DeferredSelector):
+    """The selector of an rmap loaded from a ContextImage,  decoded from the image and
+    instantiated by ReferenceMapping.selector on first use.
+    """
+    def __init__(self, image, start, end, where, checksum=None):
+        self.image = image
+        self.start = start
+        self.end = end
+        self.where = where
+        self.checksum = checksum
+
+    def read(self):
+        return self.image.decode(self.start, self.end)[0]
+
+# ===================================================================
+
+def test():
+    """Run module doctests."""
+    import doctest
+    from crds.core import context_image
+    return doctest.testmod(context_image)
+
+if __name__ == "__main__":
+    print(test())
@@ -180,6 +180,13 @@ class LazyFileDict(TransformedDict):
         """
         return [self[key] for key in self.normal_keys()]
 
+    def loaded_values(self):
+        """Return the values which have already been demand loaded.
+
+        NOTE:  Does not require full load.
+        """
+        return list(self._contents.values())
+
     def special_values(self):
         """These are values which must be trapped and reformatted in the Mapping classes."""
         return [self[key] for key in self.special_keys()]
@@ -19,6 +19,12 @@ class StatusChannelNotFoundError(ServiceError):
 class OwningProcessAbortedError(ServiceError):
     """An abort request was recieved on the specified channel."""
 
+class ServeUnavailableError(ServiceError):
+    """The local crds serve daemon could not be contacted."""
+
+class BatchRejectedError(ServiceError):
+    """The CRDS server refused a JSON RPC batch request."""
+
 # -------------------------------------------------------------------------------------------
 
 class CrdsConfigError(CrdsError):
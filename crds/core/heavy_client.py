@@ -48,6 +48,7 @@ cache sync operations.  This module provides some of the fall back mechanisms
 necessary for operating without a server connection at all.
 """
 import os
+import io
 import pprint
 import ast
 import traceback
@@ -57,10 +58,10 @@ import pickle
 
 # ============================================================================
 
-from . import rmap, log, utils, config
+from . import rmap, log, utils, config, context_image, serve
 from .constants import ALL_OBSERVATORIES
 from .log import srepr
-from .exceptions import CrdsError, CrdsBadRulesError, CrdsBadReferenceError, CrdsConfigError, CrdsDownloadError, CrdsNetworkError, ServiceError
+from .exceptions import CrdsError, CrdsBadRulesError, CrdsBadReferenceError, CrdsConfigError, CrdsDownloadError, CrdsNetworkError, ServiceError, ServeUnavailableError
 from crds.client import api
 
 # import crds  # forward
@@ -69,6 +70,7 @@ from crds.client import api
 
 __all__ = [
     "getreferences", "getrecommendations",
+    "getreferences_many", "getrecommendations_many",
     "get_config_info", "update_config_info", "load_server_info",
     "get_processing_mode", "get_context_name",
     "version_info",
@@ -118,7 +120,13 @@ def getreferences(parameters, reftypes=None, context=None, ignore_cache=False,
 
       returns a mapping from types requested in `reftypes` to the path for each
       cached reference file.
+
+    When CRDS_SERVE_SOCKET is set,  the call is answered by that crds serve daemon.
     """
+    served = _call_server("getreferences", parameters, reftypes, context, ignore_cache, observatory, fast)
+    if served is not None:
+        return served
+
     final_context, bestrefs = _initial_recommendations("getreferences",
         parameters, reftypes, context, ignore_cache, observatory, fast)
 
@@ -168,12 +176,77 @@ def getrecommendations(parameters, reftypes=None, context=None, ignore_cache=Fal
 
       returns a mapping from types requested in `reftypes` to the path for each
       cached reference file.
+
+    When CRDS_SERVE_SOCKET is set,  the call is answered by that crds serve daemon.
     """
+    served = _call_server("getrecommendations", parameters, reftypes, context, ignore_cache, observatory, fast)
+    if served is not None:
+        return served
+
     _final_context, bestrefs = _initial_recommendations("getrecommendations",
         parameters, reftypes, context, ignore_cache, observatory, fast)
 
     return bestrefs
 
+def getreferences_many(parameters_list, reftypes=None, context=None, ignore_cache=False,
+                       observatory="jwst", fast=False):
+    """
+    Batch form of getreferences() for a list of `parameters` dictionaries,  nominally
+    the matching parameters of many datasets assigned references from one context.
+
+    The context is resolved and the arguments are checked once,  best references are
+    computed once for each distinct minimized header,  and the union of the recommended
+    references is cached in a single pass.   Other arguments are as for getreferences().
+
+    Returns [ { reftype : cached_bestref_path }, ... ]
+
+      returns one getreferences() result for each item of `parameters_list`.
+    """
+    final_context, bestrefs_list, parameters_list = _initial_recommendations_many("getreferences_many",
+        parameters_list, reftypes, context, ignore_cache, observatory, fast)
+
+    return api.cache_references_many(
+        final_context, bestrefs_list, ignore_cache=ignore_cache, parameters_list=parameters_list)
+
+def getrecommendations_many(parameters_list, reftypes=None, context=None, ignore_cache=False,
+                            observatory="jwst", fast=False):
+    """
+    Batch form of getrecommendations() for a list of `parameters` dictionaries,  see
+    getreferences_many().   Files are not cached.
+
+    Returns [ { reftype : bestref_basename }, ... ]
+
+      returns one getrecommendations() result for each item of `parameters_list`.
+    """
+    _final_context, bestrefs_list, _parameters_list = _initial_recommendations_many("getrecommendations_many",
+        parameters_list, reftypes, context, ignore_cache, observatory, fast)
+
+    return bestrefs_list
+
+def _call_server(name, parameters, reftypes, context, ignore_cache, observatory, fast):
+    """Return the result of calling `name` on the crds serve daemon named by
+    CRDS_SERVE_SOCKET,  or None if it isn't set,  can't be contacted,  or uses a
+    different CRDS server or cache than this process.
+
+    The context is resolved here,  so CRDS_CONTEXT and symbolic contexts mean what
+    they would for an in process computation.
+    """
+    client = serve.get_client()
+    if client is None:
+        return None
+    try:
+        if not client.matches_environment(observatory):
+            log.verbose("crds serve daemon at", repr(client.socket_path),
+                        "uses a different CRDS server or cache:  computing best references in process.")
+            return None
+        final_context = get_processing_mode(observatory, context)[1]
+        return client.call(name, parameters=check_parameters(parameters),
+                           reftypes=reftypes,
+                           context=final_context, ignore_cache=ignore_cache, observatory=observatory, fast=fast)
+    except ServeUnavailableError as exc:
+        log.verbose_warning(str(exc), ":  computing best references in process.")
+        return None
+
 def _initial_recommendations(
         name, parameters, reftypes=None, context=None, ignore_cache=False, observatory="jwst", fast=False):
 
@@ -231,6 +304,73 @@ def _initial_recommendations(
 
     return final_context, bestrefs
 
+def _initial_recommendations_many(
+        name, parameters_list, reftypes=None, context=None, ignore_cache=False, observatory="jwst", fast=False):
+
+    """shared logic for getreferences_many() and getrecommendations_many().
+
+    Returns (final_context, bestrefs_list, parameters_list) where `parameters_list` is
+    the checked `parameters_list`,  unchecked when `fast` is True.
+    """
+
+    parameters_list = list(parameters_list)
+
+    if not fast:
+        log.verbose("="*120)
+        log.verbose(name + "() CRDS version: ", version_info())
+        log.verbose(name + "() server:", api.get_crds_server())
+        log.verbose(name + "() observatory:", observatory)
+        log.verbose(name + "() parameters:", len(parameters_list), "headers")
+        log.verbose(name + "() reftypes:", reftypes)
+        log.verbose(name + "() context:", repr(context))
+        log.verbose(name + "() ignore_cache:", ignore_cache)
+
+        check_observatory(observatory)
+        parameters_list = [check_parameters(parameters) for parameters in parameters_list]
+        check_reftypes(reftypes)
+        check_context(context)
+
+    checked_list = parameters_list
+    if observatory == "roman":
+        obs_pkg = utils.get_locator_module(observatory)
+        parameters_list = [obs_pkg.dataset_to_ref_header(parameters) for parameters in parameters_list]
+
+    mode, final_context = get_processing_mode(observatory, context)
+
+    log.verbose("Final effective context is", repr(final_context))
+
+    if mode in ["local", "s3"]:
+        log.verbose("Computing best references locally.")
+        bestrefs_list = local_bestrefs_many(
+            parameters_list, reftypes=reftypes, context=final_context, ignore_cache=ignore_cache)
+    else:
+        log.verbose("Computing best references remotely.")
+        bestrefs_list = remote_bestrefs_many(observatory, final_context, parameters_list, reftypes)
+
+    if not fast:
+        update_config_info(observatory)
+        for parameters, bestrefs in zip(parameters_list, bestrefs_list):
+            instrument = utils.header_to_instrument(parameters)
+            warn_bad_context(observatory, final_context, instrument)
+            warn_bad_references(observatory, bestrefs)
+
+    return final_context, bestrefs_list, checked_list
+
+def remote_bestrefs_many(observatory, context, parameters_list, reftypes):
+    """Compute best references for each of `parameters_list` on the server,  sending
+    as many headers per call as the server allows.   Like api.get_best_references(),
+    header keys and values are sent as strings.
+    """
+    segment_size = get_config_info(observatory).get("max_headers_per_rpc", 500)
+    bestrefs_list = []
+    for start in range(0, len(parameters_list), segment_size):
+        segment = parameters_list[start:start+segment_size]
+        header_map = { str(i) : { str(key) : str(value) for (key, value) in parameters.items() }
+                       for (i, parameters) in enumerate(segment) }
+        bestrefs_map = api.get_best_references_by_header_map(context, header_map, reftypes=reftypes)
+        bestrefs_list.extend(bestrefs_map[str(i)] for i in range(len(segment)))
+    return bestrefs_list
+
 # ============================================================================
 
 # This is cached because it should only produce output *once* per program run.
@@ -361,6 +501,22 @@ def local_bestrefs(parameters, reftypes, context, ignore_cache=False):
                 "Failed caching mapping files:", str(exc)) from exc
         return hv_best_references(context, parameters, reftypes)
 
+def local_bestrefs_many(parameters_list, reftypes, context, ignore_cache=False):
+    """Batch form of local_bestrefs() for a list of `parameters` dictionaries."""
+    try:
+        if ignore_cache:
+            raise IOError("explicitly ignoring cache.")
+        return hv_best_references_many(context, parameters_list, reftypes)
+    except IOError as exc:
+        log.verbose("Caching mapping files for context", srepr(context))
+        try:
+            api.dump_mappings(context, ignore_cache=ignore_cache)
+        except CrdsError as exc:
+            traceback.print_exc()
+            raise CrdsDownloadError(
+                "Failed caching mapping files:", str(exc)) from exc
+        return hv_best_references_many(context, parameters_list, reftypes)
+
 # =============================================================================
 
 def hv_best_references(context_file, header, include=None, condition=True):
@@ -371,15 +527,40 @@ def hv_best_references(context_file, header, include=None, condition=True):
     filekinds listed in `include`.
     """
     ctx = get_symbolic_mapping(context_file, cached=True)
+    minheader, include = _minimize_header(ctx, context_file, header, include, condition)
+    log.verbose("Bestrefs header:\n", log.PP(minheader))
+    return ctx.get_best_references(minheader, include=include)
+
+def hv_best_references_many(context_file, headers, include=None, condition=True):
+    """Batch form of hv_best_references() for a list of `headers`,  computing the
+    best references of each distinct minimized header once.
+
+    Returns [ { filekind : bestref, ... }, ... ]  one per header of `headers`.
+    """
+    ctx = get_symbolic_mapping(context_file, cached=True)
+    computed = {}
+    bestrefs_list = []
+    for header in headers:
+        minheader, header_include = _minimize_header(ctx, context_file, header, include, condition)
+        key = (tuple(sorted(minheader.items())), tuple(sorted(header_include)))
+        if key not in computed:
+            log.verbose("Bestrefs header:\n", log.PP(minheader))
+            computed[key] = ctx.get_best_references(minheader, include=header_include)
+        bestrefs_list.append(dict(computed[key]))
+    log.verbose("Computed best references for", len(computed), "distinct headers of", len(bestrefs_list))
+    return bestrefs_list
+
+def _minimize_header(ctx, context_file, header, include, condition):
+    """Return the (minimized header,  filekinds to include) for computing the best
+    references of `header` with loaded context `ctx`.
+    """
     conditioned = utils.condition_header(header) if condition else header
     if include is None:
         # requires conditioned header,  or compatible header
         include = set(ctx.locate.header_to_reftypes(conditioned, context_file))
         ctx_filekinds = set(ctx.get_filekinds(conditioned))
         include = list(ctx_filekinds & include)
-    minheader = ctx.minimize_header(conditioned)
-    log.verbose("Bestrefs header:\n", log.PP(minheader))
-    return ctx.get_best_references(minheader, include=include)
+    return ctx.minimize_header(conditioned), include
 
 # ============================================================================
 
@@ -738,38 +919,180 @@ def load_pickled_mapping(mapping):
     located in the CRDS cache.
 
     Although pickles for sub-mappings may exist, only the highest level pickle
-    in the hierarchy is read.  In general pickles for sub-mappings should not
-    exist because of storage waste.
+    in the hierarchy is read.   Sub-mapping pickles are only read on demand,  when
+    the highest level pickle is a sharded index saved with CRDS_PICKLE_SHARDS.
+
+    With CRDS_CONTEXT_IMAGES the context is instead loaded from its memory mapped
+    binary image,  see load_context_image().
     """
+    if config.CONTEXT_IMAGES:
+        return load_context_image(mapping)
+    loaded = _load_pickle(mapping)
+    log.info("Loaded pickled context", repr(mapping))
+    return loaded
+
+def _load_pickle(mapping):
+    """Return the unpickled contents of the pickle for `mapping`."""
     pickle_uri = config.get_uri(mapping + ".pkl")
     if pickle_uri == "none":
         pickle_uri = config.locate_pickle(mapping)
     pickled = utils.get_uri_content(pickle_uri, mode="binary")
-    loaded = pickle.loads(pickled)
-    log.info("Loaded pickled context", repr(mapping))
+    return _MappingUnpickler(io.BytesIO(pickled)).load()
+
+def load_pickled_shard(mapping, **keys):
+    """Loader for the selections of sharded context pickles which loads the pickle of
+    sub-mapping `mapping` on first access,  or loads `mapping` from the cache if its
+    pickle can't be loaded.
+    """
+    try:
+        loaded = _load_pickle(os.path.basename(mapping))
+    except Exception as exc:
+        log.verbose("Loading pickle shard for", repr(mapping), "failed,  loading mapping instead :", str(exc))
+        keys.pop("loader", None)
+        return rmap.get_cached_mapping(mapping, **keys)
+    log.verbose("Loaded pickle shard", repr(mapping))
     return loaded
 
 def save_pickled_mapping(mapping, loaded):
-    """Save live mapping `loaded` as a pickle under named based on `mapping` name."""
+    """Save live mapping `loaded` as a pickle under named based on `mapping` name.
+
+    With CRDS_PICKLE_SHARDS=imap the pickle of a context is an index which defers loading
+    each instrument to that instrument's own pickle.   With CRDS_PICKLE_SHARDS=rmap each
+    instrument pickle likewise defers to one pickle per rmap.   Since mappings are never
+    changed once named,  shards are shared between contexts and never rewritten.
+
+    With CRDS_CONTEXT_IMAGES a binary context image is saved instead of a pickle.
+    """
+    if config.CONTEXT_IMAGES:
+        return save_context_image(mapping, loaded)
     pickle_file = config.locate_pickle(mapping)
     if not utils.is_writable(pickle_file):  # Don't even bother pickling
         log.verbose("Pickle file", repr(pickle_file), "is not writable,  skipping pickle save.")
         return
     with log.verbose_warning_on_exception("Failed saving pickle for", repr(mapping), "to", repr(pickle_file)):
         loaded.force_load()
-        pickled = pickle.dumps(loaded)
-        cache_atomic_write(pickle_file, pickled, "CONTEXT PICKLE")
+        _save_pickle(pickle_file, loaded, str(config.PICKLE_SHARDS))
         log.info("Saved pickled context", repr(pickle_file))
 
+def _save_pickle(pickle_file, loaded, shards):
+    """Pickle `loaded` to `pickle_file`,  first saving any missing shards of `loaded`
+    as determined by the CRDS_PICKLE_SHARDS value `shards`.
+    """
+    if shards == "none" or isinstance(loaded, rmap.ReferenceMapping) or (
+            shards == "imap" and isinstance(loaded, rmap.InstrumentContext)):
+        pickled = _dumps_mapping(loaded)
+    else:
+        for nested in loaded.selections.normal_values():
+            shard_file = config.locate_pickle(nested.basename, loaded.observatory)
+            if not os.path.exists(shard_file):
+                _save_pickle(shard_file, nested, shards)
+                log.verbose("Saved pickle shard", repr(shard_file))
+        pickled = _dumps_mapping(loaded, loaded.selections)
+    cache_atomic_write(pickle_file, pickled, "CONTEXT PICKLE")
+
+def _dumps_mapping(loaded, shard_index=None):
+    """Return the pickle of `loaded`.   If `shard_index` is the selections of `loaded`,
+    its loaded sub-mappings are omitted and instead loaded from their own pickles by
+    load_pickled_shard() on first access.
+    """
+    output = io.BytesIO()
+    _MappingPickler(output, shard_index, bool(config.RMAP_STORE)).dump(loaded)
+    return output.getvalue()
+
+def _locate_stored_selector(observatory, checksum):
+    """Return the path of the pickled selector of rmaps with contents `checksum`."""
+    return os.path.join(config.get_crds_rmap_store_path(observatory), checksum + ".pkl")
+
+class _MappingPickler(pickle.Pickler):
+    """Pickles mappings.   If `shard_index` is a MappingSelectionsDict,  it is pickled as
+    its selection names and load keys only,  switching its loader to load_pickled_shard().
+    If `store` is True,  the selectors of rmaps are pickled once per rmap checksum in the
+    rmap store and referred to by checksum.
+    """
+    def __init__(self, file, shard_index=None, store=False):
+        super(_MappingPickler, self).__init__(file)
+        self.shard_index = shard_index
+        self.store = store
+        self.stored_selectors = {}
+
+    def reducer_override(self, obj):
+        if obj is not self.shard_index:
+            return NotImplemented
+        load_keys = dict(obj._xx_load_keys, loader=load_pickled_shard)
+        return (rmap.MappingSelectionsDict, (dict(obj._xx_selector), load_keys))
+
+    def persistent_id(self, obj):
+        if not self.store:
+            return None
+        if isinstance(obj, rmap.ReferenceMapping):
+            checksum = getattr(obj, "_content_checksum", None)
+            if checksum is not None and obj.selector_is_loaded():
+                self.stored_selectors[id(obj._selector)] = (obj.observatory, checksum)
+            return None
+        stored = self.stored_selectors.get(id(obj))
+        if stored is None:
+            return None
+        observatory, checksum = stored
+        selector_file = _locate_stored_selector(observatory, checksum)
+        if not os.path.exists(selector_file):
+            cache_atomic_write(selector_file, pickle.dumps(obj), "RMAP STORE")
+        return ("rmap_store", observatory, checksum)
+
+class _MappingUnpickler(pickle.Unpickler):
+    """Unpickles mappings,  loading rmap selectors referred to by checksum from
+    rmap.RMAP_STORE or the rmap store in the CRDS cache.
+    """
+    def persistent_load(self, pid):
+        kind, observatory, checksum = pid
+        if kind != "rmap_store":
+            raise pickle.UnpicklingError("Unsupported persistent id " + repr(pid))
+        selector = rmap.RMAP_STORE.get(checksum)
+        if selector is None:
+            pickled = utils.get_uri_content(_locate_stored_selector(observatory, checksum), mode="binary")
+            selector = rmap.RMAP_STORE.put(checksum, pickle.loads(pickled))
+        return selector
+
+def load_context_image(mapping):
+    """Load `mapping` from its binary context image in the CRDS cache,  memory mapping
+    the image read-only so it is shared by all the processes on a host which load it.
+    Nested mappings and rmap selectors are decoded from the image on first use.
+    """
+    image = context_image.ContextImage.from_file(config.locate_context_image(mapping))
+    loaded = image.load(os.path.basename(mapping))
+    log.info("Loaded context image", repr(mapping))
+    return loaded
+
+def save_context_image(mapping, loaded):
+    """Save the binary context image of `mapping` and its closure in the CRDS cache,
+    reading the mapping files of live mapping `loaded`.
+    """
+    image_file = config.locate_context_image(mapping, loaded.observatory)
+    if not utils.is_writable(image_file):
+        log.verbose("Context image", repr(image_file), "is not writable,  skipping image save.")
+        return
+    with log.verbose_warning_on_exception("Failed saving context image for", repr(mapping), "to", repr(image_file)):
+        cache_atomic_write(image_file, context_image.dumps_image(os.path.basename(mapping), loaded.observatory),
+                           "CONTEXT IMAGE")
+        log.info("Saved context image", repr(image_file))
+
 def remove_pickled_mapping(mapping):
-    """Delete the pickle for `mapping` from the CRDS cache."""
+    """Delete the pickle,  context image,  and match index for `mapping` from the CRDS cache.
+
+    The pickle shards and stored rmap selectors of the mappings `mapping` refers to are
+    generally shared with other contexts,  so they are only removed by crds sync --clear-pickles.
+    """
     pickle_file = config.locate_pickle(mapping)
     if not utils.is_writable(pickle_file):  # Don't even bother pickling
         log.verbose("Pickle file", repr(pickle_file), "is not writable,  skipping pickle remove.")
         return
-    if not os.path.exists(pickle_file):
-        log.verbose("Pickl file", repr(pickle_file), "does not exist,  skipping pickle remove.")
-        return
-    with log.warn_on_exception("Failed removing pickle for", repr(mapping)):
-        os.remove(pickle_file)
-        log.info("Removed pickle for context", repr(pickle_file))
+    observatory = config.mapping_to_observatory(mapping)
+    pickle_files = [pickle_file,
+                    config.locate_context_image(mapping, observatory),
+                    config.locate_match_index(mapping, observatory)]
+    for pickle_file in pickle_files:
+        if not os.path.exists(pickle_file):
+            log.verbose("Pickle file", repr(pickle_file), "does not exist,  skipping pickle remove.")
+            continue
+        with log.warn_on_exception("Failed removing pickle for", repr(mapping)):
+            os.remove(pickle_file)
+            log.info("Removed pickle for context", repr(pickle_file))
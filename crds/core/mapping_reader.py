@@ -0,0 +1,277 @@
+"""Defines and instantiates MAPPING_READER which loads the declarative subset of
+Python used by mapping files directly,  without the AST walk of MAPPING_VERIFIER
+or compiling and exec'ing the mapping.   A regular expression tokenizer feeds a
+recursive descent parser which only accepts:
+
+- top level assignments of a dict,  selector call,  or constant to 'header',
+  'selector',  or 'comment',  each starting a line
+
+- dicts,  tuples,  lists,  strings,  numbers,  True,  False,  and None
+
+- calls of the Selectors named in selectors.SELECTORS on a single dict or list
+
+Everything the reader accepts is also accepted by MAPPING_VERIFIER and defines
+the same values when exec'ed.   Anything else,  including every invalid mapping,
+is handed to MAPPING_VERIFIER and exec by read_mapping(),  so security checks and
+error messages are exactly those of the verifier.
+
+>>> MAPPING_READER.read('''
+... header = {
+...     'parkey' : (('DETECTOR',),),   # comment
+... }
+... selector = Match({
+...     ('HRC',) : 'hrc.fits',
+...     ('WFC',) : 'w' "fc.fits",
+... })
+... ''')
+{'header': {'parkey': (('DETECTOR',),)}, 'selector': Match}
+
+Constructs outside the fast subset are not read:
+
+>>> MAPPING_READER.read("header = {'a' : -(1)}") is None
+True
+
+but read_mapping() still interprets them the same way as before:
+
+>>> read_mapping("header = {'a' : -(1)}")["header"]
+{'a': -1}
+
+>>> read_mapping("import os")
+Traceback (most recent call last):
+...
+crds.core.exceptions.MappingFormatError: Illegal statement or expression in mapping <ast.Import object at 0x...> at line 1
+"""
+import ast
+import re
+
+from . import config, selectors
+from .mapping_verifier import MAPPING_VERIFIER
+
+# ===================================================================
+
+class UnsupportedMapping(Exception):
+    """The mapping text is outside the subset handled by MappingReader."""
+
+# Each token absorbs the white space and comments before it.
+TOKEN_RE = re.compile(r"""
+    (?:[ \t\f\n]+|\#[^\n]*)*
+    (?:
+        (?P<string>[rRuU]?(?:'(?!'')[^'\\\n]*(?:\\.[^'\\\n]*)*'|"(?!"")[^"\\\n]*(?:\\.[^"\\\n]*)*"|
+                           '''(?:[^\\]|\\.)*?'''|"\""(?:[^\\]|\\.)*?"\""))
+      | (?P<number>(?:\d+\.\d*|\.\d+|\d+)(?:[eE][+-]?\d+)?(?![\w.]))
+      | (?P<name>[A-Za-z_]\w*)
+      | (?P<op>[{}()\[\],:=-])
+      | (?P<end>\Z)
+      | (?P<other>.)
+    )
+""", re.VERBOSE | re.DOTALL | re.ASCII)
+
+CONSTANT_NAMES = {"True" : True, "False" : False, "None" : None}
+
+SECTION_NAMES = ("header", "selector", "comment")
+
+class MappingReader:
+    """MappingReader parses the text of a mapping into the namespace its statements
+    define,  { "header" : dict, "selector" : Parameters or dict, "comment" : str },
+    or returns None if the text uses anything outside the fast subset.
+    """
+    def read(self, text):
+        """Return the namespace defined by mapping `text` or None."""
+        try:
+            return _MappingParser(text).parse()
+        except Exception:   # UnsupportedMapping,  or errors the verifier and exec should report
+            return None
+
+class _MappingParser:
+    """Recursive descent parser for a single mapping text."""
+
+    def __init__(self, text):
+        if "\r" in text:
+            text = text.replace("\r\n", "\n")
+            if "\r" in text:
+                raise UnsupportedMapping("carriage return line ends")
+        self.text = text
+        self.tokens = []
+        for match in TOKEN_RE.finditer(text):
+            kind = match.lastgroup
+            if kind == "other":
+                raise UnsupportedMapping("unsupported character " + repr(match.group(kind)))
+            self.tokens.append((kind, match.group(kind), match.start(kind), match.end()))
+            if kind == "end":
+                break
+        self.index = 0
+
+    def unsupported(self, message):
+        kind, value, start, _end = self.tokens[self.index]
+        raise UnsupportedMapping(message + " at " + repr(value) + " offset " + str(start))
+
+    def next(self):
+        token = self.tokens[self.index]
+        self.index += 1
+        return token
+
+    def peek(self):
+        return self.tokens[self.index]
+
+    def expect(self, value):
+        if self.tokens[self.index][1] != value or self.tokens[self.index][0] != "op":
+            self.unsupported("expected " + repr(value))
+        self.index += 1
+
+    def parse(self):
+        """Return the namespace assigned by the statements of the mapping."""
+        namespace = {}
+        while self.peek()[0] != "end":
+            kind, name, start, _end = self.next()
+            if kind != "name" or name not in SECTION_NAMES or (start and self.text[start-1] != "\n"):
+                self.unsupported("expected section assignment")
+            self.expect("=")
+            first = self.peek()
+            value = self.value()
+            if not (first[1] == "{" or first[0] in ("string", "number") or
+                    (first[0] == "name" and (first[1] in CONSTANT_NAMES or first[1] in selectors.SELECTORS))):
+                self.unsupported("section value must be a selector call or dictionary or string")
+            if self.peek()[0] != "end" and "\n" not in self.text[self.tokens[self.index-1][3]:self.peek()[2]]:
+                self.unsupported("expected end of statement")
+            namespace[name] = value
+        return namespace
+
+    def value(self, nested=False):
+        """Parse and return the value of the expression at the current token."""
+        kind, token, _start, end = self.next()
+        if kind == "string":
+            value = self.string(token)
+            while self.peek()[0] == "string" and (nested or "\n" not in self.text[end:self.peek()[2]]):
+                _kind, token, _start, end = self.next()
+                value += self.string(token)
+            return value
+        elif kind == "number":
+            return self.number(token)
+        elif kind == "name":
+            if token in CONSTANT_NAMES:
+                return CONSTANT_NAMES[token]
+            if token in selectors.SELECTORS and self.peek()[1] == "(":
+                self.next()
+                if self.peek()[1] not in ("{", "["):
+                    self.unsupported("selector parameters must be a dict or list")
+                selections = self.value(nested=True)
+                self.expect(")")
+                return selectors.SELECTORS[token](selections)
+            self.unsupported("unsupported name")
+        elif token == "-" and self.peek()[0] == "number":
+            return -self.number(self.next()[1])
+        elif token == "{":
+            return self.dict_()
+        elif token == "(":
+            return self.tuple_()
+        elif token == "[":
+            return self.list_()
+        self.index -= 1
+        self.unsupported("unsupported expression")
+
+    def string(self, token):
+        """Return the value of string literal `token`."""
+        prefix = 1 if token[0] in "rRuU" else 0
+        quotes = 3 if token[prefix:prefix+3] in ("'''", '"""') else 1
+        body = token[prefix+quotes:-quotes]
+        if "\\" in body:
+            return ast.literal_eval(token)
+        return body
+
+    def number(self, token):
+        """Return the value of numeric literal `token`."""
+        if token.isdigit():
+            if token[0] == "0" and token.strip("0"):
+                self.unsupported("leading zeros in decimal integer")
+            return int(token)
+        return float(token)
+
+    def sequence(self, close):
+        """Generate the values of a comma separated sequence ending with `close`."""
+        while self.peek()[1] != close:
+            yield self.value(nested=True)
+            if self.peek()[1] != close:
+                self.expect(",")
+        self.next()
+
+    def dict_(self):
+        result = {}
+        while self.peek()[1] != "}":
+            key = self.value(nested=True)
+            self.expect(":")
+            result[key] = self.value(nested=True)
+            if self.peek()[1] != "}":
+                self.expect(",")
+        self.next()
+        return result
+
+    def tuple_(self):
+        if self.peek()[1] == ")":
+            self.next()
+            return ()
+        first = self.value(nested=True)
+        if self.peek()[1] == ")":    # parenthesized expression,  not a tuple
+            self.next()
+            return first
+        self.expect(",")
+        return (first,) + tuple(self.sequence(")"))
+
+    def list_(self):
+        return list(self.sequence("]"))
+
+MAPPING_READER = MappingReader()
+
+# ===================================================================
+
+def read_mapping(text):
+    """Return the namespace defined by mapping `text`,  reading it with MAPPING_READER
+    if CRDS_FAST_MAPPING_READER is enabled and it can,  otherwise verifying it with
+    MAPPING_VERIFIER and exec'ing it.
+    """
+    namespace = MAPPING_READER.read(text) if config.FAST_MAPPING_READER else None
+    if namespace is None:
+        code = MAPPING_VERIFIER.compile_and_check(text)
+        namespace = {}
+        namespace.update(selectors.SELECTORS)
+        exec(code, namespace)
+    return namespace
+
+def check_reader(text):
+    """Correctness harness which reads mapping `text` with both MAPPING_READER and
+    MAPPING_VERIFIER + exec,  returning a list of the names of sections which differ.
+    Texts the reader doesn't handle trivially agree.
+    """
+    namespace = MAPPING_READER.read(text)
+    if namespace is None:
+        return []
+    code = MAPPING_VERIFIER.compile_and_check(text)
+    executed = {}
+    executed.update(selectors.SELECTORS)
+    exec(code, executed)
+    return [name for name in SECTION_NAMES
+            if comparable(namespace.get(name)) != comparable(executed.get(name))]
+
+def comparable(value):
+    """Return a representation of a mapping `value` including its types,  where
+    Parameters are reduced to their class and selections.
+    """
+    if isinstance(value, selectors.Parameters):
+        return (value.__class__.__name__, tuple((comparable(key), comparable(choice))
+                                                for (key, choice) in value.selections))
+    elif isinstance(value, dict):
+        return ("dict", tuple((comparable(key), comparable(choice)) for (key, choice) in value.items()))
+    elif isinstance(value, (tuple, list)):
+        return (type(value).__name__, tuple(comparable(item) for item in value))
+    else:
+        return (type(value).__name__, repr(value))
+
+# ===================================================================
+
+def test():
+    """Run module doctests."""
+    import doctest
+    from crds.core import mapping_reader
+    return doctest.testmod(mapping_reader, optionflags=doctest.ELLIPSIS | doctest.IGNORE_EXCEPTION_DETAIL)
+
+if __name__ == "__main__":
+    print(test())
@@ -52,16 +52,23 @@ Active instrument references are also broken down by filetype:
 True
 """
 import os.path
+import re
+import atexit
+import itertools
+import concurrent.futures
 import glob
 import json
+import threading
+import types
+import weakref
 
-from collections import namedtuple
+from collections import namedtuple, OrderedDict
 
 # ===================================================================
 
 from packaging.requirements import Requirement
 
-from . import log, utils, config, selectors, substitutions
+from . import log, utils, config, selectors, selector_compiler, substitutions, mapping_reader
 
 # XXX For backward compatability until refactored away.
 from .config import locate_file, locate_mapping, locate_reference
@@ -102,6 +109,64 @@ Filemap  = namedtuple("Filemap","date,file,comment")
 
 # =============================================================================
 
+class BestrefsMemo:
+    """Bounded least-recently-used memo of ReferenceMapping best reference lookup
+    outcomes,  each either the selected value or the exception raised before
+    selection.   A `maxsize` of 0 disables the memo.
+
+    >>> memo = BestrefsMemo(2)
+    >>> memo.put(("A",), "a.fits");  memo.put(("B",), "b.fits")
+    >>> memo.get(("A",))
+    'a.fits'
+    >>> memo.put(("C",), "c.fits")
+    >>> memo.get(("B",)) is BestrefsMemo.MISSING
+    True
+    >>> memo.stats()
+    {'hits': 1, 'misses': 1, 'size': 2, 'maxsize': 2}
+    """
+    MISSING = object()
+
+    def __init__(self, maxsize):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._outcomes = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        """Return the memoized outcome for `key` or MISSING.   A `key` of None is never memoized."""
+        if key is None or not self.maxsize:
+            return self.MISSING
+        with self._lock:
+            outcome = self._outcomes.get(key, self.MISSING)
+            if outcome is self.MISSING:
+                self.misses += 1
+            else:
+                self.hits += 1
+                self._outcomes.move_to_end(key)
+            return outcome
+
+    def put(self, key, outcome):
+        """Memoize `outcome` for `key`,  discarding the least recently used outcome if full."""
+        if key is None or not self.maxsize:
+            return
+        with self._lock:
+            self._outcomes[key] = outcome
+            self._outcomes.move_to_end(key)
+            if len(self._outcomes) > self.maxsize:
+                self._outcomes.popitem(last=False)
+
+    def clear(self):
+        """Discard all memoized outcomes."""
+        with self._lock:
+            self._outcomes.clear()
+
+    def stats(self):
+        """Return { "hits" : int, "misses" : int, "size" : int, "maxsize" : int }"""
+        return dict(hits=self.hits, misses=self.misses, size=len(self._outcomes), maxsize=self.maxsize)
+
+# =============================================================================
+
 class LowerCaseDict(dict):
     """Used to return Mapping header string values uniformly as lower case.
 
@@ -264,53 +329,75 @@ class Mapping:
             basename = filename
         else:
             filename = config.locate_mapping(basename)
+        identity = MAPPING_CHECKSUMS.identity(filename)
         text = utils.get_uri_content(filename)
-        return cls.from_string(text, basename, *args, **keys)
+        checksum = MAPPING_CHECKSUMS.get(filename, identity)
+        mapping = cls.from_string(text, basename, *args, checksum=checksum, **keys)
+        if checksum is None and mapping._content_checksum == mapping.header.get("sha1sum", None):
+            MAPPING_CHECKSUMS.put(filename, identity, mapping._content_checksum)
+        return mapping
 
     @classmethod
-    def from_string(cls, text, basename="(noname)", *args, **keys):
-        """Construct a mapping from string `text` nominally named `basename`."""
+    def from_string(cls, text, basename="(noname)", *args, checksum=None, **keys):
+        """Construct a mapping from string `text` nominally named `basename`.
+        `checksum` is the already verified checksum of `text`,  if known.
+        """
         keys.pop("comment", None) #  discard comment if defined
-        header, selector, comment = cls._parse_header_selector(text, basename)
+        if checksum is None:
+            checksum = cls._get_checksum(text)
+        if keys.get("loader") is get_cached_mapping and config.RMAP_STORE:
+            header, selector, comment = cls._parse_header_selector(text, basename, checksum)
+        else:
+            header, selector, comment = cls._parse_header_selector(text, basename)
         mapping = cls(basename, header, selector, comment=comment, **keys)
+        mapping._content_checksum = checksum
+        cls._verify_checksum(mapping.basename, mapping.header, checksum, keys.get("ignore_checksum", False))
+        return mapping
+
+    @classmethod
+    def _verify_checksum(cls, basename, header, checksum, ignore_checksum=False):
+        """Check that mapping `header` records `checksum`,  warning about or ignoring
+        a missing or incorrect sha1sum as directed by `ignore_checksum` or CRDS_IGNORE_MAPPING_CHECKSUM.
+        """
         try:
-            mapping._check_hash(text)
+            cls._check_header_checksum(basename, header, checksum)
         except crexc.ChecksumError as exc:
-            ignore = keys.get("ignore_checksum", False) or config.get_ignore_checksum()
+            ignore = ignore_checksum or config.get_ignore_checksum()
             if ignore == "warn":
                 log.warning("Checksum error", ":", str(exc))
             elif ignore:
                 pass
             else:
                 raise
-        return mapping
 
     @classmethod
-    def _parse_header_selector(cls, text, where=""):
+    def _parse_header_selector(cls, text, where="", checksum=None):
         """Given a mapping at `filepath`,  validate it and return a fully
-        instantiated (header, selector) tuple.
+        instantiated (header, selector) tuple.   Only ReferenceMappings
+        share selectors by content `checksum`.
         """
         with log.augment_exception("Can't load file " + where,
                                    exception_class=crexc.MappingError):
-            code = MAPPING_VERIFIER.compile_and_check(text)
-            header, selector, comment = cls._interpret(code)
+            header, selector, comment = cls._interpret(text)
         return LowerCaseDict(header), selector, comment
 
     @classmethod
-    def _interpret(cls, code):
-        """Interpret a valid rmap code object and return it's header and
+    def _interpret(cls, text):
+        """Interpret the text of a valid mapping and return it's header and
         selector.
         """
-        namespace = {}
-        namespace.update(selectors.SELECTORS)
-        exec(code, namespace)
+        namespace = mapping_reader.read_mapping(text)
         header = LowerCaseDict(namespace["header"])
-        selector = namespace["selector"]
         comment = namespace.get("comment", None)
+        return header, cls._instantiate(namespace["selector"], header), comment
+
+    @classmethod
+    def _instantiate(cls, selector, header):
+        """Return the Selector tree or dict defined by interpreted `selector` and `header`."""
         if isinstance(selector, selectors.Parameters):
-            return header, selector.instantiate(header), comment
+            return selector.instantiate(header)
         elif isinstance(selector, dict):
-            return header, selector, comment
+            return selector
         else:
             raise crexc.MappingFormatError("selector must be a dict or a Selector.")
 
@@ -389,17 +476,26 @@ class Mapping:
         with open(filename, "w+") as handle:
             handle.write(self.format())
 
-    def _check_hash(self, text):
+    def _check_hash(self, text, checksum=None):
         """Verify that the mapping header has a checksum and that it is
-        correct,  else raise an appropriate exception.
+        correct,  else raise an appropriate exception.   `checksum` is the
+        already computed checksum of `text`,  if any.
         """
-        old = self.header.get("sha1sum", None)
+        if checksum is None:
+            checksum = self._get_checksum(text)
+        self._check_header_checksum(self.basename, self.header, checksum)
+
+    @staticmethod
+    def _check_header_checksum(basename, header, checksum):
+        """Raise a ChecksumError unless mapping `header` records sha1sum `checksum`."""
+        old = header.get("sha1sum", None)
         if old is None:
-            raise crexc.ChecksumError("sha1sum is missing in " + repr(self.basename))
-        if self._get_checksum(text) != self.header["sha1sum"]:
-            raise crexc.ChecksumError("sha1sum mismatch in " + repr(self.basename))
+            raise crexc.ChecksumError("sha1sum is missing in " + repr(basename))
+        if checksum != old:
+            raise crexc.ChecksumError("sha1sum mismatch in " + repr(basename))
 
-    def _get_checksum(self, text):
+    @staticmethod
+    def _get_checksum(text):
         """Compute the rmap checksum over the original file contents.  Skip over the sha1sum line."""
         # Compute the new checksum over everything but the sha1sum line.
         # This will fail if sha1sum appears for some other reason.  It won't ;-)
@@ -609,6 +705,16 @@ class Mapping:
         """Return the "extended match tuples" which can be followed to arrive at `filename`."""
         return sorted([match for value in self.selections.normal_values() for match in value.file_matches(filename)])
 
+    def all_file_matches(self):
+        """Return { filename : sorted([extended match tuple, ...]) } for every file in this
+        context,  equivalent to file_matches() for each file but walking the context once.
+        """
+        matches = {}
+        for value in self.selections.normal_values():
+            for filename, file_matches in value.all_file_matches().items():
+                matches.setdefault(filename, []).extend(file_matches)
+        return { filename : sorted(file_matches) for (filename, file_matches) in matches.items() }
+
     def get_derived_from(self):
         """Return the Mapping object `self` was derived from, or None."""
         for substring in self.null_derivation_substrings:
@@ -686,6 +792,17 @@ class ContextMapping(Mapping):
         for selection in self.selections.normal_values():
             selection.force_load()
 
+    def get_memo_stats(self):
+        """Return the best references memo statistics summed over the already loaded
+        rmaps of this context.   See ReferenceMapping.get_memo_stats().
+        """
+        totals = dict(hits=0, misses=0, size=0, maxsize=0)
+        for mapping in self.selections.loaded_values():
+            if isinstance(mapping, Mapping):
+                for name, value in mapping.get_memo_stats().items():
+                    totals[name] += value
+        return totals
+
     def set_item(self, key, value):
         """Add or replace and element of this mapping's selector.   For re-writing only.
 
@@ -1024,10 +1141,232 @@ class InstrumentContext(ContextMapping):
 
 # ===================================================================
 
+class RmapStore:
+    """Content addressed store of the selectors of loaded rmaps,  keyed by the checksum
+    of the rmap text.   With CRDS_RMAP_STORE enabled,  rmaps loaded by get_cached_mapping()
+    or from context pickles share the selector of any loaded rmap with the same contents,
+    whatever its name,  so successive contexts share their common rules.
+
+    Selectors are only weakly referenced,  they're dropped when no rmap uses them.
+
+    >>> store = RmapStore()
+    >>> selector = selectors.UseAfterSelector(("DATE-OBS",), {"2001-01-01 00:00:00" : "a.fits"})
+    >>> store.put("0123", selector) is selector
+    True
+    >>> store.get("0123") is selector
+    True
+    >>> store.get("4567") is None
+    True
+    >>> store.stats()
+    {'hits': 1, 'misses': 1, 'size': 1}
+    """
+    def __init__(self):
+        self._selectors = weakref.WeakValueDictionary()
+        self._lock = threading.Lock()
+        self._hits = 0
+        self._misses = 0
+
+    def get(self, checksum):
+        """Return the stored selector for rmap `checksum` or None."""
+        with self._lock:
+            selector = self._selectors.get(checksum)
+            if selector is None:
+                self._misses += 1
+            else:
+                self._hits += 1
+        return selector
+
+    def put(self, checksum, selector):
+        """Store `selector` for rmap `checksum` unless a selector is already stored,
+        returning the stored selector.   Only Selector trees are stored.
+        """
+        if not isinstance(selector, selectors.Selector):
+            return selector
+        with self._lock:
+            return self._selectors.setdefault(checksum, selector)
+
+    def clear(self):
+        """Drop all stored selectors and reset the statistics."""
+        with self._lock:
+            self._selectors.clear()
+            self._hits = self._misses = 0
+
+    def stats(self):
+        """Return { "hits" : int, "misses" : int, "size" : int }"""
+        with self._lock:
+            return dict(hits=self._hits, misses=self._misses, size=len(self._selectors))
+
+RMAP_STORE = RmapStore()
+
+# ===================================================================
+
+class MappingChecksums:
+    """Persistent record of the checksums of mapping files which passed checksum
+    verification,  keyed by absolute path and valid only while the file's size,
+    modification time,  and inode are unchanged.   With CRDS_CACHE_MAPPING_CHECKSUMS
+    enabled,  Mapping.from_file() skips hashing mapping files which haven't changed
+    since they were last verified.   CRDS_FORCE_MAPPING_CHECKSUMS,  or crds sync
+    --check-sha1sum,  forces full verification.
+
+    The record is kept in mapping_checksums.json of the CRDS config directory and
+    saved when the process exits,  merged with records saved by other processes.
+    """
+    FILENAME = "mapping_checksums.json"
+
+    def __init__(self):
+        self._records = {}     # { record_path : { mapping_path : [size, mtime_ns, inode, checksum] } }
+        self._updated = set()
+        self._lock = threading.Lock()
+        self._exit_registered = False
+
+    @classmethod
+    def record_path(cls):
+        """Return the path of the checksum record of the current CRDS cache."""
+        return os.path.join(config.get_crds_root_cfgpath(), cls.FILENAME)
+
+    def identity(self, filename):
+        """Return the [size, mtime_ns, inode] of local mapping file `filename`,  or None
+        if checksum caching is disabled or the file can't be stat'ed.
+        """
+        if not config.CACHE_MAPPING_CHECKSUMS:
+            return None
+        try:
+            stat = os.stat(filename)
+        except (OSError, ValueError):
+            return None
+        return [stat.st_size, stat.st_mtime_ns, stat.st_ino]
+
+    def get(self, filename, identity):
+        """Return the previously verified checksum of `filename` if its file `identity`
+        is unchanged,  otherwise None.
+        """
+        if identity is None or config.FORCE_MAPPING_CHECKSUMS:
+            return None
+        record = self._load(self.record_path()).get(os.path.abspath(filename))
+        if record is None or record[:3] != identity:
+            return None
+        return record[3]
+
+    def put(self, filename, identity, checksum):
+        """Record verified `checksum` for `filename` with file `identity`."""
+        if identity is None:
+            return
+        record_path = self.record_path()
+        records = self._load(record_path)
+        with self._lock:
+            records[os.path.abspath(filename)] = identity + [checksum]
+            self._updated.add(record_path)
+            if not self._exit_registered:
+                atexit.register(self.save)
+                self._exit_registered = True
+
+    def _load(self, record_path):
+        """Return the checksum records of `record_path`,  reading them once."""
+        with self._lock:
+            records = self._records.get(record_path)
+            if records is None:
+                records = self._records[record_path] = self._read(record_path)
+            return records
+
+    def _read(self, record_path):
+        """Return the records saved at `record_path` or {}."""
+        try:
+            with open(record_path) as handle:
+                records = json.load(handle)
+        except (OSError, ValueError):
+            return {}
+        return records if isinstance(records, dict) else {}
+
+    def save(self):
+        """Save updated records,  merged with any saved by other processes since."""
+        with self._lock:
+            updated, self._updated = self._updated, set()
+            for record_path in updated:
+                if not utils.is_writable(record_path, no_exist=True):
+                    continue
+                with log.verbose_warning_on_exception("Failed saving mapping checksums to", repr(record_path)):
+                    records = self._read(record_path)
+                    records.update(self._records[record_path])
+                    utils.ensure_dir_exists(record_path)
+                    temp_path = record_path + "." + str(os.getpid()) + ".tmp"
+                    with open(temp_path, "w+") as handle:
+                        json.dump(records, handle)
+                    os.replace(temp_path, record_path)
+
+    def clear(self):
+        """Forget all records read or added by this process,  without saving them."""
+        with self._lock:
+            self._records = {}
+            self._updated = set()
+
+MAPPING_CHECKSUMS = MappingChecksums()
+
+# ===================================================================
+
+class DeferredSelector:
+    """The unparsed selector source of an rmap loaded with CRDS_LAZY_RMAPS,  parsed
+    and instantiated by ReferenceMapping.selector on first use.
+
+    >>> deferred = DeferredSelector("\\nselector = UseAfter({'2001-01-01 00:00:00' : 'a.fits'})\\n", "(test)")
+    >>> deferred
+    DeferredSelector('(test)')
+
+    >>> deferred.parse({"parkey" : (("DATE-OBS",),)})
+    UseAfterSelector(('DATE-OBS',), nselections=1)
+    """
+    # The assignment to `selector` starts a line in every formatted rmap.
+    SELECTOR_RE = re.compile(r"^selector\s*=", re.MULTILINE)
+
+    checksum = None   # for DeferredSelectors pickled before RmapStore
+
+    def __init__(self, text, where, checksum=None):
+        self.text = text
+        self.where = where
+        self.checksum = checksum
+
+    def __repr__(self):
+        return self.__class__.__name__ + "(" + repr(self.where) + ")"
+
+    @classmethod
+    def split(cls, text):
+        """Return (header_text, selector_text) for rmap `text` or None if there is no
+        distinct selector assignment.   Line numbers of `selector_text` are preserved
+        by blank lines in place of the header.
+        """
+        found = cls.SELECTOR_RE.search(text)
+        if found is None:
+            return None
+        header_text = text[:found.start()]
+        return header_text, "\n" * header_text.count("\n") + text[found.start():]
+
+    def parse(self, header):
+        """Verify and interpret the selector source,  returning its Selector tree,  or
+        the selector already in RMAP_STORE for the rmap checksum if there is one.
+        """
+        if self.checksum is not None:
+            selector = RMAP_STORE.get(self.checksum)
+            if selector is not None:
+                return selector
+        with log.augment_exception("Can't load file " + self.where,
+                                   exception_class=crexc.MappingError):
+            selector = ReferenceMapping._instantiate(self.read(), header)
+        if self.checksum is not None:
+            selector = RMAP_STORE.put(self.checksum, selector)
+        return selector
+
+    def read(self):
+        """Return the uninstantiated selector Parameters of the deferred source."""
+        return mapping_reader.read_mapping(self.text)["selector"]
+
+# ===================================================================
+
 class ReferenceMapping(Mapping):
     """ReferenceMapping manages loading the rmap associated with a single
     reference filetype and instantiate an appropriate selector tree from the
     rmap header and data.
+
+    When CRDS_LAZY_RMAPS is enabled only the rmap header is parsed when it is
+    loaded,  the selector is parsed the first time it is used.
     """
     mapping_type = "reference"
     required_attrs = Mapping.required_attrs + ["observatory","instrument","filekind"]
@@ -1045,10 +1384,6 @@ class ReferenceMapping(Mapping):
         self._reffile_format = self.header.get("reffile_format", "IMAGE").upper()
         self._reffile_required = self.header.get("reffile_required", "NONE").upper()
 
-        # header precondition method, e.g. crds.hst.acs.precondition_header
-        # TPNs define the static definitive possibilities for parameter choices
-        # rmaps define the actually appearing literal parameter values
-        self._rmap_valid_values = self.selector.get_value_map()
         self._required_parkeys = self.get_required_parkeys()
 
         # For "rmap_relevance" and "rmap_omit" expressions,  the expressions are enclosed in ()
@@ -1089,16 +1424,75 @@ class ReferenceMapping(Mapping):
         del state["_precondition_header"]
         del state["_fallback_header"]
         del state["_rmap_update_headers"]
+        del state["_bestrefs_memo"]
         return state
 
     def __setstate__(self, state):
         """Recreate rmap object from `state`,  recompiling missing __getstate__ objects on the fly."""
-        self.__dict__ = dict(state)
+        state = dict(state)
+        if "selector" in state:    # pickled before selectors could be deferred
+            state["_selector"] = state.pop("selector")
+        state.pop("_rmap_valid_values", None)
+        if config.RMAP_STORE and state.get("_content_checksum") is not None:
+            state["_selector"] = RMAP_STORE.put(state["_content_checksum"], state["_selector"])
+        self.__dict__ = state
         self._init_compiled()
 
+    @classmethod
+    def _parse_header_selector(cls, text, where="", checksum=None):
+        """As Mapping._parse_header_selector(),  but if CRDS_LAZY_RMAPS is enabled only
+        the header is parsed and the selector is returned as a DeferredSelector.
+
+        If `checksum` is specified,  the selector is shared through RMAP_STORE and only
+        the header is parsed when RMAP_STORE already has it.
+        """
+        stored = RMAP_STORE.get(checksum) if checksum is not None else None
+        split = DeferredSelector.split(text) if (config.LAZY_RMAPS or stored is not None) else None
+        if split is None:
+            header, selector, comment = super(ReferenceMapping, cls)._parse_header_selector(text, where)
+            if checksum is not None:
+                selector = RMAP_STORE.put(checksum, selector)
+            return header, selector, comment
+        header_text, selector_text = split
+        with log.augment_exception("Can't load file " + where,
+                                   exception_class=crexc.MappingError):
+            namespace = mapping_reader.read_mapping(header_text)
+            header = LowerCaseDict(namespace["header"])
+            comment = namespace.get("comment", None)
+        if stored is None:
+            stored = DeferredSelector(selector_text, where, checksum)
+        return header, stored, comment
+
+    @property
+    def selector(self):
+        """The Selector tree of this rmap,  parsed now if it was deferred at load time."""
+        selector = self._selector
+        if isinstance(selector, DeferredSelector):
+            log.verbose("Parsing deferred selector for", repr(self.basename), verbosity=55)
+            selector = self._selector = selector.parse(self.header)
+        return selector
+
+    @selector.setter
+    def selector(self, selector):
+        self._selector = selector
+
+    def selector_is_loaded(self):
+        """Return True unless parsing this rmap's selector is still deferred."""
+        return not isinstance(self._selector, DeferredSelector)
+
+    @property
+    def _rmap_valid_values(self):
+        """The literal parameter values which actually appear in the rmap,  as opposed to
+        the TPN valid values which define every possibility.
+        """
+        return self.selector.get_value_map()
+
     def force_load(self):
-        """Nothing below ReferenceMapping is loaded."""
-        pass
+        """Nothing below ReferenceMapping is loaded,  but compile the selector if enabled
+        so that it is saved with context pickles.
+        """
+        if self._compile_selector:
+            self.compiled_selector()
 
     def _init_compiled(self):
         """Initialize object fields which contain compiled code objects, special handling for pickling."""
@@ -1114,10 +1508,83 @@ class ReferenceMapping(Mapping):
             name.lower() : self.get_expr(expr) for (name, expr) in relevant.items()
             }
 
-        self._precondition_header = self.get_hook("precondition_header", (lambda self, header: header))
+        precondition_header = self.get_hook("precondition_header", None)
+        self._precondition_header = precondition_header or (lambda self, header: header)
         self._fallback_header = self.get_hook("fallback_header", (lambda self, header: None))
         self._rmap_update_headers = self.get_hook("rmap_update_headers", None)
 
+        # The compiled selector pickles,  it is only discarded if compilation is disabled.
+        self._compile_selector = bool(config.COMPILE_RMAPS)
+        if not self._compile_selector or "_compiled_selector" not in self.__dict__:
+            self._compiled_selector = None
+
+        # Precondition hooks can read any header keyword so memo keys include them all.
+        # Otherwise memo keys include the parkeys and the keywords read by the rmap_relevance,
+        # rmap_omit,  and parkey_relevance expressions,  compared in eval() form.
+        self._bestrefs_memo = BestrefsMemo(config.BESTREFS_MEMO_SIZE.get())
+        if precondition_header is None:
+            self._memo_parkeys = frozenset(
+                name.upper().replace(".", "_") for name in list(self._required_parkeys) + self._expr_names())
+        else:
+            self._memo_parkeys = None
+
+    def _expr_names(self):
+        """Return the names read by the rmap_relevance,  rmap_omit,  and parkey_relevance
+        expressions of this rmap.
+        """
+        codes = [self._rmap_relevance_expr[1], self._rmap_omit_expr[1]] + \
+            [compiled for (_source, compiled) in self._parkey_relevance_exprs.values()]
+        names = []
+        while codes:
+            code = codes.pop()
+            names.extend(code.co_names)
+            codes.extend(const for const in code.co_consts if isinstance(const, types.CodeType))
+        return names
+
+    def get_memo_stats(self):
+        """Return the statistics of this rmap's memo of best reference lookups:
+
+        { "hits" : int, "misses" : int, "size" : int, "maxsize" : int }
+
+        The memo size is set by CRDS_BESTREFS_MEMO_SIZE.
+        """
+        return self._bestrefs_memo.stats()
+
+    def _memo_key(self, header):
+        """Return the best references memo key for `header`,  the sorted items of its
+        lookup parameters,  or None if `header` can't be memoized.
+        """
+        try:
+            if self._memo_parkeys is None:
+                items = header.items()
+            else:
+                items = [item for item in header.items()
+                         if item[0].upper().replace(".", "_") in self._memo_parkeys]
+            key = tuple(sorted(items))
+            hash(key)
+        except Exception:
+            return None
+        return key
+
+    def compiled_selector(self):
+        """Return the CompiledSelector for self.selector,  compiling it on first use."""
+        if self._compiled_selector is None:
+            log.verbose("Compiling selector for", repr(self.basename), verbosity=55)
+            self._compiled_selector = selector_compiler.compile_selector(self.selector)
+        return self._compiled_selector
+
+    def _choose(self, header):
+        """Return self.selector.choose(header),  first trying the compiled selector
+        if CRDS_COMPILE_RMAPS is enabled.   Any lookup which the compiled selector
+        doesn't handle is repeated by the interpreted selector.
+        """
+        if self._compile_selector:
+            try:
+                return self.compiled_selector()(header)
+            except Exception:
+                pass
+        return self.selector.choose(header)
+
     def validate(self):
         """Validate the contents of this rmap against the TPN for this
         filekind / reftype.   Each field of each Match tuple must have a value
@@ -1208,30 +1675,87 @@ class ReferenceMapping(Mapping):
         """
         try:
             return self._get_best_ref(header)
-        except crexc.IrrelevantReferenceTypeError:
+        except Exception as exc:
+            return self._best_ref_exception(exc)
+
+    def _best_ref_exception(self, exc):
+        """Map exception `exc` from a best reference lookup onto the value returned
+        by get_best_ref(),  or re-raise it if exceptions are not being trapped.
+        """
+        if isinstance(exc, crexc.IrrelevantReferenceTypeError):
             return "NOT FOUND n/a"
-        except crexc.OmitReferenceTypeError:
+        elif isinstance(exc, crexc.OmitReferenceTypeError):
             return None
-        except Exception as exc:
-            if log.get_exception_trap():
-                return "NOT FOUND " + str(exc)
-            else:
-                raise
+        elif log.get_exception_trap():
+            return "NOT FOUND " + str(exc)
+        else:
+            raise exc
 
-    def _get_best_ref(self, header_in):
-        """Return the single reference file basename appropriate for
-        `header_in` selected by this ReferenceMapping.
+    def get_best_refs_many(self, headers):
+        """Batch form of get_best_ref() for `headers`,  a list of header dictionaries
+        or a dictionary of value columns,  e.g. NumPy string arrays,  one per parameter.
+
+        Headers are conditioned individually but selected with selector.choose_many().
+        Headers whose first selection fails are retried with get_best_ref() so that
+        DNR checks,  fallback headers,  and reffile_required apply exactly as usual.
+
+        Returns [ best reference value, ... ]  one per header of `headers`.
+        """
+        headers = selectors.batch_headers(headers)
+        bestrefs = [None] * len(headers)
+        rows, lookup_headers = [], []
+        for i, header_in in enumerate(headers):
+            try:
+                lookup_headers.append(self._lookup_header(dict(header_in)))
+            except Exception as exc:
+                bestrefs[i] = self._best_ref_exception(exc)
+            else:
+                rows.append(i)
+        choices = self.selector.choose_many(lookup_headers)
+        for i, choice in zip(rows, choices):
+            if isinstance(choice, Exception):
+                bestrefs[i] = self.get_best_ref(headers[i])
+            else:
+                try:
+                    bestrefs[i] = self._screen_best_ref(choice)
+                except Exception as exc:
+                    bestrefs[i] = self._best_ref_exception(exc)
+        return bestrefs
+
+    def _lookup_header(self, header_in):
+        """Apply rmap_omit and rmap_relevance expressions and header plugins to
+        `header_in`,  returning the header used for the initial selection.
         """
-        header_in = dict(header_in)
         log.verbose("Getting bestrefs:", self.basename, verbosity=55)
         expr_header = utils.condition_header_keys(header_in)
         self.check_rmap_omit(expr_header)     # Should bestref be omitted based on rmap_omit expr?
         self.check_rmap_relevance(expr_header)  # Should bestref be set N/A based on rmap_relevance expr?
         # Some filekinds, .e.g. ACS biasfile, mutate the header
         header = self._precondition_header(self, header_in) # Execute type-specific plugin if applicable
-        header = self.map_irrelevant_parkeys_to_na(header)  # Execute rmap parkey_relevance conditions
+        return self.map_irrelevant_parkeys_to_na(header)  # Execute rmap parkey_relevance conditions
+
+    def _get_best_ref(self, header_in):
+        """Return the single reference file basename appropriate for
+        `header_in` selected by this ReferenceMapping.
+
+        Results of first selections,  and errors preceding selection,  are memoized
+        on the lookup parameters of `header_in`.   DNR and fallback lookups aren't.
+        """
+        header_in = dict(header_in)
+        key = self._memo_key(header_in)
+        memoized = self._bestrefs_memo.get(key)
+        if isinstance(memoized, Exception):
+            raise memoized.with_traceback(None)
+        elif memoized is not BestrefsMemo.MISSING:
+            return self._screen_best_ref(memoized)
         try:
-            bestref = self.selector.choose(header)
+            header = self._lookup_header(header_in)
+        except Exception as exc:
+            self._bestrefs_memo.put(key, exc)
+            raise
+        try:
+            bestref = self._choose(header)
+            self._bestrefs_memo.put(key, bestref)
         except Exception as exc:
             # Check conditions for Do Not Reprocess dataset parameters, set to NA if True
             dnr = self.dnr_check(header)
@@ -1246,7 +1770,7 @@ class ReferenceMapping(Mapping):
                     header = self.minimize_header(header)
                     log.verbose("Fallback lookup on", repr(header), verbosity=55)
                     header = self.map_irrelevant_parkeys_to_na(header) # Execute rmap parkey_relevance conditions
-                    bestref = self.selector.choose(header)
+                    bestref = self._choose(header)
                 else:
                     raise
             except Exception as exc:
@@ -1257,6 +1781,10 @@ class ReferenceMapping(Mapping):
                 else:
                     log.verbose("No match found but reference is not required:",  str(exc), verbosity=55)
                     raise crexc.IrrelevantReferenceTypeError("No match found and reference type is not required.") from exc
+        return self._screen_best_ref(bestref)
+
+    def _screen_best_ref(self, bestref):
+        """Return selected `bestref`,  or raise an exception if the rules define it as N/A or OMIT."""
         log.verbose("Found bestref", repr(self.instrument), repr(self.filekind), "=", repr(bestref), verbosity=55)
         if MappingSelectionsDict.is_na_value(bestref):
             raise crexc.IrrelevantReferenceTypeError("Rules define this type as Not Applicable for these observation parameters.")
@@ -1370,6 +1898,16 @@ class ReferenceMapping(Mapping):
                   ("filekind", self.filekind),),)
         return sorted(self.selector.file_matches(filename, sofar))
 
+    def all_file_matches(self):
+        """Return { filename : sorted([match tuple, ...]) } for every file in this rmap,
+        equivalent to file_matches() for each file but walking the selector once.
+        """
+        sofar = ((("observatory", self.observatory),
+                  ("instrument",self.instrument),
+                  ("filekind", self.filekind),),)
+        return { filename : sorted(file_matches) for (filename, file_matches)
+                 in self.selector.all_file_matches(sofar).items() }
+
     def difference(self, other, path=(), pars=(), include_header_diffs=False, recurse_added_deleted=False):
         """Return the list of difference tuples between `self` and `other`, prefixing each tuple with context `path`.
         Elements of `path` are named by correspnding elements of `pars`.
@@ -1555,6 +2093,9 @@ class ReferenceMapping(Mapping):
         new = self.copy()
         new.selector.insert(header, value,
             self.tpn_valid_values if not config.ALLOW_BAD_PARKEY_VALUES else {})
+        new._compiled_selector = None
+        new._content_checksum = None
+        new._bestrefs_memo.clear()
         return new
 
     def delete(self, terminal):
@@ -1564,6 +2105,9 @@ class ReferenceMapping(Mapping):
         deleted_count = new.selector.delete(terminal)
         if deleted_count == 0:
             raise crexc.CrdsError("Terminal '%s' could not be found and deleted." % terminal)
+        new._compiled_selector = None
+        new._content_checksum = None
+        new._bestrefs_memo.clear()
         return new
 
     def todict(self, recursive=10):
@@ -1691,6 +2235,64 @@ def asmapping(filename_or_mapping, cached=False, **keys):
     else:
         raise TypeError("asmapping: parameter should be a string or mapping.")
 
+def preload_mappings(mappings, jobs=None, **keys):
+    """Parse the rmaps of `mappings` in a pool of `jobs` processes and add them to the
+    cache of get_cached_mapping(),  so that loading many mappings afterward,  as for
+    crds sync --all,  crds uses,  or regenerating pickles,  doesn't parse every rmap
+    serially.   Contexts in `mappings` are loaded here to find the rmaps they refer to.
+    `keys` are the keyword parameters of the get_cached_mapping() calls to preload.
+
+    `jobs` defaults to CRDS_MAPPING_LOAD_JOBS,  0 meaning one process per core.   With
+    1 job nothing is preloaded.   Rmaps which fail to load in a worker are skipped,
+    their errors are reported when they're loaded normally.
+
+    Returns the list of names of the preloaded rmaps.
+    """
+    jobs = config.MAPPING_LOAD_JOBS.get() if jobs is None else jobs
+    jobs = jobs or os.cpu_count() or 1
+    if jobs <= 1:
+        return []
+    keys["loader"] = get_cached_mapping
+    names = set()
+    for name in _mapping_closure_rmaps(mappings, keys):
+        if _load_mapping.cache_key(name, **keys) not in _load_mapping.cache:
+            names.add(name)
+    names = sorted(names)
+    if len(names) < 2:
+        return []
+    log.verbose("Preloading", len(names), "rmaps using", jobs, "processes.")
+    jobs = min(jobs, len(names))
+    preloaded = []
+    with concurrent.futures.ProcessPoolExecutor(jobs) as pool:
+        chunksize = max(1, len(names) // (jobs * 4))
+        results = pool.map(_preload_rmap, names, itertools.repeat(keys), chunksize=chunksize)
+        for name, loaded in zip(names, results):
+            if loaded is not None:
+                _load_mapping.add(loaded, name, **keys)
+                preloaded.append(name)
+    return preloaded
+
+def _mapping_closure_rmaps(mappings, keys):
+    """Generate the names of the rmaps of `mappings` and of the contexts in `mappings`,
+    loading only the contexts.
+    """
+    for name in mappings:
+        if name.endswith(".rmap"):
+            yield name
+        elif name.endswith((".pmap", ".imap")):
+            with log.verbose_warning_on_exception("Failed loading context", repr(name)):
+                context = _load_mapping(name, **keys)
+                yield from _mapping_closure_rmaps(
+                    [nested for nested in context.selector.values()
+                     if nested not in MappingSelectionsDict.special_values_set], keys)
+
+def _preload_rmap(name, keys):
+    """Worker for preload_mappings(),  load and return rmap `name` or None on failure."""
+    try:
+        return _load_mapping.uncached(name, **keys)
+    except Exception:
+        return None
+
 # =============================================================================
 
 class MappingSelectionsDict(LazyFileDict):
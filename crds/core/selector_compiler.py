@@ -0,0 +1,299 @@
+"""This module compiles the Selector tree of an rmap into generated Python
+functions specialized for that tree.   Compiled lookups select the same choices
+as Selector.choose() without walking generic Selector objects, generators,
+MatchSelections,  or per-call verbose logging:
+
+- Match selectors become a dict dispatch on the tuple of header values,  with
+  every combination of literal match values ranked ahead of time by the
+  interpreted winnowing match,  and other values ranked as they are seen.
+
+- UseAfter and VersionAfter selectors bisect their precomputed sorted keys inline.
+
+- Other selectors are called as-is.
+
+Compilation only covers the common cases.   A lookup the compiled code cannot
+decide exactly,  e.g. a header value matched only by a wild card,  a date before
+all UseAfter dates,  an ambiguous match,  or a nested failure,  raises
+CompiledLookupFallback or another exception and should be retried with the
+interpreted Selector.choose(),  which also defines any error.
+
+>>> from crds.core import selectors
+>>> m = selectors.MatchSelector(("DETECTOR", "CCDAMP"), {
+...    ('HRC', 'A|B') : selectors.UseAfterSelector(("DATE-OBS",), {
+...         '2003-09-26 01:28:00' : 'hrc_1.fits',
+...         '2004-02-14 00:00:00' : 'hrc_2.fits',
+...    }),
+...    ('WFC', '*') : 'wfc.fits',
+... })
+>>> compiled = compile_selector(m)
+
+>>> compiled({'DETECTOR': 'HRC', 'CCDAMP': 'B', 'DATE-OBS': '2004-01-01 00:00:00'})
+'hrc_1.fits'
+
+>>> compiled({'DETECTOR': 'WFC', 'CCDAMP': 'C', 'DATE-OBS': '2004-01-01 00:00:00'})
+'wfc.fits'
+
+>>> compiled({'DETECTOR': 'HRC', 'CCDAMP': 'A', 'DATE-OBS': '2000-01-01 00:00:00'})
+Traceback (most recent call last):
+...
+crds.core.selector_compiler.CompiledLookupFallback
+
+>>> m.choose({'DETECTOR': 'HRC', 'CCDAMP': 'A', 'DATE-OBS': '2000-01-01 00:00:00'})
+Traceback (most recent call last):
+...
+crds.core.exceptions.MatchingError: No match found.
+"""
+import bisect
+import itertools
+
+from . import log, selectors
+
+# ===================================================================
+
+# Match tuples with more combinations of literal values than this are ranked
+# as they are looked up rather than expanded into the dispatch table up front.
+MAX_MATCH_COMBINATIONS = 1000
+
+# Header values beyond this many distinct tuples per Match selector are ranked
+# but not added to its dispatch table.
+MAX_DISPATCH_SIZE = 10000
+
+class CompiledLookupFallback(Exception):
+    """The compiled lookup can't decide the result,  use the interpreted Selector."""
+
+# ===================================================================
+
+class CompiledSelector:
+    """A callable compiled form of a Selector tree,  compiled_selector(header) returns
+    the same choice as selector.choose(header) or raises an exception.
+
+    Only the generated source and its constants are pickled,  the source is
+    re-executed when unpickled.
+    """
+    def __init__(self, source, constants):
+        self.source = source
+        self.constants = constants
+        self._lookup = self._exec()
+
+    def __repr__(self):
+        return self.__class__.__name__ + "(nlines=" + str(len(self.source.splitlines())) + ")"
+
+    def _exec(self):
+        """Execute the generated source and return its lookup function."""
+        namespace = dict(self.constants)
+        namespace.update(_bisect=bisect.bisect_right, _Fallback=CompiledLookupFallback)
+        exec(compile(self.source, "<compiled selector>", "exec"), namespace)
+        return namespace["lookup"]
+
+    def __call__(self, header):
+        return self._lookup(header)
+
+    def __getstate__(self):
+        return dict(source=self.source, constants=self.constants)
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._lookup = self._exec()
+
+# ===================================================================
+
+class SelectorCompiler:
+    """Generates the source and constants of a CompiledSelector from a Selector tree.
+    Each node of the tree becomes a function _node_<n>(header).
+    """
+    def __init__(self):
+        self.lines = []
+        self.constants = {}
+        self.nodes = 0
+        self.tables = 0
+
+    def compile(self, selector):
+        """Return the CompiledSelector for `selector`."""
+        root = self.node(selector)
+        self.lines.append("lookup = " + root)
+        return CompiledSelector("\n".join(self.lines) + "\n", self.constants)
+
+    def constant(self, prefix, value):
+        """Add `value` to the namespace of the generated code,  returning its name."""
+        name = "_" + prefix + "_" + str(len(self.constants))
+        self.constants[name] = value
+        return name
+
+    def node(self, choice):
+        """Generate the function which looks up `choice` and return its name."""
+        name = "_node_" + str(self.nodes)
+        self.nodes += 1
+        if isinstance(choice, selectors.MatchSelector):
+            body = self.match_node(choice)
+        elif type(choice) in (selectors.UseAfterSelector, selectors.VersionAfterSelector):
+            body = self.useafter_node(choice)
+        elif isinstance(choice, selectors.Selector):
+            body = ["return " + self.constant("selector", choice) + ".choose(header)"]
+        else:
+            body = ["return " + self.constant("value", choice)]
+        self.lines.append("def " + name + "(header):")
+        self.lines.extend("    " + line for line in body)
+        return name
+
+    def choose_index(self, choices):
+        """Return the statement which returns the choice at `index` of `choices`.   Leaf
+        choices are returned directly,  otherwise each choice gets a node function.
+        """
+        choices = list(choices)
+        if not any(isinstance(choice, selectors.Selector) for choice in choices):
+            return "return " + self.constant("choices", tuple(choices)) + "[index]"
+        name = "_branches_" + str(self.tables)
+        self.tables += 1
+        names = [self.node(choice) for choice in choices]
+        self.lines.append(name + " = (" + "".join(node + ", " for node in names) + ")")
+        return "return " + name + "[index](header)"
+
+    def match_node(self, selector):
+        """Return the body of a dict dispatch on the values of the parameters of
+        MatchSelector `selector`.
+        """
+        dispatch = MatchDispatch(selector)
+        values = "(" + "".join("header.get(" + repr(par) + "), " for par in selector._parameters) + ")"
+        return [
+            "values = " + values,
+            "index = " + self.constant("dispatch", dispatch.table) + ".get(values)",
+            "if index is None:",
+            "    index = " + self.constant("extend", dispatch.extend) + "(values)",
+            "if index < 0:",
+            "    if index == -1:",
+            "        raise _Fallback",
+            "    return " + self.constant("merged", dispatch.merged_choice) + "(index, header)",
+            self.choose_index(selection.choice for selection in selector._match_selections.values()),
+        ]
+
+    def useafter_node(self, selector):
+        """Return the body of an inline bisection of the keys of UseAfterSelector `selector`."""
+        return [
+            "index = _bisect(" + self.constant("keys", selector._selection_keys) + ", " +
+            self.constant("validate", selector._validate_header) + "(header)) - 1",
+            "if index < 0:",
+            "    raise _Fallback",
+            self.choose_index(selector.choices()),
+        ]
+
+# ===================================================================
+
+class MatchDispatch:
+    """Maps tuples of header values onto the index of the match tuple which the
+    interpreted lookup of a MatchSelector tries first,  or -1 if that is undecided
+    because the values are invalid,  missing,  or match ambiguously without merging.
+    Indices below -1 refer to equally weighted match tuples which are merged.
+
+    Every combination of literal match values is ranked up front.   Other values,
+    e.g. those matched by wild cards,  are ranked on first lookup and added to
+    the table until it reaches MAX_DISPATCH_SIZE.
+    """
+    def __init__(self, selector):
+        self.selector = selector
+        self.indices = { match_tuple : i for (i, match_tuple) in enumerate(selector._match_selections) }
+        self.table = {}
+        self.merged = []
+        self.merged_indices = {}
+        for matchers in (selection.key for selection in selector._match_selections.values()):
+            literals = [selectors.MatchIndex._literal_values(matcher_) for matcher_ in matchers]
+            if None in literals:
+                continue
+            combinations = 1
+            for values in literals:
+                combinations *= len(values)
+            if combinations > MAX_MATCH_COMBINATIONS:
+                log.verbose("Not precompiling", combinations, "combinations of", repr(matchers), verbosity=60)
+                continue
+            for values in itertools.product(*literals):
+                if values not in self.table:
+                    self.table[values] = self.rank(values)
+
+    def rank(self, values):
+        """Return the index of the match tuple tried first for header `values`,  or -1."""
+        if None in values:   # missing parameter
+            return -1
+        header = dict(zip(self.selector._parameters, values))
+        try:
+            self.selector._check_defined(header)
+            self.selector._validate_header(header)
+            ranked = self.selector._rank_candidates(*self.selector._winnow(header))
+        except Exception:
+            return -1
+        if not ranked:
+            return -1
+        match_tuples = ranked[0][1]
+        if len(match_tuples) == 1:
+            return self.indices[match_tuples[0]]
+        if match_tuples not in self.merged_indices:
+            if not self.selector._merge_overlaps:
+                return -1
+            choices = tuple(self.selector._match_selections[match_tuple].choice for match_tuple in match_tuples)
+            try:
+                merged = self.selector.merge_group(choices) if isinstance(choices[0], selectors.Selector) else choices
+            except Exception:
+                return -1
+            self.merged_indices[match_tuples] = -2 - len(self.merged)
+            self.merged.append(merged)
+        return self.merged_indices[match_tuples]
+
+    def merged_choice(self, index, header):
+        """Return the choice for `header` of the merged selections at dispatch `index`."""
+        choice = self.merged[-2 - index]
+        return choice.choose(header) if isinstance(choice, selectors.Selector) else choice
+
+    def extend(self, values):
+        """Rank header `values` which are not yet in the table,  adding them if there is room."""
+        index = self.rank(values)
+        if len(self.table) < MAX_DISPATCH_SIZE:
+            self.table[values] = index
+        return index
+
+# ===================================================================
+
+def compile_selector(selector):
+    """Return the CompiledSelector for the Selector tree rooted at `selector`."""
+    return SelectorCompiler().compile(selector)
+
+# ===================================================================
+
+def check_compiled(rmapping, headers):
+    """Correctness harness which looks up each of `headers` with both the compiled
+    and interpreted selectors of ReferenceMapping `rmapping`.   Compiled lookups
+    which fall back are checked the same way as lookups which don't.
+
+    Returns  [ (header, interpreted_choice, compiled_choice), ... ]  for disagreements.
+    """
+    compiled = rmapping.compiled_selector()
+    mismatches = []
+    for header in headers:
+        try:
+            header = rmapping._lookup_header(dict(header))
+        except Exception:   # omitted,  irrelevant,  or invalid before selection
+            continue
+        interpreted = _choice_or_exception(rmapping.selector.choose, header)
+        result = _choice_or_exception(compiled, header)
+        if isinstance(result, Exception):
+            result = interpreted
+        if _comparable(result) != _comparable(interpreted):
+            mismatches.append((header, interpreted, result))
+    return mismatches
+
+def _choice_or_exception(lookup, header):
+    try:
+        return lookup(header)
+    except Exception as exc:
+        return exc
+
+def _comparable(result):
+    return (type(result), str(result)) if isinstance(result, Exception) else result
+
+# ===================================================================
+
+def test():
+    """Run module doctests."""
+    import doctest
+    from crds.core import selector_compiler
+    return doctest.testmod(selector_compiler, optionflags=doctest.IGNORE_EXCEPTION_DETAIL)
+
+if __name__ == "__main__":
+    print(test())
@@ -89,7 +89,9 @@ import os
 import re
 import fnmatch
 import sys
+import bisect
 import numbers
+import operator
 from collections import namedtuple
 import ast
 import copy
@@ -106,6 +108,12 @@ from .exceptions import (ValidationError, CrdsLookupError,
                          InvalidDatetimeError,
                          VersionAfterError,
                          MappingInsertionError)
+
+# Dates and times as nominally written in UseAfter rmaps,  which order the same way
+# as strings and as datetime64 relative to dates formatted by timestamp.reformat_date().
+
+STANDARD_DATETIME_RE = re.compile(r"^\d\d\d\d-\d\d-\d\d \d\d:\d\d:\d\d$")
+
 # ==============================================================================
 
 def glob_list(value):
@@ -201,17 +209,48 @@ def dict_wo_dups(items):
         d[key] = value
     return d
 
+def batch_headers(headers):
+    """Return a batch of lookup `headers` as a list of header dictionaries.   The
+    batch is either a sequence of header dictionaries or a dictionary of equal
+    length value columns,  e.g. NumPy string arrays,  one per parameter.
+
+    >>> batch_headers([{'DETECTOR': 'HRC'}])
+    [{'DETECTOR': 'HRC'}]
+
+    >>> import numpy as np
+    >>> pp(batch_headers({'DETECTOR': np.array(['HRC', 'WFC']), 'CCDAMP': ['A', 'B']}))
+    [{'CCDAMP': 'A', 'DETECTOR': 'HRC'}, {'CCDAMP': 'B', 'DETECTOR': 'WFC'}]
+    """
+    if isinstance(headers, dict):
+        names = list(headers)
+        return [dict(zip(names, [str(value) for value in values]))
+                for values in zip(*[headers[name] for name in names])]
+    return list(headers)
+
+# ==============================================================================
+
 # Selections are items from a Selector's dictionary.   Portions of the lookup return both.
 # A "choice" is a Selector's ultimate choose() return value,  e.g. a filename or other Selector.
 # Selection = namedtuple("Selection", ("key", "choice"))
 
 class Selection(tuple):
+    """A (key, choice) item of a Selector.   Selections have no instance __dict__,
+    key and choice are read-only views of the tuple items.
+
+    >>> s = Selection(("2003-09-26 01:28:00", "nal1503ij_bia.fits"))
+    >>> s.key, s.choice
+    ('2003-09-26 01:28:00', 'nal1503ij_bia.fits')
+    """
+    __slots__ = ()
+
     def __new__(cls, t):
         return super(Selection, cls).__new__(cls, t)
 
-    def __init__(self, t):
-        self.key = t[0]
-        self.choice = t[1]
+    key = property(operator.itemgetter(0))
+    choice = property(operator.itemgetter(1))
+
+    def __setstate__(self, state):
+        """Ignore the key and choice __dict__ of pickles made before Selections had slots."""
 
     def _cmp_key(self, key):
         return tuple(str(field) for field in key) if isinstance(key, tuple) else (str(key),)
@@ -556,6 +595,84 @@ class Selector:
         more_info = " last exception: " + str(last_exc) if last_exc else ""
         raise CrdsLookupError("All lookup attempts failed." + more_info)
 
+    def choose_many(self, headers):
+        """Batch form of choose() for `headers`,  a list of header dictionaries or a
+        dictionary of value columns,  see batch_headers().
+
+        Headers are grouped by lookup key so each distinct key is only selected once,
+        and nested selectors are passed each group as a batch.
+
+        Returns [ choice or exception, ... ]  with one result per header,  either the
+        value choose() returns or the exception it raises for that header.
+        """
+        headers = batch_headers(headers)
+        results = [None] * len(headers)
+        lookups = {}
+        for i, header in enumerate(headers):
+            try:
+                self._check_defined(header)
+                lookup_key = self._validate_header(header)
+            except Exception as exc:
+                results[i] = exc
+            else:
+                lookups.setdefault(self._lookup_group(lookup_key), (lookup_key, []))[1].append(i)
+        for selections, rows in self._selection_groups(list(lookups.values())):
+            self._choose_rows(selections, rows, headers, results)
+        return results
+
+    def _lookup_group(self, lookup_key):
+        """Return a hashable key identifying the headers which share `lookup_key`."""
+        return lookup_key
+
+    def _selection_groups(self, lookups):
+        """Given `lookups`,  a list of (lookup_key, rows) pairs,  generate the
+        corresponding (weighted selections iterable, rows) pairs.
+        """
+        for lookup_key, rows in lookups:
+            yield self.get_selection(lookup_key), rows
+
+    def _choose_rows(self, selections, rows, headers, results):
+        """Batch form of the choose() loop over weighted `selections`,  storing the
+        choice or exception for each of the `rows` of `headers` in `results`.
+        """
+        last_exc = {}
+        try:
+            for selection in selections:
+                log.verbose("Trying", selection, verbosity=60)
+                choices = self.get_choice_many(selection, [headers[i] for i in rows])
+                remaining = []
+                for i, choice in zip(rows, choices):
+                    if isinstance(choice, CrdsLookupError):
+                        last_exc[i] = choice
+                        remaining.append(i)
+                    else:
+                        results[i] = choice
+                rows = remaining
+                if not rows:
+                    return
+        except Exception as exc:
+            for i in rows:
+                results[i] = exc
+            return
+        for i in rows:
+            more_info = " last exception: " + str(last_exc[i]) if i in last_exc else ""
+            results[i] = CrdsLookupError("All lookup attempts failed." + more_info)
+
+    def get_choice_many(self, selection, headers):
+        """Batch form of get_choice(),  recursing into nested selectors with choose_many().
+
+        Returns [ choice or exception, ... ]  one per header of `headers`.
+        """
+        if isinstance(selection, Selection) and isinstance(selection.choice, Selector):
+            return selection.choice.choose_many(headers)
+        results = []
+        for header in headers:
+            try:
+                results.append(self.get_choice(selection, header))
+            except Exception as exc:
+                results.append(exc)
+        return results
+
     def get_selection(self, lookup_key):
         """Most selectors are based on a sorted items list which represents a
         dictionary.  get_selection() typically returns one such item,  both the
@@ -807,6 +924,21 @@ class Selector:
                     matches.append(here)
         return sorted(matches)
 
+    def all_file_matches(self, sofar=(), matches=None):
+        """Return { filename : [match keys, ...] } for every filename selected by this
+        Selector tree,  adding to and returning dict `matches` if specified.   This
+        collects file_matches() for all files with one walk of the tree.
+        """
+        if matches is None:
+            matches = {}
+        for key, value in self._raw_selections:
+            here = tuple(sofar + (self.match_item(key),))
+            if isinstance(value, Selector):
+                value.all_file_matches(here, matches)
+            elif isinstance(value, str):
+                matches.setdefault(value, []).append(here)
+        return matches
+
     def match_item(self, key):
         """Return ((parkey, key_field), ...) for match key `key`.   Fix string `key`s to unary tuples."""
         if not isinstance(key, tuple):
@@ -823,8 +955,15 @@ class Selector:
         """Remove all instances of `terminal` from `self`."""
         deleted = self._delete(self._selections, terminal)
         deleted += self._delete( self._raw_selections, terminal)
+        if deleted:
+            self._init_search()
         return deleted
 
+    def _init_search(self):
+        """Precompute any search state derived from the selections,  recomputed when
+        selections are deleted.   Overridden by selectors which search precomputed keys.
+        """
+
     def _delete(self, selections, terminal):
         """Remove all instances of `terminal` from `selections`.   Directly mutates selections."""
         deleted = 0
@@ -1219,10 +1358,29 @@ def different_match_weight(subkey, superkey):
 class Matcher:
     """Matches a single key of a matching tuple to a dataset value.  Every
     key of a MatchSelector will have a tuple of corresponding Matchers.
+
+    Matchers are immutable and have no instance __dict__.   Those created by
+    matcher() are interned and pickle as their match key,  re-interning them
+    when unpickled.
     """
+    __slots__ = ("_key", "_spec")
+
     def __init__(self, key):
         self._key = key
 
+    def __reduce_ex__(self, protocol):
+        spec = getattr(self, "_spec", None)
+        if spec is None:
+            return super(Matcher, self).__reduce_ex__(protocol)
+        return (matcher, (spec,))
+
+    def __setstate__(self, state):
+        """Restore slot `state`,  or the __dict__ state of pickles made before Matchers had slots."""
+        if isinstance(state, tuple):   # (None, slot state)
+            state = state[1]
+        for name, value in state.items():
+            setattr(self, name, value)
+
     def match(self, value):
         """Return 1 (match),  0 (don't care), or -1 (no match).
         """
@@ -1238,9 +1396,11 @@ class Matcher:
 
 class RegexMatcher(Matcher):
     """Matcher for raw regular expressions."""
+    __slots__ = ("_regex",)
+
     def __init__(self, key):
         super(RegexMatcher, self).__init__(key)
-        self._regex = re.compile(key)
+        self._regex = intern_regex(key)
 
     def match(self, value):
         result = super(RegexMatcher, self).match(value)
@@ -1299,11 +1459,14 @@ class GlobMatcher(RegexMatcher):
     >>> p.match("N/A")
     0
     """
+    __slots__ = ("_glob",)
+
     def __init__(self, key):
         parts = glob_list(key)
         exprs = [fnmatch.translate(part) for part in parts]
         new_key = "^(" + "|".join(exprs) + ")$"
         super(GlobMatcher, self).__init__(new_key)
+        self._glob = key
         # To support automatic refactoring in the refactor module,  also
         # match on the original key such as A|B|C|D
 
@@ -1329,6 +1492,8 @@ class InequalityMatcher(Matcher):
     >>> m.match("N/A")
     0
     """
+    __slots__ = ("_operator", "_value")
+
     def __init__(self, key):
         super(InequalityMatcher, self).__init__(key)
         parts = re.match(
@@ -1355,6 +1520,8 @@ class BinaryMatcher(Matcher):
     """A matcher which supports logical "or" and "and" for relational
     expressions.
     """
+    __slots__ = ("_operator", "_matcher1", "_matcher2")
+
     def __init__(self, key, operator):
         super(BinaryMatcher, self).__init__(key)
         self._operator = operator.strip()
@@ -1381,6 +1548,8 @@ class BinaryMatcher(Matcher):
 
 class NaMatcher(Matcher):
     """Matcher that always matches,  simplifies/speeds code elsewhere."""
+    __slots__ = ()
+
     def __init__(self, key="N/A"):
         super(NaMatcher, self).__init__(key)
 
@@ -1391,6 +1560,8 @@ class NaMatcher(Matcher):
 
 class NotMatcher(Matcher):
     """Matcher which matches the negation of `key`."""
+    __slots__ = ("_unnegated_matcher",)
+
     def __init__(self, key):
         super(NotMatcher, self).__init__(key)
         self._unnegated_matcher = matcher(key[len("NOT "):].strip())
@@ -1427,7 +1598,51 @@ def esoteric_key(key):
     key = key.upper()
     return key.startswith(("{","(","#")) and key.endswith(("}",")","#")) or key.startswith("BETWEEN") or key.startswith("NOT")
 
+# Interned Matchers and compiled regexes shared by all MatchSelectors,  keyed by
+# their rmap match key or regex pattern respectively.
+INTERN_MATCHERS = True
+_MATCHERS = {}
+_REGEXES = {}
+
 def matcher(key):
+    """Return the interned Matcher for match `key`,  creating it on first use.
+    Identical keys of all loaded rmaps share one Matcher,  e.g. '*' or 'N/A'.
+
+    >>> matcher("HRC|WFC") is matcher("HRC|WFC")
+    True
+
+    See make_matcher() for the kinds of keys.
+    """
+    if not INTERN_MATCHERS:
+        return make_matcher(key)
+    try:
+        return _MATCHERS[key]
+    except KeyError:
+        new = make_matcher(key)
+        new._spec = key
+        return _MATCHERS.setdefault(key, new)
+    except TypeError:   # unhashable,  e.g. a list
+        return make_matcher(key)
+
+def intern_regex(pattern):
+    """Return the shared compiled regex for `pattern`."""
+    if not INTERN_MATCHERS:
+        return re.compile(pattern)
+    try:
+        return _REGEXES[pattern]
+    except KeyError:
+        return _REGEXES.setdefault(pattern, re.compile(pattern))
+
+def clear_matchers():
+    """Drop the interned Matchers and regexes.   Matchers already in use are unaffected."""
+    _MATCHERS.clear()
+    _REGEXES.clear()
+
+def matcher_stats():
+    """Return { "matchers" : count of interned Matchers,  "regexes" : count of interned regexes }"""
+    return dict(matchers=len(_MATCHERS), regexes=len(_REGEXES))
+
+def make_matcher(key):
     """Factory for different matchers based on key types.
 
     A tuple of values is treated as an or-ed glob expression.
@@ -1646,6 +1861,137 @@ class MatchSelection(Selection):
     and there are indeed multiple equal weighted keys.   Note that a MatchSelection still
     reduces to a single merged choice.
     """
+    __slots__ = ()
+
+GLOB_SPECIAL_CHARS = ("*", "?", "[")
+
+class MatchIndex:
+    """MatchIndex is an inverted index over the match tuples of a MatchSelector
+    which replaces calling every Matcher of every match tuple with a few integer
+    bitset operations per parameter.
+
+    Match tuples are numbered in the order of the MatchSelector's selections.   For
+    each parameter,  literal match values (simple strings and or-globs of simple
+    strings) map to the bitset of tuples which match that value exactly.   "Don't care"
+    N/A clauses form a separate bitset,  and matchers which can't be indexed,  e.g.
+    regexes,  wild card globs,  and inequalities,  are kept as residuals evaluated
+    only for surviving candidates.
+
+    >>> m = MatchSelector(("foo","bar"), {
+    ...    ('1.0', 'N/A') : "100",
+    ...    ('1.0', '2.0|3.0') : "200",
+    ...    ('4.0', '*') : "300",
+    ...    ('>5', '3.0') : "400",
+    ... })
+    >>> index = m._match_index
+
+    >>> index.winnow({"foo":"1.0", "bar":"3.0"})
+    ({('1.0', '2.0|3.0'): -2, ('1.0', 'N/A'): -1}, [('1.0', '2.0|3.0'), ('1.0', 'N/A')])
+
+    >>> index.winnow({"foo":"6", "bar":"3.0"})
+    ({('>5', '3.0'): -2}, [('>5', '3.0')])
+
+    >>> index.winnow({"foo":"*", "bar":"N/A"})
+    ({('1.0', '2.0|3.0'): -1, ('1.0', 'N/A'): -1, ('4.0', '*'): -1, ('>5', '3.0'): -1}, [('1.0', '2.0|3.0'), ('1.0', 'N/A'), ('4.0', '*'), ('>5', '3.0')])
+
+    >>> index.winnow({"foo":"2.0", "bar":"3.0"})
+    ({}, [])
+    """
+    def __init__(self, parameters, match_selections):
+        self._match_tuples = tuple(match_selections.keys())
+        self._all = (1 << len(self._match_tuples)) - 1
+        self._parameter_indices = []
+        for i, parameter in enumerate(parameters):
+            matchers = [selection.key[i] for selection in match_selections.values()]
+            self._parameter_indices.append((parameter,) + self._index_parameter(matchers))
+
+    def __repr__(self):
+        return self.__class__.__name__ + "(nselections=" + str(len(self._match_tuples)) + ")"
+
+    @classmethod
+    def _index_parameter(cls, matchers):
+        """Return (literals, indexed, na_literal, dont_care, residuals) describing the
+        Matchers for one parameter of every match tuple.
+
+        literals     { value : bitset of tuples which match `value` exactly }
+        indexed      bitset of all tuples with literal matchers
+        na_literal   bitset of tuples whose literal matcher is the value 'N/A'
+        dont_care    bitset of tuples with NaMatcher's,  always "don't care"
+        residuals    [(bit, Matcher), ...] for matchers which must be evaluated
+        """
+        literals = {}
+        indexed = na_literal = dont_care = 0
+        residuals = []
+        for j, matcher_ in enumerate(matchers):
+            bit = 1 << j
+            values = cls._literal_values(matcher_)
+            if isinstance(matcher_, NaMatcher):
+                dont_care |= bit
+            elif values is None:
+                residuals.append((bit, matcher_))
+            else:
+                indexed |= bit
+                if type(matcher_) is Matcher and matcher_._key == "N/A":
+                    na_literal |= bit
+                for value in values:
+                    literals[value] = literals.get(value, 0) | bit
+        return literals, indexed, na_literal, dont_care, tuple(residuals)
+
+    @staticmethod
+    def _literal_values(matcher_):
+        """Return the values which `matcher_` matches exactly or None if `matcher_`
+        cannot be reduced to a set of literal values.
+        """
+        if type(matcher_) is Matcher:
+            return [matcher_._key]
+        elif type(matcher_) is GlobMatcher:
+            parts = glob_list(matcher_._glob)
+            if any(char in part for part in parts for char in GLOB_SPECIAL_CHARS):
+                return None
+            # Matcher.match() also accepts the regex itself,  index it for equivalence.
+            return parts + [matcher_._key]
+        else:
+            return None
+
+    def winnow(self, header):
+        """Based on the parkey values in `header` determine the match tuples which
+        survive matching.  Weight each by -1 for each parameter which matches
+        exactly and 0 for each "don't care" parameter.
+
+        Returns ({ match_tuple : weight, ...},  [surviving match_tuples, ...])
+
+        where the surviving match tuples are in selection order.
+        """
+        candidates = self._all
+        exact_masks = []
+        for parameter, literals, indexed, na_literal, dont_care, residuals in self._parameter_indices:
+            value = header.get(parameter, "UNDEFINED")
+            if value == "*":
+                exact, dont_care_here = indexed, dont_care
+            elif value == "N/A":
+                exact, dont_care_here = na_literal, dont_care | (indexed & ~na_literal)
+            else:
+                exact, dont_care_here = literals.get(value, 0), dont_care
+            for bit, matcher_ in residuals:
+                if candidates & bit:
+                    status = matcher_.match(value)
+                    if status == 1:
+                        exact |= bit
+                    elif status == 0:
+                        dont_care_here |= bit
+            candidates &= exact | dont_care_here
+            if not candidates:
+                return {}, []
+            exact_masks.append(exact)
+        survivors = []
+        weights = {}
+        while candidates:
+            bit = candidates & -candidates   # lowest set bit,  selection order
+            candidates ^= bit
+            match_tuple = self._match_tuples[bit.bit_length() - 1]
+            survivors.append(match_tuple)
+            weights[match_tuple] = -sum(1 for exact in exact_masks if exact & bit)
+        return weights, survivors
 
 class MatchSelector(Selector):
     """Matching selector does a modified dictionary lookup by directly matching
@@ -1826,8 +2172,15 @@ Restore original debug behavior:
     def __init__(self, parameters, selections, rmap_header={}):
         super(MatchSelector, self).__init__(parameters, selections, rmap_header)
         self._match_selections = self.get_matcher_selections(dict_wo_dups(self._selections))
+        self._match_index = MatchIndex(self._parameters, self._match_selections)
         self._value_map = self.get_value_map()
 
+    def __setstate__(self, state):
+        """Restore pickled MatchSelector,  building the match index if the pickle predates it."""
+        self.__dict__.update(state)
+        if "_match_index" not in state:
+            self._match_index = MatchIndex(self._parameters, self._match_selections)
+
     def _equal_keys(self, key1, key2):
         """Return True IFF `key1` is equivalent to `key2` for rmap modification.  Ignore comment pars."""
         key1, key2 = self.condition_key(key1), self.condition_key(key2)
@@ -1884,6 +2237,10 @@ Restore original debug behavior:
             selections[keytuple] = MatchSelection((tuple(matchers), choice))
         return selections
 
+    def _lookup_group(self, header):
+        """Matching depends only on the values of this selector's parameters."""
+        return tuple(header.get(par) for par in self._parameters)
+
     def get_selection(self, header):
         """Get the matching selection for `self` based on parameters in `header`.
 
@@ -1901,7 +2258,7 @@ Restore original debug behavior:
         Successively yield any survivors,  in the order of most specific
         matching value (fewest *'s) to least specific matching value.
         """
-        weights, remaining = self._winnow(header, dict(self._match_selections))
+        weights, remaining = self._winnow(header)
 
         sorted_candidates = self._rank_candidates(weights, remaining)
 
@@ -1922,13 +2279,25 @@ Restore original debug behavior:
             yield MatchSelection((match_tuples, selector))
         raise MatchingError("No match found.")
 
-    def _winnow(self, header, remaining):
+    def _winnow(self, header):
         """Based on the parkey values in `header`, winnow out selections
-        from `remaining` which cannot possibly match.  For each surviving
-        selection,  weight each parkey which matches exactly as -1 and
-        "don't care" matches as 0.
+        which cannot possibly match using the precomputed match index.  For
+        each surviving selection,  weight each parkey which matches exactly as
+        -1 and "don't care" matches as 0.
+
+        returns   ( {match_tuple:weight ...},   remaining_selections )
+        """
+        weights, survivors = self._match_index.winnow(header)
+        log.verbose("Surviving match tuples", survivors, verbosity=60)
+        remaining = { match_tuple : self._match_selections[match_tuple] for match_tuple in survivors }
+        return weights, remaining
+
+    def _linear_winnow(self, header, remaining):
+        """Reference implementation of _winnow() which calls the Matcher of every
+        remaining selection for every parameter.   Retained to verify and benchmark
+        the match index.
 
-        returns   ( {match_tuple:weight ...},   remaining_selections
+        returns   ( {match_tuple:weight ...},   remaining_selections )
         """
         # weights counts the # of parkey value matches, establishing a
         # goodness-of-match weighting.  negative weights are better matches
@@ -2215,12 +2584,66 @@ Restore debug configuration.
     """
     error_class = UseAfterError
 
+    def __init__(self, *args, **keys):
+        super(UseAfterSelector, self).__init__(*args, **keys)
+        self._init_search()
+
+    def __setstate__(self, state):
+        """Restore pickled UseAfterSelector,  building the search keys if the pickle predates them."""
+        self.__dict__.update(state)
+        if "_key_times" not in state:
+            self._init_search()
+
+    def _init_search(self):
+        """Precompute the sorted list of conditioned keys searched by get_selection().
+
+        When every key is a standard form date/time,  also precompute them as a
+        datetime64 array for vectorized lookups by choose_many().
+        """
+        self._selection_keys = self.keys()
+        self._key_times = None
+        if all(isinstance(key, str) and STANDARD_DATETIME_RE.match(key) for key in self._selection_keys):
+            import numpy as np
+            try:
+                self._key_times = np.array(self._selection_keys, dtype="datetime64[us]")
+            except ValueError:   # invalid dates are reported by validate_selector() or bsearch()
+                pass
+
     def get_selection(self, date):
         log.verbose("Matching", date, " ", verbosity=60)
-        yield self.bsearch(date, self._selections)
+        yield self.bsearch(date)
 
-    def bsearch(self, date, selections):
-        """Do a binary search over a sorted selections list."""
+    def bsearch(self, date):
+        """Return the selection with the greatest key <= `date` by bisecting the
+        precomputed sorted keys,  else raise self.error_class.
+        """
+        index = bisect.bisect_right(self._selection_keys, date) - 1
+        if index < 0:
+            raise self.error_class("No selection <= " + repr(date))
+        log.verbose("matched", repr(self._selections[index]), verbosity=60)
+        return self._selections[index]
+
+    def _selection_groups(self, lookups):
+        """Bisect the dates of all `lookups` at once using np.searchsorted() over
+        the datetime64 keys.   Dates preceding every key are left to get_selection()
+        to raise the appropriate error.
+        """
+        if self._key_times is None or not lookups:
+            yield from super(UseAfterSelector, self)._selection_groups(lookups)
+            return
+        import numpy as np
+        dates = np.array([date for (date, _rows) in lookups], dtype="datetime64[us]")
+        indices = np.searchsorted(self._key_times, dates, side="right") - 1
+        for (date, rows), index in zip(lookups, indices):
+            if index < 0:
+                yield self.get_selection(date), rows
+            else:
+                yield (self._selections[index],), rows
+
+    def _sliced_bsearch(self, date, selections):
+        """Reference implementation of bsearch() which recursively slices `selections`.
+        Retained to verify and benchmark bsearch().
+        """
         if len(selections) == 0:
             raise self.error_class("No selection <= " + repr(date))
         elif len(selections) > 1:
@@ -2229,9 +2652,9 @@ Restore debug configuration.
             compared = right[0].key
             log.verbose("...against", compared, end="", verbosity=60)
             if date >= compared:
-                return self.bsearch(date, right)
+                return self._sliced_bsearch(date, right)
             else:
-                return self.bsearch(date, left)
+                return self._sliced_bsearch(date, left)
         else:
             if date >= selections[0].key:
                 log.verbose("matched", repr(selections[0]), verbosity=60)
@@ -2499,11 +2922,56 @@ class ClosestTimeSelector(UseAfterSelector):
     >>> t.choose({"time":"2019-04-16 00:00:00"})
     'cref_flatfield_123.fits'
     """
+    def _init_search(self):
+        """Precompute the keys of this ClosestTime as datetimes sorted by time,
+        along with the corresponding selection indices.   If any key doesn't
+        parse,  lookups fall back to _linear_closest() which reports it.
+        """
+        super(ClosestTimeSelector, self)._init_search()
+        try:
+            dated = sorted((timestamp.parse_date(key), i) for (i, key) in enumerate(self._selection_keys))
+        except Exception:
+            dated = []
+        self._key_dates = [date for (date, _i) in dated]
+        self._key_order = [i for (_date, i) in dated]
+
     def get_selection(self, date):
+        if not self._key_dates:
+            yield self._linear_closest(date)
+            return
+        time = timestamp.parse_date(date)
+        dates = self._key_dates
+        pos = bisect.bisect_left(dates, time)
+        low, high = max(pos - 1, 0), min(pos, len(dates) - 1)
+        best = min(self._time_delta(dates[low], time), self._time_delta(dates[high], time))
+        # Deltas are compared in single precision so neighbors may tie;  like
+        # np.argmin,  choose the earliest selection of those which tie.
+        while low > 0 and self._time_delta(dates[low - 1], time) == best:
+            low -= 1
+        while high < len(dates) - 1 and self._time_delta(dates[high + 1], time) == best:
+            high += 1
+        index = min(self._key_order[i] for i in range(low, high + 1)
+                    if self._time_delta(dates[i], time) == best)
+        yield self._selections[index]
+
+    def _selection_groups(self, lookups):
+        """ClosestTime doesn't bisect for the greatest key <= date,  select each lookup individually."""
+        return Selector._selection_groups(self, lookups)
+
+    @staticmethod
+    def _time_delta(date1, date2):
+        """Return abs(date1 - date2) in total seconds as float32."""
+        import numpy as np
+        return np.float32(abs((date1 - date2).total_seconds()))
+
+    def _linear_closest(self, date):
+        """Reference implementation of get_selection() which computes the delta
+        to every key.   Retained to verify and benchmark get_selection().
+        """
         import numpy as np
         diff = np.array([abs_time_delta(date, key) for key in self.keys()], 'f')
         index = np.argmin(diff)
-        yield self._selections[index]
+        return self._selections[index]
 
 # ==============================================================================
 
@@ -2558,17 +3026,96 @@ Effective_wavelength doesn't have to be covered by valid_values_map:
     ...
     ValidationError: GeometricallyNearest Invalid number for 'effective_wavelength' value='foo'
 
+
+Lookups search keys sorted by value,  ties resolve to the first selection:
+
+    >>> r.choose({"effective_wavelength":'1.35'}) == r._linear_nearest(1.35).choice
+    True
+
+Batched lookups search for all values at once:
+
+    >>> [selection.choice for selection in r.get_selections([1.0, 3.26, 7.0])]
+    ['cref_flatfield_120.fits', 'cref_flatfield_137.fits', 'cref_flatfield_137.fits']
     """
+    def __init__(self, *args, **keys):
+        super(GeometricallyNearestSelector, self).__init__(*args, **keys)
+        self._init_search()
+
+    def __setstate__(self, state):
+        """Restore pickled GeometricallyNearestSelector,  building the sorted keys if the pickle predates them."""
+        self.__dict__.update(state)
+        if "_key_values" not in state:
+            self._init_search()
+
+    def _init_search(self):
+        """Precompute the single precision key values sorted by value,  along with the
+        corresponding selection indices.   If any key is not a number,  lookups fall
+        back to _linear_nearest() which reports it.
+        """
+        import numpy as np
+        try:
+            values = np.array(self.keys(), dtype='f')
+        except ValueError:
+            values = np.array([], dtype='f')
+        if np.isnan(values).any():
+            values = np.array([], dtype='f')
+        self._key_order = np.argsort(values, kind="stable")
+        self._key_values = values[self._key_order]
+
     @classmethod
     def condition_key(cls, key):
         return utils.condition_value(key)
 
     def get_selection(self, keyval):
+        yield self.get_selections([keyval])[0]
+
+    def get_selections(self, keyvals):
+        """Batch form of get_selection() returning the nearest selection for each
+        of the numbers `keyvals`.
+
+        Returns [ Selection, ... ]
+        """
+        import numpy as np
+        if not len(self._key_values):
+            return [self._linear_nearest(keyval) for keyval in keyvals]
+        positions = np.searchsorted(self._key_values, np.array(keyvals, dtype=float))
+        return [self._nearest(keyval, pos) for (keyval, pos) in zip(keyvals, positions)]
+
+    def _nearest(self, keyval, pos):
+        """Return the selection nearest `keyval` given its sorted insertion position `pos`.
+        Distances are single precision so neighboring keys may tie;  like np.argmin,
+        choose the first selection of those which tie.
+        """
+        import numpy as np
+        values = self._key_values
+        low, high = max(pos - 2, 0), min(pos + 2, len(values))
+        while True:
+            distances = np.abs(values[low:high] - keyval)   # single precision as in _linear_nearest()
+            best = distances.min()
+            if np.isnan(best):
+                return self._linear_nearest(keyval)
+            if (low > 0 and distances[0] == best) or (high < len(values) and distances[-1] == best):
+                low, high = max(low - len(distances), 0), min(high + len(distances), len(values))
+            else:
+                break
+        tied = self._key_order[low:high][distances == best]
+        return self._selections[tied.min()]
+
+    def _linear_nearest(self, keyval):
+        """Reference implementation of get_selection() which computes the distance
+        to every key.   Retained to verify and benchmark get_selection().
+        """
         import numpy as np
         nkeys = np.array(self.keys(), dtype='f')
         diff = np.abs(nkeys - keyval)
         index = np.argmin(diff)
-        yield self._selections[index]
+        return self._selections[index]
+
+    def _selection_groups(self, lookups):
+        """Search for the values of all `lookups` at once."""
+        selections = self.get_selections([keyval for (keyval, _rows) in lookups]) if lookups else []
+        for selection, (_keyval, rows) in zip(selections, lookups):
+            yield (selection,), rows
 
     def _validate_raw_key(self, key, valid_values_map):
         parname = self._parameters[0]
@@ -2622,7 +3169,34 @@ class BracketSelector(Selector):
 
     >>> r.choose({"effective_wavelength":'6.0'})
     ('cref_flatfield_137.fits', 'cref_flatfield_137.fits')
+
+    Batched lookups search for all values at once:
+
+    >>> [(less.choice, greater.choice) for (less, greater) in r.get_selections([1.3, 5.0])]
+    [('cref_flatfield_120.fits', 'cref_flatfield_124.fits'), ('cref_flatfield_137.fits', 'cref_flatfield_137.fits')]
     """
+    def __init__(self, *args, **keys):
+        super(BracketSelector, self).__init__(*args, **keys)
+        self._init_search()
+
+    def __setstate__(self, state):
+        """Restore pickled BracketSelector,  building the sorted keys if the pickle predates them."""
+        self.__dict__.update(state)
+        if "_key_values" not in state:
+            self._init_search()
+
+    def _init_search(self):
+        """Precompute the keys as a sorted float array.   If the keys aren't all numbers,
+        lookups fall back to _linear_bracket() which compares them as they are.
+        """
+        import numpy as np
+        keys = self.keys()
+        self._key_values = None
+        if all(isinstance(key, numbers.Real) and not isinstance(key, bool) for key in keys):
+            values = np.array(keys, dtype=float)
+            if not np.isnan(values).any() and (values[:-1] <= values[1:]).all():
+                self._key_values = values
+
     def get_selection(self, keyval):
         """Returns BracketSelection() corresponding to keyval.   This is an atypical
         Selection which is really two selections, right and left.   Consequently,  the
@@ -2635,6 +3209,42 @@ class BracketSelector(Selector):
         of Selection but is rather (less, greater) where `less` and `greater` are normal
         (key, choice) Selections.
         """
+        yield self.get_selections([keyval])[0]
+
+    def get_selections(self, keyvals):
+        """Batch form of get_selection() returning the BracketSelection for each of
+        the numbers `keyvals`,  searching the sorted keys.
+
+        Returns [ BracketSelection, ... ]
+        """
+        import numpy as np
+        selections = self._selections
+        if self._key_values is None or not len(selections):
+            return [self._linear_bracket(keyval) for keyval in keyvals]
+        keyvals = np.array(keyvals, dtype=float)
+        positions = np.searchsorted(self._key_values, keyvals, side="left")
+        brackets = []
+        for keyval, index in zip(keyvals, positions):
+            if np.isnan(keyval):
+                brackets.append(self._linear_bracket(keyval))
+            elif index == len(selections):
+                brackets.append(BracketSelection(selections[index-1], selections[index-1]))
+            elif index == 0 or keyval == self._key_values[index]:
+                brackets.append(BracketSelection(selections[index], selections[index]))
+            else:
+                brackets.append(BracketSelection(selections[index-1], selections[index]))
+        return brackets
+
+    def _selection_groups(self, lookups):
+        """Search for the values of all `lookups` at once."""
+        brackets = self.get_selections([keyval for (keyval, _rows) in lookups]) if lookups else []
+        for bracket, (_keyval, rows) in zip(brackets, lookups):
+            yield (bracket,), rows
+
+    def _linear_bracket(self, keyval):
+        """Reference implementation of get_selection() which scans the keys in order.
+        Retained to verify and benchmark get_selection().
+        """
         index = 0
         selections = self._selections
         while index < len(selections) and keyval > selections[index].key:
@@ -2645,7 +3255,7 @@ class BracketSelector(Selector):
             less, greater = selections[index], selections[index]
         else:
             less, greater = selections[index-1], selections[index]
-        yield BracketSelection(less, greater)   # XXXX non-standard interface
+        return BracketSelection(less, greater)   # XXXX non-standard interface
 
     def get_choice(self, bracket_selection, header):
         """Return the paired choices of the BracketSelector based on an atypical
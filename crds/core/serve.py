@@ -0,0 +1,235 @@
+"""Defines a long running local daemon which computes best references for the
+processes on a host over a Unix domain socket,  and the thin client which
+heavy_client.getreferences() and getrecommendations() use to call it when
+CRDS_SERVE_SOCKET names the socket of a running daemon.
+
+The daemon keeps the contexts it has loaded warm via the cached functions of
+heavy_client,  so clients skip loading contexts and resolving configuration.
+Each client process keeps one connection per thread open for its lifetime.
+
+The protocol is one JSON object per line in each direction:
+
+    request     {"method" : "getreferences", "params" : { getreferences() keyword parameters }}
+    response    {"result" : <return value>}  or  {"error" : {"type" : <class name>, "message" : <str>}}
+
+The daemon is started with "crds serve",  see crds.serve.
+"""
+import os
+import json
+import signal
+import socket
+import builtins
+import threading
+import socketserver
+
+from . import config, log, heavy_client
+from . import exceptions as crexc
+
+# ===================================================================
+
+# True within the daemon process,  which computes bestrefs itself rather than calling itself.
+SERVING = False
+
+# heavy_client functions the daemon serves,  called with the request parameters.
+SERVED_FUNCTIONS = ("getreferences", "getrecommendations")
+
+def environment(observatory):
+    """Return the settings which determine where best references for `observatory`
+    come from and where they are cached.   A client only calls the daemon when its
+    settings match the daemon's,  otherwise the results could differ or name files
+    the client can't find.
+    """
+    return {
+        "CRDS_SERVER_URL" : config.get_server_url(observatory),
+        "CRDS_MODE" : config.get_crds_processing_mode(),
+        "CRDS_PATH" : config.get_crds_path(),
+        "CRDS_MAPPATH" : config.get_crds_mappath(observatory),
+        "CRDS_REFPATH" : config.get_crds_refpath(observatory),
+        "CRDS_CFGPATH" : config.get_crds_cfgpath(observatory),
+    }
+
+def dispatch(request):
+    """Return the response dict for decoded `request` dict."""
+    try:
+        method = request["method"]
+        if method == "ping":
+            result = "pong"
+        elif method == "environment":
+            result = environment(**request.get("params", {}))
+        elif method in SERVED_FUNCTIONS:
+            result = getattr(heavy_client, method)(**request.get("params", {}))
+        else:
+            raise ValueError("Unknown method " + repr(method))
+        return { "result" : result }
+    except Exception as exc:
+        log.verbose("Served request", log.PP(request), "failed:", repr(exc))
+        return { "error" : { "type" : exc.__class__.__name__, "message" : str(exc) } }
+
+def error_from_response(error):
+    """Return the exception to raise for the "error" of a daemon response,  of the same
+    class as the daemon's exception when that is a CRDS or builtin exception.
+    """
+    exception_class = getattr(crexc, error["type"], None) or getattr(builtins, error["type"], None)
+    if not (isinstance(exception_class, type) and issubclass(exception_class, Exception)):
+        exception_class = crexc.ServiceError
+    return exception_class(error["message"])
+
+# ===================================================================
+
+class ServeHandler(socketserver.StreamRequestHandler):
+    """Answers the requests of one client connection until it closes."""
+
+    def handle(self):
+        for line in self.rfile:
+            try:
+                response = dispatch(json.loads(line))
+            except ValueError as exc:
+                response = { "error" : { "type" : "ValueError", "message" : "Invalid request: " + str(exc) } }
+            self.wfile.write(json.dumps(response).encode("utf-8") + b"\n")
+            self.wfile.flush()
+
+class ServeDaemon(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    """Threaded Unix domain socket server for bestrefs requests."""
+
+    daemon_threads = True
+
+    def __init__(self, socket_path):
+        if os.path.exists(socket_path):
+            client = ServeClient(socket_path)
+            try:
+                client.call("ping")
+            except crexc.ServeUnavailableError:
+                os.remove(socket_path)   # left by a daemon which died
+            else:
+                raise crexc.CrdsError("A crds serve daemon is already listening on", repr(socket_path))
+        super().__init__(socket_path, ServeHandler)
+
+    def server_close(self):
+        super().server_close()
+        if os.path.exists(self.server_address):
+            os.remove(self.server_address)
+
+def serve(socket_path, contexts=(), observatory=None):
+    """Answer bestrefs requests on Unix domain socket `socket_path` until interrupted,
+    first loading each of `contexts`.
+    """
+    global SERVING
+    SERVING = True
+    for context in contexts:
+        log.info("Loading context", repr(context))
+        heavy_client.get_symbolic_mapping(context, observatory)
+    if threading.current_thread() is threading.main_thread():
+        signal.signal(signal.SIGTERM, _terminate)
+    with ServeDaemon(socket_path) as daemon:
+        log.info("Serving best references on", repr(socket_path))
+        try:
+            daemon.serve_forever()
+        except KeyboardInterrupt:
+            log.info("Stopped serving on", repr(socket_path))
+
+def _terminate(_signum, _frame):
+    """Stop serving on SIGTERM like on SIGINT,  removing the socket."""
+    raise KeyboardInterrupt()
+
+# ===================================================================
+
+class ServeClient:
+    """Calls the daemon on `socket_path` using a persistent connection per thread."""
+
+    def __init__(self, socket_path):
+        self.socket_path = socket_path
+        self._local = threading.local()
+
+    def __repr__(self):
+        return self.__class__.__name__ + "(" + repr(self.socket_path) + ")"
+
+    def _connect(self):
+        """Return the (socket, file) connection of the calling thread,  connecting if needed.
+        A connection inherited from the parent of a forked process is never used,  since
+        parent and child would read each other's responses.   Each connection caches the
+        environment() of the daemon it is connected to.
+        """
+        connection = getattr(self._local, "connection", None)
+        if connection is not None and self._local.pid != os.getpid():
+            connection = self._local.connection = None
+        if connection is None:
+            sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            sock.settimeout(config.SERVE_TIMEOUT.get() or None)
+            try:
+                sock.connect(self.socket_path)
+            except OSError as exc:
+                sock.close()
+                raise crexc.ServeUnavailableError(
+                    "Can't connect to crds serve daemon at", repr(self.socket_path), ":", str(exc)) from exc
+            connection = self._local.connection = (sock, sock.makefile("rb"))
+            self._local.pid = os.getpid()
+            self._local.environments = {}
+        return connection
+
+    def close(self):
+        """Close the connection of the calling thread,  if any."""
+        connection = getattr(self._local, "connection", None)
+        if connection is not None:
+            self._local.connection = None
+            self._local.environments = {}
+            if self._local.pid == os.getpid():
+                connection[1].close()
+                connection[0].close()
+
+    def call(self, method, **params):
+        """Return the result of calling `method` with keyword `params` on the daemon,
+        reconnecting once if the connection was closed since the last call.   Since the
+        daemon may have been restarted with different settings,  its environment is
+        checked again after reconnecting.
+
+        Raises ServeUnavailableError if the daemon can't be reached,  doesn't answer within
+        CRDS_SERVE_TIMEOUT seconds,  or no longer matches this process's environment.
+        """
+        request = json.dumps({ "method" : method, "params" : params }).encode("utf-8") + b"\n"
+        for retry in (True, False):
+            sock, responses = self._connect()
+            if not retry and "observatory" in params and method != "environment" and \
+                    not self.matches_environment(params["observatory"]):
+                raise crexc.ServeUnavailableError("crds serve daemon at", repr(self.socket_path),
+                                                  "was restarted with a different CRDS server or cache.")
+            try:
+                sock.sendall(request)
+                line = responses.readline()
+            except socket.timeout as exc:
+                self.close()
+                raise crexc.ServeUnavailableError("crds serve daemon at", repr(self.socket_path),
+                                                  "did not answer within", config.SERVE_TIMEOUT.get(), "seconds.") from exc
+            except OSError:
+                line = b""
+            if line:
+                break
+            self.close()
+            if not retry:
+                raise crexc.ServeUnavailableError("crds serve daemon at", repr(self.socket_path), "closed the connection.")
+        response = json.loads(line)
+        if "error" in response:
+            raise error_from_response(response["error"])
+        return response["result"]
+
+    def matches_environment(self, observatory):
+        """Return True IFF the daemon's environment() for `observatory` matches this process's."""
+        self._connect()
+        daemon_environment = self._local.environments.get(observatory)
+        if daemon_environment is None:
+            daemon_environment = self.call("environment", observatory=observatory)
+            self._local.environments[observatory] = daemon_environment
+        return daemon_environment == environment(observatory)
+
+_CLIENTS = {}
+
+def get_client():
+    """Return the ServeClient for CRDS_SERVE_SOCKET,  or None if it isn't set or this
+    process is the daemon.
+    """
+    socket_path = config.SERVE_SOCKET.get()
+    if SERVING or socket_path == "none":
+        return None
+    client = _CLIENTS.get(socket_path)
+    if client is None:
+        client = _CLIENTS[socket_path] = ServeClient(socket_path)
+    return client
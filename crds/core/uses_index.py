@@ -0,0 +1,223 @@
+"""Defines UsesIndex,  a persistent sqlite3 reverse index from the names of files to
+the names of the mappings in the CRDS cache which directly refer to them:  from
+references to rmaps,  rmaps to imaps,  and imaps to pmaps.
+
+The index is updated incrementally,  only (re)indexing mapping files which were
+added or changed since the last update,  as crds sync does after syncing mappings
+and get_uses_index() does before each use when CRDS_USES_INDEX is enabled.   crds uses,  crds matches,  and certify's
+find_governing_rmap() then answer with a few queries instead of loading every
+mapping in the cache.
+
+Indexing reads each mapping with MAPPING_READER and records the literal file
+names of its selector without instantiating it.
+"""
+import os.path
+import sqlite3
+import contextlib
+
+from . import config, log, utils, rmap, selectors, mapping_reader
+
+# ===================================================================
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS mappings (
+    name TEXT PRIMARY KEY,
+    size INTEGER,
+    mtime_ns INTEGER
+);
+CREATE TABLE IF NOT EXISTS uses (
+    filename TEXT,
+    mapping TEXT,
+    PRIMARY KEY (filename, mapping)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS uses_by_mapping ON uses (mapping, filename);
+"""
+
+def locate_uses_index(observatory):
+    """Return the path of the uses index of `observatory` in the CRDS config area."""
+    return os.path.join(config.get_crds_cfgpath(observatory), "uses_index.sqlite")
+
+def mapping_files(text):
+    """Return the sorted names of the files directly named by the selector of mapping
+    `text`,  the nested mappings of a context or the references of an rmap,  without
+    any directory paths.
+
+    >>> mapping_files('''
+    ... header = {'mapping' : 'REFERENCE'}
+    ... selector = Match({
+    ...     ('HRC',) : UseAfter({'2001-01-01 00:00:00' : 'b.fits'}),
+    ...     ('WFC',) : ('a.fits', 'N/A'),
+    ... })
+    ... ''')
+    ['a.fits', 'b.fits']
+    """
+    namespace = mapping_reader.read_mapping(text)
+    return sorted({ os.path.basename(name) for name in _selector_files(namespace["selector"])
+                    if not rmap.is_special_value(name) })
+
+def _selector_files(selector):
+    """Generate the literal strings of the choices of uninstantiated `selector`."""
+    if isinstance(selector, str):
+        yield selector
+    elif isinstance(selector, selectors.Parameters):
+        for _key, choice in selector.selections:
+            yield from _selector_files(choice)
+    elif isinstance(selector, dict):
+        for choice in selector.values():
+            yield from _selector_files(choice)
+    elif isinstance(selector, (tuple, list)):
+        for choice in selector:
+            yield from _selector_files(choice)
+
+# ===================================================================
+
+class UsesIndex:
+    """Reverse index of the mappings in the CRDS cache of `observatory` stored at `path`."""
+
+    def __init__(self, observatory, path=None):
+        self.observatory = observatory
+        self.path = locate_uses_index(observatory) if path is None else path
+
+    def __repr__(self):
+        return self.__class__.__name__ + "(" + repr(self.observatory) + ", " + repr(self.path) + ")"
+
+    @contextlib.contextmanager
+    def connect(self):
+        """Yield a connection to the index database,  creating it if needed,  and commit
+        any updates on success.
+        """
+        utils.ensure_dir_exists(self.path)
+        connection = sqlite3.connect(self.path, timeout=60)
+        try:
+            connection.executescript(SCHEMA)
+            with connection:
+                yield connection
+        finally:
+            connection.close()
+
+    def exists(self):
+        """Return True IFF the index has been created and has indexed any mappings."""
+        if not os.path.exists(self.path):
+            return False
+        with self.connect() as connection:
+            return connection.execute("SELECT 1 FROM mappings LIMIT 1").fetchone() is not None
+
+    def update(self, paths=None):
+        """Index the mapping files at `paths`,  by default every mapping in the CRDS cache,
+        which aren't indexed or have changed size or modification time since they
+        were indexed.   When indexing the whole cache,  also drop mappings which no
+        longer exist.
+
+        Returns the list of names of the (re)indexed mappings.
+        """
+        complete = paths is None
+        if complete:
+            paths = rmap.list_mappings("*.*map", self.observatory, full_path=True)
+        updated = []
+        with self.connect() as connection:
+            indexed = { name : (size, mtime_ns) for (name, size, mtime_ns) in
+                        connection.execute("SELECT name, size, mtime_ns FROM mappings") }
+            listed = set()
+            for path in paths:
+                name = os.path.basename(path)
+                listed.add(name)
+                with log.warn_on_exception("Failed indexing", repr(path)):
+                    stat = os.stat(path)
+                    if indexed.get(name) == (stat.st_size, stat.st_mtime_ns):
+                        continue
+                    files = mapping_files(utils.get_uri_content(path))
+                    self._remove(connection, name)
+                    connection.execute("INSERT INTO mappings VALUES (?, ?, ?)", (name, stat.st_size, stat.st_mtime_ns))
+                    connection.executemany("INSERT OR IGNORE INTO uses VALUES (?, ?)",
+                                           [(filename, name) for filename in files])
+                    updated.append(name)
+            if complete:
+                for name in set(indexed) - listed:
+                    self._remove(connection, name)
+        if updated:
+            log.verbose("Indexed", len(updated), "mappings in", repr(self.path))
+        return updated
+
+    def _remove(self, connection, name):
+        """Remove mapping `name` and the files it names from the index."""
+        connection.execute("DELETE FROM mappings WHERE name = ?", (name,))
+        connection.execute("DELETE FROM uses WHERE mapping = ?", (name,))
+
+    def files(self, mapping):
+        """Return the sorted names of the files directly named by `mapping`."""
+        with self.connect() as connection:
+            return sorted(row[0] for row in connection.execute(
+                "SELECT filename FROM uses WHERE mapping = ?", (os.path.basename(mapping),)))
+
+    def uses(self, files):
+        """Return the sorted names of the mappings which refer to any of `files`,
+        directly or by referring to a mapping which does.
+        """
+        files = [os.path.basename(filename) for filename in files]
+        if not files:
+            return []
+        with self.connect() as connection:
+            return sorted(row[0] for row in connection.execute("""
+                WITH RECURSIVE users(name) AS (
+                    SELECT mapping FROM uses WHERE filename IN ({})
+                    UNION
+                    SELECT uses.mapping FROM uses JOIN users ON uses.filename = users.name
+                )
+                SELECT name FROM users""".format(", ".join("?" * len(files))), files))
+
+    CLOSURE = """
+        WITH RECURSIVE closure(name) AS (
+            SELECT ?
+            UNION
+            SELECT uses.filename FROM uses JOIN closure ON uses.mapping = closure.name
+            WHERE closure.name LIKE '%map'
+        )
+    """
+
+    def closure(self, context):
+        """Return the sorted names of the mappings in the closure of `context`,  including
+        `context`,  or None if `context` isn't indexed.
+        """
+        context = os.path.basename(context)
+        with self.connect() as connection:
+            if connection.execute("SELECT 1 FROM mappings WHERE name = ?", (context,)).fetchone() is None:
+                return None
+            return sorted(row[0] for row in connection.execute(
+                self.CLOSURE + "SELECT name FROM closure WHERE name LIKE '%map'", (context,)))
+
+    def context_users(self, context, filename):
+        """Return the sorted names of the mappings in the closure of `context`,  including
+        `context`,  which directly name `filename`,  or None if `context` isn't indexed.
+        """
+        context = os.path.basename(context)
+        with self.connect() as connection:
+            if connection.execute("SELECT 1 FROM mappings WHERE name = ?", (context,)).fetchone() is None:
+                return None
+            return sorted(row[0] for row in connection.execute(
+                self.CLOSURE + "SELECT mapping FROM uses WHERE filename = ? AND mapping IN closure",
+                (context, os.path.basename(filename))))
+
+def get_uses_index(observatory):
+    """Return the UsesIndex of `observatory`,  first indexing the whole CRDS cache if
+    the index doesn't exist yet,  or otherwise any mappings added to or changed in the
+    cache since the last update,  e.g. by getreferences() or copying.
+    """
+    index = UsesIndex(observatory)
+    if not index.exists():
+        log.info("Creating uses index", repr(index.path))
+        index.update()
+    else:
+        with log.warn_on_exception("Failed updating uses index", repr(index.path), ",  results may be out of date"):
+            index.update()
+    return index
+
+# ===================================================================
+
+def test():
+    """Run module doctests."""
+    import doctest
+    from crds.core import uses_index
+    return doctest.testmod(uses_index)
+
+if __name__ == "__main__":
+    print(test())
@@ -11,6 +11,8 @@ import re
 import hashlib
 import io
 import functools
+import threading
+import types
 from collections import Counter, defaultdict
 import datetime
 import ast
@@ -264,14 +266,35 @@ class xcached:
 class CachedFunction:
     """Class to support the @cached function decorator.   Called at runtime
     for typical caching version of function.
+
+    The cache is unbounded unless `maxsize` (results) or `maxbytes` (approximate
+    result bytes) are specified,  or CRDS_CACHE_MAXSIZE or CRDS_CACHE_MAXBYTES set
+    defaults for all cached functions.   Bounded caches evict the least recently
+    used results.
+
+    >>> @xcached(maxsize=2)
+    ... def square(x):
+    ...     return x*x
+    >>> square(1), square(2), square(1), square(3)
+    (1, 4, 1, 9)
+    >>> sorted(square.cache)
+    [(1,), (3,)]
+    >>> square.stats()
+    {'hits': 1, 'misses': 3, 'evictions': 1, 'size': 2, 'bytes': 0, 'maxsize': 2, 'maxbytes': 0}
     """
 
     cache_set = set()
 
-    def __init__(self, func, omit_from_key=None):
+    def __init__(self, func, omit_from_key=None, maxsize=None, maxbytes=None):
         self.cache = dict()
         self.uncached = func
         self.omit_from_key = [] if omit_from_key is None else omit_from_key
+        self.maxsize = maxsize
+        self.maxbytes = maxbytes
+        self._sizes = dict()
+        self._bytes = 0
+        self._hits = self._misses = self._evictions = 0
+        self._lock = threading.RLock()
         self.cache_set.add(self)
         self.__doc__ = self.uncached.__doc__
         self.__module__ = self.uncached.__module__
@@ -283,46 +306,131 @@ class CachedFunction:
         keys = tuple([item for item in keys.items() if item[0] not in self.omit_from_key])
         return args + keys
 
+    def limits(self):
+        """Return the (maxsize, maxbytes) of this cache,  0 meaning unbounded."""
+        maxsize = config.CACHE_MAXSIZE.get() if self.maxsize is None else self.maxsize
+        maxbytes = config.CACHE_MAXBYTES.get() if self.maxbytes is None else self.maxbytes
+        return maxsize, maxbytes
+
     def _readonly(self, *args, **keys):
-        """Compute (cache_key, func(*args, **keys)).   Do not add to cache."""
+        """Compute (cache_key, func(*args, **keys), cached).   Do not add to cache."""
         key = self.cache_key(*args, **keys)
-        if key in self.cache:
+        with self._lock:
+            result = self.cache.pop(key, self)
+            if result is not self:
+                self.cache[key] = result    # keep the most recently used last
+                self._hits += 1
+            else:
+                self._misses += 1
+        if result is not self:
             log.verbose("Cached call", self.uncached.__name__, repr(key), verbosity=80)
-            return key, self.cache[key]
-        else:
-            log.verbose("Uncached call", self.uncached.__name__, repr(key), verbosity=80)
-            return key, self.uncached(*args, **keys)
+            return key, result, True
+        log.verbose("Uncached call", self.uncached.__name__, repr(key), verbosity=80)
+        return key, self.uncached(*args, **keys), False
 
     def readonly(self, *args, **keys):
         """Compute or fetch func(*args, **keys) but do not add to cache.
         Return func(*args, **keys)
         """
-        _key, result = self._readonly(*args, **keys)
+        _key, result, _cached = self._readonly(*args, **keys)
         return result
 
     def __call__(self, *args, **keys):
         """Compute or fetch func(*args, **keys).  Add the result to the cache.
         return func(*args, **keys)
         """
-        key, result = self._readonly(*args, **keys)
-        self.cache[key] = result
+        key, result, cached = self._readonly(*args, **keys)
+        if not cached:
+            self._store(key, result)
         return result
 
+    def add(self, result, *args, **keys):
+        """Add `result`,  computed elsewhere,  to the cache as the value of func(*args, **keys)."""
+        self._store(self.cache_key(*args, **keys), result)
+
+    def _store(self, key, result):
+        """Add `result` to the cache under `key`,  evicting least recently used
+        results to stay within the cache limits.
+        """
+        maxsize, maxbytes = self.limits()
+        size = approximate_size(result) if maxbytes else 0
+        with self._lock:
+            if len(self._sizes) != len(self.cache):   # cache cleared or updated directly
+                self._sizes = { k: s for (k, s) in self._sizes.items() if k in self.cache }
+                self._bytes = sum(self._sizes.values())
+            self.cache.pop(key, None)
+            self._bytes -= self._sizes.pop(key, 0)
+            self.cache[key] = result
+            self._sizes[key] = size
+            self._bytes += size
+            while len(self.cache) > 1 and (
+                    (maxsize and len(self.cache) > maxsize) or (maxbytes and self._bytes > maxbytes)):
+                oldest = next(iter(self.cache))
+                del self.cache[oldest]
+                self._bytes -= self._sizes.pop(oldest, 0)
+                self._evictions += 1
+
+    def clear(self):
+        """Drop all cached results and reset the statistics."""
+        with self._lock:
+            self.cache = dict()
+            self._sizes = dict()
+            self._bytes = 0
+            self._hits = self._misses = self._evictions = 0
+
+    def stats(self):
+        """Return { "hits", "misses", "evictions", "size", "bytes", "maxsize", "maxbytes" }
+        for this cache,  where bytes is the approximate size of the results if maxbytes
+        is in effect.
+        """
+        maxsize, maxbytes = self.limits()
+        with self._lock:
+            return dict(hits=self._hits, misses=self._misses, evictions=self._evictions,
+                        size=len(self.cache), bytes=self._bytes, maxsize=maxsize, maxbytes=maxbytes)
+
     def __get__(self, obj, objtype):
         '''Support instance methods.'''
         return functools.partial(self.__call__, obj)
 
+def approximate_size(obj):
+    """Return the approximate number of bytes of `obj` and the objects it refers to,
+    not counting classes,  modules,  and functions.
+
+    >>> approximate_size("x" * 1000) > 1000
+    True
+    >>> approximate_size(["x" * 1000, "y" * 1000]) > 2000
+    True
+    """
+    seen = set()
+    total = 0
+    pending = [obj]
+    while pending:
+        objs = [o for o in pending if id(o) not in seen and not isinstance(o, _UNSIZED_TYPES)]
+        seen.update(id(o) for o in objs)
+        total += sum(sys.getsizeof(o) for o in objs)
+        pending = gc.get_referents(*objs)
+    return total
+
+_UNSIZED_TYPES = (type, types.ModuleType, types.FunctionType, types.BuiltinFunctionType, types.MethodType)
+
 def clear_function_caches():
     "Clear all the caches created using @utils.cached or @utils.xcached."""
     for cache_func in CachedFunction.cache_set:
         log.verbose("Clearing cache for", repr(cache_func.uncached), verbosity=80)
-        cache_func.cache = dict()
+        cache_func.clear()
 
 def list_cached_functions():
     """List all the functions supporting caching under @utils.cached or @utils.xcached."""
-    for cache_func in sorted(CachedFunction.cache_set):
+    for cache_func in sorted(CachedFunction.cache_set, key=lambda func: func.__name__):
         print(repr(cache_func.uncached))
 
+def cache_stats():
+    """Return { "module.function" : CachedFunction.stats(), ... } for all the functions
+    cached by @utils.cached or @utils.xcached,  see CachedFunction.stats().
+    """
+    return { cache_func.__module__ + "." + cache_func.uncached.__qualname__ : cache_func.stats()
+             for cache_func in sorted(CachedFunction.cache_set, key=lambda func: func.__module__ + func.__name__) }
+
 # ===================================================================
 
 def capture_output(func):
@@ -725,8 +833,8 @@ def get_url_content(url, mode="text"):
 
 
 def _get_url_content(url, mode):
-    import requests
-    r = requests.get(url)
+    from ..client import proxy
+    r = proxy.get_http_session().get(url)
     r.raise_for_status()
     if mode == "text":
         return r.text
@@ -10,11 +10,12 @@ The api function find_full_match_paths() returns a list of "match paths",  lists
 """
 import sys
 import os.path
+import pickle
 from collections import defaultdict
 from pprint import pprint as pp   # doctests
 
 import crds
-from crds.core import log, utils, cmdline, selectors
+from crds.core import log, config, utils, cmdline, selectors, rmap, uses_index, heavy_client
 from crds.client import api
 
 # ===================================================================
@@ -60,8 +61,43 @@ def find_full_match_paths(context, reffile):
        ('CCDCHIP', 'N/A')),
       (('DATE-OBS', '2006-07-04'), ('TIME-OBS', '11:32:35')))]
     """
+    matches = _indexed_file_matches(context, reffile)
+    if matches is None:
+        matches = get_match_index(context).get(reffile, [])
+    return matches
+
+def _indexed_file_matches(context, reffile):
+    """With CRDS_USES_INDEX,  return the extended match tuples of `reffile` in `context`
+    loading only the rmaps of `context` which the uses index shows naming `reffile`.
+    Otherwise,  or if `context` isn't indexed,  return None.
+    """
+    if not config.USES_INDEX:
+        return None
+    users = uses_index.get_uses_index(utils.file_to_observatory(context)).context_users(context, reffile)
+    if users is None:
+        return None
+    return sorted(match for name in users if name.endswith(".rmap")
+                  for match in rmap.get_cached_mapping(name).file_matches(reffile))
+
+@utils.cached
+def get_match_index(context):
+    """Return { filename : [full match path, ...] } for every file in `context`,  as
+    returned by find_full_match_paths() for each file,  built by walking `context` once.
+
+    Like context pickles,  the index is loaded from the pickle cache when
+    CRDS_USE_PICKLED_CONTEXTS is set and saved there when CRDS_AUTO_PICKLE_CONTEXTS is.
+    """
+    index_file = config.locate_match_index(context)
+    if config.USE_PICKLED_CONTEXTS and os.path.exists(index_file):
+        with log.verbose_warning_on_exception("Failed loading match index", repr(index_file)):
+            with open(index_file, "rb") as handle:
+                return pickle.load(handle)
     ctx = crds.get_pickled_mapping(context, cached=True)  # reviewed
-    return ctx.file_matches(reffile)
+    index = ctx.all_file_matches()
+    if config.AUTO_PICKLE_CONTEXTS:
+        heavy_client.cache_atomic_write(index_file, pickle.dumps(index, pickle.HIGHEST_PROTOCOL),
+                                        "MATCH INDEX")
+    return index
 
 def find_match_paths_as_dict(context, reffile):
     """Return the matching parameters for reffile as a list of dictionaries, one dict for
@@ -309,8 +345,9 @@ jwst_niriss_throughput_0008.fits :  META.INSTRUMENT.FILTER='F480M'
     def find_match_tuples(self, context, reffile):
         """Return the list of match representations for `reference` in `context`.
         """
-        ctx = crds.get_cached_mapping(context)
-        matches = ctx.file_matches(reffile)
+        matches = _indexed_file_matches(context, reffile)
+        if matches is None:
+            matches = get_match_index(context).get(reffile, [])
         result = []
         for path in matches:
             prefix = self.format_prefix(path[0])
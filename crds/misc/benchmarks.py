@@ -0,0 +1,554 @@
+"""This module is a command line script which measures the performance of CRDS
+rules processing internals,  primarily best reference lookups,  against the
+rmaps of real contexts.
+
+% crds benchmarks --contexts hst-operational jwst-operational --benchmarks match --count 3
+
+Each benchmark compares the current implementation of a lookup primitive with
+the reference implementation it replaced,  after first verifying that both
+produce the same results for every sampled lookup.
+"""
+import sys
+import os.path
+import gc
+import timeit
+import resource
+import tempfile
+import tracemalloc
+import multiprocessing
+
+import crds
+from crds.core import log, utils, config, cmdline, rmap, selectors, selector_compiler, mapping_reader
+from crds.core import heavy_client, context_image
+
+# ===================================================================
+
+def walk_selectors(selector, selector_class=selectors.Selector):
+    """Generate every nested Selector of `selector` which is an instance of `selector_class`."""
+    if isinstance(selector, selector_class):
+        yield selector
+    if isinstance(selector, selectors.Selector):
+        for choice in selector.choices():
+            yield from walk_selectors(choice, selector_class)
+
+def count_selections(rmapping):
+    """Return the total number of selections in all selectors of `rmapping`."""
+    return sum(len(selector.keys()) for selector in walk_selectors(rmapping.selector))
+
+def load_rmaps(rmaps=(), contexts=(), count=None):
+    """Return the list of ReferenceMappings named by `rmaps` and the `count` largest
+    rmaps of each of `contexts`.   Size is measured as total selection count.
+    """
+    loaded = [rmap.get_cached_mapping(name, ignore_checksum=True) for name in rmaps]
+    for context in contexts:
+        mapping = crds.get_pickled_mapping(context)   # reviewed
+        names = [name for name in mapping.mapping_names() if name.endswith(".rmap")]
+        rmappings = [rmap.get_cached_mapping(name) for name in names]
+        rmappings.sort(key=count_selections, reverse=True)
+        loaded.extend(rmappings[:count])
+    return loaded
+
+def time_per_call(func, args_list, repeat=3):
+    """Return the best average seconds per call of `func` over every argument tuple
+    of `args_list`,  taken over `repeat` trials.
+    """
+    def trial():
+        for args in args_list:
+            func(*args)
+    best = min(timeit.repeat(trial, number=1, repeat=repeat))
+    return best / max(len(args_list), 1)
+
+# ===================================================================
+
+def sample_match_headers(selector, limit=200):
+    """Return up to `limit` lookup headers for MatchSelector `selector`.  Headers
+    are drawn from the selector's own match tuples,  selecting the first alternative
+    of or-globs,  so that lookups exercise both literal and wild card clauses.
+    """
+    headers = []
+    keys = selector.keys()
+    stride = max(len(keys) // limit, 1)
+    for key in keys[::stride][:limit]:
+        header = {}
+        for parameter, value in zip(selector._parameters, key):
+            header[parameter] = selectors.glob_list(value)[0] if isinstance(value, str) else str(value)
+        headers.append(header)
+    return headers
+
+def benchmark_match(rmapping, repeat=3):
+    """Time MatchSelector winnowing of `rmapping` with the match index vs. calling
+    every Matcher,  verifying identical results for every sampled header.
+
+    Returns { "selections" : int, "lookups" : int, "indexed" : secs, "linear" : secs }
+    """
+    lookups = [(selector, header)
+               for selector in walk_selectors(rmapping.selector, selectors.MatchSelector)
+               for header in sample_match_headers(selector)]
+
+    def indexed(selector, header):
+        return selector._winnow(header)
+
+    def linear(selector, header):
+        return selector._linear_winnow(header, dict(selector._match_selections))
+
+    for selector, header in lookups:
+        weights, remaining = indexed(selector, header)
+        linear_weights, linear_remaining = linear(selector, header)
+        assert list(remaining) == list(linear_remaining), \
+            "Indexed and linear winnowing disagree for " + repr(header)
+        assert weights == { key : linear_weights[key] for key in linear_remaining }, \
+            "Indexed and linear weights disagree for " + repr(header)
+    return {
+        "selections" : count_selections(rmapping),
+        "lookups" : len(lookups),
+        "indexed" : time_per_call(indexed, lookups, repeat),
+        "linear" : time_per_call(linear, lookups, repeat),
+    }
+
+def sample_keys(selector, limit=200):
+    """Return up to `limit` conditioned lookup keys of `selector`,  evenly strided."""
+    keys = selector.keys()
+    return keys[::max(len(keys) // limit, 1)][:limit]
+
+def benchmark_useafter(rmapping, repeat=3):
+    """Time UseAfter,  VersionAfter,  and ClosestTime lookups of `rmapping` by
+    bisecting precomputed keys vs. the recursive slicing and linear delta searches,
+    verifying identical selections for every sampled key.
+
+    Returns { "selections" : int, "lookups" : int, "bisected" : secs, "sliced" : secs }
+    """
+    lookups = [(selector, key)
+               for selector in walk_selectors(rmapping.selector, selectors.UseAfterSelector)
+               for key in sample_keys(selector)]
+
+    def bisected(selector, key):
+        return next(selector.get_selection(key))
+
+    def sliced(selector, key):
+        if isinstance(selector, selectors.ClosestTimeSelector):
+            return selector._linear_closest(key)
+        return selector._sliced_bsearch(key, selector._selections)
+
+    for selector, key in lookups:
+        assert bisected(selector, key) == sliced(selector, key), \
+            "Bisected and sliced searches disagree for " + repr(key)
+    return {
+        "selections" : count_selections(rmapping),
+        "lookups" : len(lookups),
+        "bisected" : time_per_call(bisected, lookups, repeat),
+        "sliced" : time_per_call(sliced, lookups, repeat),
+    }
+
+def sample_numbers(selector, limit=200):
+    """Return up to `limit` lookup values spanning the numeric keys of `selector`,
+    including the keys themselves,  midpoints,  and values beyond either end.
+    """
+    keys = sorted(float(key) for key in selector.keys())
+    if not keys:
+        return []
+    values = keys + [(low + high) / 2 for (low, high) in zip(keys, keys[1:])] + [keys[0] - 1, keys[-1] + 1]
+    return values[::max(len(values) // limit, 1)][:limit]
+
+def benchmark_numeric(rmapping, repeat=3):
+    """Time GeometricallyNearest and Bracket lookups of `rmapping` by searching
+    sorted keys vs. scanning every key,  verifying identical selections for every
+    sampled value.
+
+    Returns { "selections" : int, "lookups" : int, "searched" : secs, "linear" : secs }
+    """
+    numeric = (selectors.GeometricallyNearestSelector, selectors.BracketSelector)
+    lookups = [(selector, value)
+               for selector in walk_selectors(rmapping.selector, numeric)
+               for value in sample_numbers(selector)]
+
+    def searched(selector, value):
+        return next(selector.get_selection(value))
+
+    def linear(selector, value):
+        if isinstance(selector, selectors.BracketSelector):
+            return selector._linear_bracket(value)
+        return selector._linear_nearest(value)
+
+    for selector, value in lookups:
+        assert searched(selector, value) == linear(selector, value), \
+            "Searched and linear selections disagree for " + repr(value)
+    return {
+        "selections" : count_selections(rmapping),
+        "lookups" : len(lookups),
+        "searched" : time_per_call(searched, lookups, repeat),
+        "linear" : time_per_call(linear, lookups, repeat),
+    }
+
+def selection_headers(selector, header=None):
+    """Generate a conditioned lookup header for every path from `selector` to a
+    leaf choice,  using the first alternative of or-globs.
+    """
+    header = header or {}
+    for key, choice in selector._raw_selections:
+        here = dict(header)
+        for parameter, value in selector.match_item(key):
+            here[parameter] = selectors.glob_list(value)[0] if isinstance(value, str) else str(value)
+        if isinstance(choice, selectors.Selector):
+            yield from selection_headers(choice, here)
+        else:
+            yield utils.condition_header(here)
+
+def sample_rmap_headers(rmapping, limit=200):
+    """Return up to `limit` lookup headers for `rmapping`,  evenly strided over
+    the paths to its leaf choices.
+    """
+    headers = list(selection_headers(rmapping.selector))
+    return headers[::max(len(headers) // limit, 1)][:limit]
+
+def benchmark_compiled(rmapping, repeat=3):
+    """Time lookups of `rmapping` by its compiled selector,  falling back to the
+    interpreted selector as ReferenceMapping does,  vs. interpreted lookups alone.
+    Verifies that both agree for every sampled header first.
+
+    Returns { "selections" : int, "lookups" : int, "compiled" : secs, "interpreted" : secs }
+    """
+    headers = sample_rmap_headers(rmapping)
+    mismatches = selector_compiler.check_compiled(rmapping, headers)
+    assert not mismatches, "Compiled and interpreted lookups disagree for " + repr(mismatches[0][0])
+    compiled = rmapping.compiled_selector()
+    interpreted = rmapping.selector.choose
+
+    def compiled_choose(header):
+        try:
+            return compiled(header)
+        except Exception:
+            return interpreted_choose(header)
+
+    def interpreted_choose(header):
+        try:
+            return interpreted(header)
+        except Exception:
+            return None
+
+    lookups = []
+    for header in headers:
+        with log.verbose_on_exception("Skipping header", repr(header)):
+            lookups.append((rmapping._lookup_header(dict(header)),))
+    return {
+        "selections" : count_selections(rmapping),
+        "lookups" : len(lookups),
+        "compiled" : time_per_call(compiled_choose, lookups, repeat),
+        "interpreted" : time_per_call(interpreted_choose, lookups, repeat),
+    }
+
+def benchmark_parse(rmapping, repeat=3):
+    """Time reading the text of `rmapping` with MAPPING_READER vs. verifying it with
+    MAPPING_VERIFIER and exec'ing it.   Verifies that both define the same header,
+    selector,  and comment first.
+
+    Returns { "selections" : int, "bytes" : int, "read" : secs, "exec" : secs }
+    """
+    text = utils.get_uri_content(config.locate_mapping(rmapping.filename, rmapping.observatory))
+    assert mapping_reader.MAPPING_READER.read(text) is not None, "Mapping is not handled by the fast reader."
+    differences = mapping_reader.check_reader(text)
+    assert not differences, "Fast reader and exec disagree on " + repr(differences)
+
+    def exec_mapping(text):
+        namespace = dict(selectors.SELECTORS)
+        exec(mapping_reader.MAPPING_VERIFIER.compile_and_check(text), namespace)
+
+    return {
+        "selections" : count_selections(rmapping),
+        "bytes" : len(text),
+        "read" : time_per_call(mapping_reader.MAPPING_READER.read, [(text,)], repeat),
+        "exec" : time_per_call(exec_mapping, [(text,)], repeat),
+    }
+
+BENCHMARKS = {
+    "match" : (benchmark_match, "per-lookup latency of MatchSelector winnowing", ("indexed", "linear")),
+    "useafter" : (benchmark_useafter, "per-lookup latency of UseAfter family searches", ("bisected", "sliced")),
+    "numeric" : (benchmark_numeric, "per-lookup latency of GeometricallyNearest and Bracket searches", ("searched", "linear")),
+    "compiled" : (benchmark_compiled, "per-lookup latency of compiled vs. interpreted selectors", ("compiled", "interpreted")),
+    "parse" : (benchmark_parse, "per-mapping latency of reading vs. verifying and exec'ing rmap text", ("read", "exec")),
+}
+
+# ===================================================================
+
+def rmap_paths(rmaps=(), contexts=()):
+    """Return the file paths of the rmaps named by `rmaps` and of all rmaps of `contexts`."""
+    names = list(rmaps)
+    for context in contexts:
+        mapping = crds.get_pickled_mapping(context)   # reviewed
+        names.extend(name for name in mapping.mapping_names() if name.endswith(".rmap"))
+    return sorted({ name if os.path.dirname(name) else config.locate_mapping(name) for name in names })
+
+def load_rmap_files(paths):
+    """Load and return uncached ReferenceMappings for each of `paths`."""
+    return [rmap.ReferenceMapping.from_file(path, ignore_checksum=True) for path in paths]
+
+def memory_report(paths):
+    """Load the rmaps at `paths` with uninterned and then interned Matchers,  measuring
+    the load time and the memory retained by the loaded rmaps in each mode.
+
+    Returns { mode : { "bytes" : int, "seconds" : float, "matchers" : int, "regexes" : int }, ... }
+    """
+    loadable = []
+    for path in paths:   # warm up imports,  file system,  and function caches
+        with log.warn_on_exception("Skipping rmap", repr(path)):
+            load_rmap_files([path])
+            loadable.append(path)
+    paths = loadable
+    report = {}
+    interning = selectors.INTERN_MATCHERS
+    try:
+        for mode, intern in [("uninterned", False), ("interned", True)]:
+            selectors.INTERN_MATCHERS = intern
+            selectors.clear_matchers()
+            seconds = min(timeit.repeat(lambda: load_rmap_files(paths), number=1, repeat=1))
+            selectors.clear_matchers()
+            gc.collect()
+            tracemalloc.start()
+            try:
+                mappings = load_rmap_files(paths)
+                gc.collect()
+                retained, _peak = tracemalloc.get_traced_memory()
+            finally:
+                tracemalloc.stop()
+            report[mode] = dict(bytes=retained, seconds=seconds, **selectors.matcher_stats())
+            del mappings
+    finally:
+        selectors.INTERN_MATCHERS = interning
+    return report
+
+def format_memory_report(report):
+    """Return the lines summarizing memory_report() `report`,  comparing each mode to the first."""
+    lines = []
+    baseline = None
+    for mode, result in report.items():
+        fields = [mode.ljust(12),
+                  "memory={:.1f}M".format(result["bytes"] / 2**20),
+                  "load={:.2f}s".format(result["seconds"]),
+                  "matchers=" + str(result["matchers"]),
+                  "regexes=" + str(result["regexes"])]
+        if baseline is None:
+            baseline = result
+        else:
+            fields.append("memory_saved={:.1%}".format(1 - result["bytes"] / max(baseline["bytes"], 1)))
+            fields.append("load_speedup={:.2f}x".format(baseline["seconds"] / max(result["seconds"], 1e-9)))
+        lines.append(" ".join(fields))
+    return lines
+
+def resident_bytes():
+    """Return the resident set size of this process,  or its peak where the current
+    size isn't available.
+    """
+    try:
+        with open("/proc/self/statm") as statm:
+            return int(statm.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError):
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak if sys.platform == "darwin" else peak * 1024
+
+def loaded_rmaps(mapping):
+    """Return the loaded ReferenceMappings of `mapping`,  a context or rmap."""
+    if isinstance(mapping, rmap.ReferenceMapping):
+        return [mapping]
+    return [rmapping for nested in mapping.selections.loaded_values() if isinstance(nested, rmap.Mapping)
+            for rmapping in loaded_rmaps(nested)]
+
+def rss_report(context):
+    """Load every mapping of `context` from its files,  bypassing the mapping cache,
+    and measure the growth of resident memory and the load time.
+
+    Returns { "mappings" : int, "selections" : int, "seconds" : float, "rss" : int }
+    """
+    gc.collect()
+    before = resident_bytes()
+    start = timeit.default_timer()
+    mapping = rmap.load_mapping(context)
+    mapping.force_load()
+    seconds = timeit.default_timer() - start
+    gc.collect()
+    rss = resident_bytes() - before
+    return dict(
+        mappings=len(mapping.mapping_names()),
+        selections=sum(count_selections(rmapping) for rmapping in loaded_rmaps(mapping)),
+        seconds=seconds,
+        rss=rss)
+
+def private_bytes():
+    """Return the resident memory of this process which isn't shared with other
+    processes through file mappings,  or 0 where that isn't available.
+    """
+    try:
+        with open("/proc/self/statm") as statm:
+            fields = statm.read().split()
+        return (int(fields[1]) - int(fields[2])) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        return 0
+
+def _measure_context_load(mode, context, instrument):
+    """Worker run in a fresh process which loads `context` from its pickle or its
+    context image according to `mode`,  and then uses every rmap of `instrument`.
+
+    Returns { "seconds" : float, "rss" : int, "private" : int, "use_rss" : int, "use_private" : int }
+    """
+    gc.collect()
+    rss, private = resident_bytes(), private_bytes()
+    start = timeit.default_timer()
+    if mode == "image":
+        loaded = heavy_client.load_context_image(context)
+    else:
+        loaded = heavy_client.load_pickled_mapping(context)
+    seconds = timeit.default_timer() - start
+    gc.collect()
+    result = dict(seconds=seconds, rss=resident_bytes() - rss, private=private_bytes() - private)
+    for rmapping in loaded.get_imap(instrument).selections.normal_values():
+        rmapping.selector.reference_names()
+    gc.collect()
+    result.update(use_rss=resident_bytes() - rss, use_private=private_bytes() - private)
+    return result
+
+def image_report(context, instrument=None):
+    """Save `context` both as a pickle and as a context image in a temporary directory,
+    then load each in a fresh process,  measuring load time and the growth of resident
+    and private memory after loading and after using the rmaps of `instrument`,
+    nominally the first instrument of `context`.
+
+    Returns { "pickle" : result, "image" : result } for results of _measure_context_load().
+    """
+    loaded = rmap.get_cached_mapping(context)
+    loaded.force_load()
+    if instrument is None:
+        instrument = loaded.selections.normal_keys()[0]
+    name = os.path.basename(context)
+    original = os.environ.get("CRDS_PICKLEPATH_SINGLE")
+    report = {}
+    with tempfile.TemporaryDirectory() as picklepath:
+        os.environ["CRDS_PICKLEPATH_SINGLE"] = picklepath
+        try:
+            heavy_client._save_pickle(config.locate_pickle(name), loaded, "none")
+            with open(config.locate_context_image(name), "wb") as image:
+                image.write(context_image.dumps_image(name, loaded.observatory))
+            for mode in ["pickle", "image"]:
+                with multiprocessing.get_context("spawn").Pool(1) as pool:
+                    report[mode] = pool.apply(_measure_context_load, (mode, name, instrument))
+        finally:
+            if original is None:
+                os.environ.pop("CRDS_PICKLEPATH_SINGLE", None)
+            else:
+                os.environ["CRDS_PICKLEPATH_SINGLE"] = original
+    return report
+
+def format_image_report(context, report):
+    """Return the lines summarizing image_report() `report` for `context`."""
+    lines = []
+    for mode, result in report.items():
+        lines.append(" ".join([
+            context.ljust(32), mode.ljust(8),
+            "load={:.3f}s".format(result["seconds"]),
+            "rss={:.1f}M".format(result["rss"] / 2**20),
+            "private={:.1f}M".format(result["private"] / 2**20),
+            "used_rss={:.1f}M".format(result["use_rss"] / 2**20),
+            "used_private={:.1f}M".format(result["use_private"] / 2**20)]))
+    return lines
+
+# ===================================================================
+
+class BenchmarksScript(cmdline.ContextsScript):
+    """Command line script for timing CRDS rules processing internals."""
+
+    description = """
+Times CRDS rules processing primitives,  nominally best reference lookups,  on the largest rmaps
+of the specified contexts or on explicitly specified rmaps.   Each benchmark verifies that the
+current implementation agrees with the reference implementation it replaced before timing both.
+"""
+
+    epilog = """
+** Benchmark the 3 largest rmaps of the operational HST and JWST contexts:
+
+% crds benchmarks --contexts hst-operational jwst-operational --count 3
+
+** Benchmark specific rmaps by filename or path:
+
+% crds benchmarks --rmaps ./hst_acs_darkfile.rmap --benchmarks match
+
+Each result line reports the rmap,  its total selection count,  the number of sampled lookups,
+the per-lookup latency of the current and reference implementations,  and the speedup.
+
+** Report the memory and load time of all rmaps of a context with and without interned Matchers:
+
+% crds benchmarks --contexts hst-operational --memory-report
+
+** Report the resident memory of fully loaded operational HST and JWST contexts:
+
+% crds benchmarks --contexts hst-operational jwst-operational --rss-report
+
+** Compare the per-process load time and memory of context pickles and memory mapped context images:
+
+% crds benchmarks --contexts hst-operational --image-report
+"""
+
+    def add_args(self):
+        super(BenchmarksScript, self).add_args()
+        self.add_argument("--rmaps", nargs="+", default=(),
+            help="Explicitly named or pathed rmaps to benchmark.")
+        self.add_argument("--count", type=int, default=3,
+            help="Number of largest rmaps of each context to benchmark.")
+        self.add_argument("--benchmarks", nargs="+", default=sorted(BENCHMARKS), choices=sorted(BENCHMARKS),
+            help="Benchmarks to run,  defaulting to all.")
+        self.add_argument("--repeat", type=int, default=3,
+            help="Number of timing trials,  the fastest is reported.")
+        self.add_argument("--memory-report", action="store_true",
+            help="Instead of timing lookups,  report memory use and load time of all the rmaps with and without interned Matchers.")
+        self.add_argument("--rss-report", action="store_true",
+            help="Instead of timing lookups,  report the resident memory growth and load time of each fully loaded context.")
+        self.add_argument("--image-report", action="store_true",
+            help="Instead of timing lookups,  compare per-process load time and memory of each context's pickle and context image.")
+
+    def determine_contexts(self):
+        """Only use default contexts if no rmaps are explicitly specified."""
+        if self.args.rmaps and not self.args.contexts:
+            return []
+        return super(BenchmarksScript, self).determine_contexts()
+
+    def main(self):
+        """Run each requested benchmark on each selected rmap and print the results."""
+        if self.args.memory_report:
+            paths = rmap_paths(self.args.rmaps, self.contexts)
+            log.info("Memory report for", len(paths), "rmaps.")
+            for line in format_memory_report(memory_report(paths)):
+                print(line)
+            return log.errors()
+        if self.args.rss_report:
+            for context in self.contexts:
+                with log.error_on_exception("RSS report failed for", repr(context)):
+                    result = rss_report(context)
+                    print(context.ljust(32),
+                          "mappings=" + str(result["mappings"]),
+                          "selections=" + str(result["selections"]),
+                          "load={:.2f}s".format(result["seconds"]),
+                          "rss={:.1f}M".format(result["rss"] / 2**20))
+            return log.errors()
+        if self.args.image_report:
+            for context in self.contexts:
+                with log.error_on_exception("Image report failed for", repr(context)):
+                    for line in format_image_report(context, image_report(context)):
+                        print(line)
+            return log.errors()
+        rmappings = load_rmaps(self.args.rmaps, self.contexts, self.args.count)
+        for name in self.args.benchmarks:
+            benchmark, description, timings = BENCHMARKS[name]
+            log.info("Benchmark", repr(name), ":", description + ".")
+            for rmapping in rmappings:
+                with log.error_on_exception("Benchmark", repr(name), "failed for", repr(rmapping.basename)):
+                    result = benchmark(rmapping, self.args.repeat)
+                    print(self.format_result(rmapping, result, timings))
+        return log.errors()
+
+    def format_result(self, rmapping, result, timings):
+        """Return a one line summary of benchmark `result` for `rmapping`."""
+        fields = [os.path.basename(rmapping.filename).ljust(32)]
+        fields += [key + "=" + str(value) for (key, value) in result.items() if key not in timings]
+        fields += [key + "=" + "{:.1f}us".format(result[key] * 1e6) for key in timings]
+        if result[timings[0]]:
+            fields.append("speedup=" + "{:.1f}x".format(result[timings[1]] / result[timings[0]]))
+        return " ".join(fields)
+
+if __name__ == "__main__":
+    sys.exit(BenchmarksScript()())
@@ -0,0 +1,52 @@
+"""This module defines the "crds serve" command which runs a long lived local daemon
+answering getreferences() and getrecommendations() requests over a Unix domain
+socket,  keeping contexts loaded between requests.   See crds.core.serve.
+"""
+import os
+import sys
+
+from crds.core import log, cmdline, config, serve
+
+# ===================================================================
+
+class ServeScript(cmdline.Script):
+    """Command line script for running a local best references daemon."""
+
+    description = """
+Runs a daemon which computes best references for the processes of this host over a Unix
+domain socket.   Contexts are loaded once and kept in memory,  so each request only pays
+for the best references computation itself.
+
+Processes call the daemon from crds.getreferences() and crds.getrecommendations() when
+CRDS_SERVE_SOCKET is set to its socket,  otherwise falling back to computing best
+references themselves if the daemon can't be contacted.
+"""
+
+    epilog = """
+Run a daemon which initially loads the current operational context:
+
+% crds serve --socket /tmp/crds_jwst.sock --contexts jwst-operational --jwst &
+
+Then set CRDS_SERVE_SOCKET for pipeline processes on the host:
+
+% export CRDS_SERVE_SOCKET=/tmp/crds_jwst.sock
+"""
+    def add_args(self):
+        """Add command line parameters unique to this script."""
+        super(ServeScript, self).add_args()
+        self.add_argument("--socket", type=str, default=None,
+                          help="Path of the Unix domain socket to serve on,  default CRDS_SERVE_SOCKET.")
+        self.add_argument("--contexts", nargs="*", default=(), metavar="CONTEXTS",
+                          help="Contexts,  e.g. jwst-operational,  to load before serving requests.")
+
+    def main(self):
+        """Serve best references requests until interrupted."""
+        socket_path = self.args.socket or config.SERVE_SOCKET.get()
+        if socket_path == "none":
+            log.error("Specify the daemon socket with --socket or CRDS_SERVE_SOCKET.")
+            return log.errors()
+        serve.serve(os.path.abspath(socket_path), self.args.contexts, self.observatory)
+        return log.errors()
+
+if __name__ == "__main__":
+    sys.exit(ServeScript()())
@@ -32,7 +32,7 @@ import glob
 # ============================================================================
 
 import crds
-from crds.core import log, config, utils, rmap, heavy_client, cmdline, crds_cache_locking
+from crds.core import log, config, utils, rmap, heavy_client, cmdline, crds_cache_locking, uses_index
 from crds import data_file
 from crds.core.log import srepr
 from crds.client import api
@@ -237,7 +237,7 @@ class SyncScript(cmdline.ContextsScript):
         self.add_argument('-k', '--check-files', action='store_true', dest='check_files',
                           help='Check cached files against the CRDS database and report anomalies.')
         self.add_argument('-s', '--check-sha1sum', action='store_true', dest='check_sha1sum',
-                          help='For --check-files,  also verify file sha1sums.')
+                          help='For --check-files,  also verify file sha1sums.  Also fully verify mapping checksums when loading mappings.')
         self.add_argument('-r', '--repair-files', action='store_true', dest='repair_files',
                           help='Repair or re-download files noted as bad by --check-files')
         self.add_argument('--purge-rejected', action='store_true', dest='purge_rejected',
@@ -265,6 +265,8 @@ class SyncScript(cmdline.ContextsScript):
                           help="Remove CRDS cache file lock(s).")
         self.add_argument("--force-config-update", action="store_true",
                           help="Even if sync errors occur, attempt to update the CRDS configuration, including the default context.")
+        self.add_argument("--jobs", type=int, default=None,
+                          help="Number of files to download concurrently,  default CRDS_DOWNLOAD_JOBS or 1.")
 
     # ------------------------------------------------------------------------------------------
 
@@ -301,6 +303,10 @@ class SyncScript(cmdline.ContextsScript):
             self.args.purge_blacklisted or self.args.purge_rejected):
             self.verify_files(verify_file_list)
 
+        # keep the uses index current with the sync'ed mappings
+        if config.USES_INDEX and not self.readonly_cache:
+            self.update_uses_index()
+
         # context pickles should only be (re)generated after mappings are fully sync'ed and verified
         if self.args.save_pickles:
             self.pickle_contexts(self.contexts)
@@ -330,6 +336,12 @@ class SyncScript(cmdline.ContextsScript):
         if self.args.repair_files:
             self.args.check_files = True
 
+        if self.args.check_sha1sum:   # don't trust recorded mapping checksums
+            config.FORCE_MAPPING_CHECKSUMS.set(True)
+
+        if self.args.jobs is not None:
+            config.DOWNLOAD_JOBS.set(self.args.jobs)
+
         if self.args.output_dir:
             os.environ["CRDS_MAPPATH_SINGLE"] = self.args.output_dir
             os.environ["CRDS_REFPATH_SINGLE"] = self.args.output_dir
@@ -423,17 +435,31 @@ class SyncScript(cmdline.ContextsScript):
             log.warning("Errors occurred during sync,  skipping CRDS cache config and context update.")
 
     def clear_pickles(self):
-        """Remove all pickles."""
+        """Remove all pickles,  including pickle shards,  match indexes,  stored rmap selectors,
+        and context images.
+        """
         log.info("Removing all context pickles.  Use --save-pickles to recreate for specified contexts.")
-        for path in rmap.list_pickles("*.pmap", self.observatory, full_path=True):
+        paths = [path for pattern in ["*.pmap", "*.imap", "*.rmap", "*.pmap.matches"]
+                 for path in rmap.list_pickles(pattern, self.observatory, full_path=True)]
+        paths += sorted(glob.glob(config.locate_context_image("*.pmap", self.observatory)))
+        paths.append(config.get_crds_rmap_store_path(self.observatory))
+        for path in paths:
             if os.path.exists(path):
                 utils.remove(path, self.observatory)
 
+    def update_uses_index(self):
+        """Index any new or changed mappings in the CRDS cache for crds uses and matches."""
+        with log.error_on_exception("Failed updating uses index"):
+            updated = uses_index.UsesIndex(self.observatory).update()
+            log.verbose("Uses index updated for", len(updated), "mappings.")
+
     def pickle_contexts(self, contexts):
         """Save pickled versions of `contexts` in the CRDS cache.
 
         By default this will by-pass existing pickles if they successfully load.
         """
+        rmap.preload_mappings([context for context in contexts
+                               if not os.path.exists(config.locate_pickle(context))])
         for context in contexts:
             with log.error_on_exception("Failed pickling", repr(context)):
                 crds.get_pickled_mapping.uncached(context, use_pickles=True, save_pickles=True)  # reviewed
@@ -18,7 +18,7 @@ reference or mapping file.
 import sys
 import os.path
 
-from crds.core import config, cmdline, utils, log, rmap
+from crds.core import config, cmdline, utils, log, rmap, uses_index
 
 @utils.cached
 def load_all_mappings(observatory, pattern="*map"):
@@ -26,6 +26,7 @@ def load_all_mappings(observatory, pattern="*map"):
     onto the loaded Mapping object.
     """
     all_mappings = rmap.list_mappings(pattern, observatory)
+    rmap.preload_mappings(all_mappings)
     loaded = {}
     for name in all_mappings:
         with log.error_on_exception("Failed loading", repr(name)):
@@ -88,7 +89,13 @@ def _findall_mappings_using_rmap(rmap, observatory="hst"):
     return sorted(list(set(mappings)))
 
 def uses(files, observatory="hst"):
-    """Return the list of mappings which use any of `files`."""
+    """Return the list of mappings which use any of `files`.
+
+    With CRDS_USES_INDEX the answer comes from the persistent uses index of the
+    cache rather than loading every mapping.
+    """
+    if config.USES_INDEX:
+        return uses_index.get_uses_index(observatory).uses(files)
     mappings = []
     for file_ in files:
         if file_.endswith(".rmap"):
@@ -1,7 +1,8 @@
-from pytest import mark
+from pytest import mark, raises
 import os
 import re
-from crds.core import log, heavy_client, utils
+import pickle
+from crds.core import log, heavy_client, rmap, utils
 from crds.core import config as crds_config
 from crds.core.exceptions import *
 from crds.client import api
@@ -284,3 +285,266 @@ def dt_get_context_parkeys(jwst_serverless_state):
     assert parkeys2 == ['META.INSTRUMENT.LAMP_STATE', 'META.OBSERVATION.DATE', 'META.VISIT.TSOVISIT', 'REFTYPE']
     parkeys3 = heavy_client.get_context_parkeys("jwst_miri_flat.rmap","miri")
     assert parkeys3 == ['META.OBSERVATION.DATE', 'META.VISIT.TSOVISIT', 'META.INSTRUMENT.LAMP_STATE']
+
+
+@mark.hst
+@mark.core
+@mark.heavy_client
+def test_sharded_pickled_mappings(hst_temp_cache_state, hst_data, tmp_path, monkeypatch):
+    monkeypatch.setenv("CRDS_MAPPATH_SINGLE", hst_data)
+    monkeypatch.setenv("CRDS_PICKLEPATH_SINGLE", str(tmp_path))
+    monkeypatch.setenv("CRDS_IGNORE_CHECKSUM", "1")
+    utils.clear_function_caches()
+    loaded = heavy_client.get_pickled_mapping("hst_0001.pmap", use_pickles=False)
+    for shards, pickles in [("imap", 7), ("rmap", 116)]:
+        for path in tmp_path.iterdir():
+            path.unlink()
+        monkeypatch.setenv("CRDS_PICKLE_SHARDS", shards)
+        heavy_client.save_pickled_mapping("hst_0001.pmap", loaded)
+        assert len(list(tmp_path.iterdir())) == pickles
+        p = heavy_client.load_pickled_mapping("hst_0001.pmap")
+        assert p.selections.loaded_values() == []
+        i = p.get_imap("COS")
+        assert p.selections.loaded_values() == [i]
+        assert bool(i.selections.loaded_values()) == (shards == "imap")
+        assert i.get_rmap("flatfile").reference_names() == loaded.get_imap("COS").get_rmap("flatfile").reference_names()
+        assert p.reference_names() == loaded.reference_names()
+
+
+@mark.hst
+@mark.core
+@mark.heavy_client
+def test_sharded_pickle_missing_shard(hst_temp_cache_state, hst_data, tmp_path, monkeypatch):
+    monkeypatch.setenv("CRDS_MAPPATH_SINGLE", hst_data)
+    monkeypatch.setenv("CRDS_PICKLEPATH_SINGLE", str(tmp_path))
+    monkeypatch.setenv("CRDS_IGNORE_CHECKSUM", "1")
+    monkeypatch.setenv("CRDS_PICKLE_SHARDS", "imap")
+    utils.clear_function_caches()
+    loaded = heavy_client.get_pickled_mapping("hst_0001.pmap", use_pickles=False)
+    heavy_client.save_pickled_mapping("hst_0001.pmap", loaded)
+    (tmp_path / "hst_cos.imap.pkl").unlink()
+    p = heavy_client.load_pickled_mapping("hst_0001.pmap")
+    assert p.get_imap("COS").reference_names() == loaded.get_imap("COS").reference_names()
+
+
+@mark.hst
+@mark.core
+@mark.heavy_client
+def test_rmap_store_pickles(hst_temp_cache_state, hst_data, tmp_path, monkeypatch):
+    monkeypatch.setenv("CRDS_MAPPATH_SINGLE", hst_data)
+    monkeypatch.setenv("CRDS_PICKLEPATH_SINGLE", str(tmp_path))
+    monkeypatch.setenv("CRDS_IGNORE_CHECKSUM", "1")
+    utils.clear_function_caches()
+    loaded1 = heavy_client.get_pickled_mapping("hst_0001.pmap", use_pickles=False)
+    loaded2 = heavy_client.get_pickled_mapping("hst_0002.pmap", use_pickles=False)
+    heavy_client.save_pickled_mapping("hst_0001.pmap", loaded1)
+    monolithic = (tmp_path / "hst_0001.pmap.pkl").stat().st_size
+    (tmp_path / "hst_0001.pmap.pkl").unlink()
+    monkeypatch.setenv("CRDS_RMAP_STORE", "1")
+    heavy_client.save_pickled_mapping("hst_0001.pmap", loaded1)
+    heavy_client.save_pickled_mapping("hst_0002.pmap", loaded2)
+    assert (tmp_path / "hst_0001.pmap.pkl").stat().st_size < monolithic / 2
+    stored = list((tmp_path / "rmap_store").iterdir())
+    assert stored
+    rmap.RMAP_STORE.clear()
+    p1 = heavy_client.load_pickled_mapping("hst_0001.pmap")
+    p2 = heavy_client.load_pickled_mapping("hst_0002.pmap")
+    assert p1.reference_names() == loaded1.reference_names()
+    assert p2.reference_names() == loaded2.reference_names()
+    stored_names = sorted(path.name for path in stored)
+    assert len(stored_names) == len(set(stored_names))
+    flat1 = p1.get_imap("COS").get_rmap("flatfile")
+    flat2 = p2.get_imap("COS").get_rmap("flatfile")
+    assert flat1.selector is flat2.selector
+    assert rmap.RMAP_STORE.stats()["size"] <= len(stored)
+
+
+@mark.hst
+@mark.core
+@mark.heavy_client
+def test_remove_pickled_mapping_keeps_shards(hst_temp_cache_state, hst_data, tmp_path, monkeypatch):
+    monkeypatch.setenv("CRDS_MAPPATH_SINGLE", hst_data)
+    monkeypatch.setenv("CRDS_PICKLEPATH_SINGLE", str(tmp_path))
+    monkeypatch.setenv("CRDS_IGNORE_CHECKSUM", "1")
+    monkeypatch.setenv("CRDS_PICKLE_SHARDS", "rmap")
+    monkeypatch.setenv("CRDS_RMAP_STORE", "1")
+    utils.clear_function_caches()
+    loaded = heavy_client.get_pickled_mapping("hst_0001.pmap", use_pickles=False)
+    heavy_client.save_pickled_mapping("hst_0001.pmap", loaded)
+    monkeypatch.setenv("CRDS_CONTEXT_IMAGES", "1")
+    heavy_client.save_pickled_mapping("hst_0001.pmap", loaded)
+    assert (tmp_path / "hst_0001.pmap.img").exists()
+    shards = sorted(path.name for path in tmp_path.iterdir() if not path.name.startswith("hst_0001.pmap"))
+    stored = sorted(path.name for path in (tmp_path / "rmap_store").iterdir())
+    assert "hst_cos.imap.pkl" in shards and stored
+    heavy_client.remove_pickled_mapping("hst_0001.pmap")
+    assert not (tmp_path / "hst_0001.pmap.pkl").exists()
+    assert not (tmp_path / "hst_0001.pmap.img").exists()
+    assert sorted(path.name for path in tmp_path.iterdir()) == shards
+    assert sorted(path.name for path in (tmp_path / "rmap_store").iterdir()) == stored
+
+
+@mark.hst
+@mark.core
+@mark.heavy_client
+def test_context_images(hst_temp_cache_state, hst_data, tmp_path, monkeypatch):
+    monkeypatch.setenv("CRDS_MAPPATH_SINGLE", hst_data)
+    monkeypatch.setenv("CRDS_PICKLEPATH_SINGLE", str(tmp_path))
+    monkeypatch.setenv("CRDS_IGNORE_CHECKSUM", "1")
+    monkeypatch.setenv("CRDS_CONTEXT_IMAGES", "1")
+    utils.clear_function_caches()
+    loaded = heavy_client.get_pickled_mapping("hst_0001.pmap", use_pickles=True, save_pickles=True)
+    assert [path.name for path in tmp_path.iterdir()] == ["hst_0001.pmap.img"]
+    image = heavy_client.get_pickled_mapping("hst_0001.pmap", use_pickles=True, save_pickles=False)
+    assert image is not loaded
+    assert image.selections.loaded_values() == []
+    cos = image.get_imap("COS")
+    flatfile = cos.get_rmap("flatfile")
+    assert not flatfile.selector_is_loaded()
+    assert flatfile.reference_names() == loaded.get_imap("COS").get_rmap("flatfile").reference_names()
+    assert flatfile.selector_is_loaded()
+    assert image.reference_names() == loaded.reference_names()
+    assert image.mapping_names() == loaded.mapping_names()
+    for rmapping in image.get_imap("ACS").selections.normal_values():
+        original = loaded.get_imap("ACS").get_rmap(rmapping.filekind)
+        assert rmapping.header == original.header
+        assert rmapping.selector.format() == original.selector.format()
+
+
+@mark.hst
+@mark.core
+@mark.heavy_client
+def test_context_image_errors(hst_temp_cache_state, hst_data, tmp_path, monkeypatch):
+    monkeypatch.setenv("CRDS_MAPPATH_SINGLE", hst_data)
+    monkeypatch.setenv("CRDS_PICKLEPATH_SINGLE", str(tmp_path))
+    monkeypatch.setenv("CRDS_IGNORE_CHECKSUM", "1")
+    monkeypatch.setenv("CRDS_CONTEXT_IMAGES", "1")
+    utils.clear_function_caches()
+    (tmp_path / "hst_0001.pmap.img").write_bytes(b"CRDSIMG0" + bytes(40))
+    with raises(FileFormatError):
+        heavy_client.load_context_image("hst_0001.pmap")
+    loaded = heavy_client.get_pickled_mapping("hst_0001.pmap", use_pickles=True, save_pickles=True)
+    image = heavy_client.load_context_image("hst_0001.pmap")
+    assert image.reference_names() == loaded.reference_names()
+    unpickled = pickle.loads(pickle.dumps(image))
+    assert unpickled.get_imap("COS").get_rmap("flatfile").reference_names() == \
+        loaded.get_imap("COS").get_rmap("flatfile").reference_names()
+    truncated = (tmp_path / "hst_0001.pmap.img").read_bytes()[:-10]
+    (tmp_path / "hst_0001.pmap.img").write_bytes(truncated)
+    with raises(FileFormatError):
+        heavy_client.load_context_image("hst_0001.pmap")
+
+
+@mark.hst
+@mark.core
+@mark.heavy_client
+def test_context_image_checksums(hst_temp_cache_state, hst_data, tmp_path, monkeypatch):
+    from crds.core import context_image
+    monkeypatch.setenv("CRDS_MAPPATH_SINGLE", str(tmp_path))
+    monkeypatch.setenv("CRDS_PICKLEPATH_SINGLE", str(tmp_path))
+    monkeypatch.setenv("CRDS_CONTEXT_IMAGES", "1")
+    text = open(os.path.join(hst_data, "hst_cos_flatfile.rmap")).read()
+    (tmp_path / "hst_cos_flatfile.rmap").write_text(text.replace("v2e20129l_flat.fits", "v2e20129m_flat.fits"))
+    with raises(ChecksumError, match="sha1sum mismatch in 'hst_cos_flatfile.rmap'"):
+        context_image.dumps_image("hst_cos_flatfile.rmap", "hst")
+    loaded = rmap.ReferenceMapping.from_string(text, "hst_cos_flatfile.rmap", ignore_checksum=True)
+    heavy_client.save_context_image("hst_cos_flatfile.rmap", loaded)
+    assert not (tmp_path / "hst_cos_flatfile.rmap.img").exists()
+    monkeypatch.setenv("CRDS_IGNORE_MAPPING_CHECKSUM", "1")
+    image = context_image.ContextImage.from_bytes(context_image.dumps_image("hst_cos_flatfile.rmap", "hst"))
+    assert "v2e20129m_flat.fits" in image.load("hst_cos_flatfile.rmap").reference_names()
+
+
+@mark.hst
+@mark.core
+@mark.heavy_client
+def test_context_image_report(hst_temp_cache_state, hst_data, monkeypatch):
+    from crds.misc import benchmarks
+    monkeypatch.setenv("CRDS_MAPPATH_SINGLE", hst_data)
+    monkeypatch.setenv("CRDS_IGNORE_CHECKSUM", "1")
+    utils.clear_function_caches()
+    report = benchmarks.image_report("hst_0001.pmap", "cos")
+    assert sorted(report) == ["image", "pickle"]
+    assert all(result["seconds"] > 0 for result in report.values())
+    assert len(benchmarks.format_image_report("hst_0001.pmap", report)) == 2
+
+
+COS_HEADERS = [
+    { "INSTRUME" : "COS", "DETECTOR" : detector, "OPT_ELEM" : opt_elem, "LIFE_ADJ" : "1",
+      "DATE-OBS" : date, "TIME-OBS" : "00:00:00", "ROOTNAME" : "la8q99" + str(i) }
+    for (i, (detector, opt_elem, date)) in enumerate([
+        ("FUV", "G130M", "2012-01-01"), ("NUV", "G160M", "2012-01-01"), ("FUV", "G130M", "2012-01-01"),
+        ("NUV", "G230L", "2012-01-01"), ("NUV", "G230L", "2001-01-01"), ("FUV", "G130M", "2013-05-05"),
+    ])]
+
+
+@mark.hst
+@mark.core
+@mark.heavy_client
+def test_getrecommendations_many(hst_offline_state, monkeypatch):
+    expected = [heavy_client.getrecommendations(header, reftypes=["flatfile"], context="hst_cos.imap",
+                                                observatory="hst") for header in COS_HEADERS]
+    computed = []
+    get_best_references = rmap.InstrumentContext.get_best_references
+    def counted(self, header, include=None):
+        computed.append(header)
+        return get_best_references(self, header, include)
+    monkeypatch.setattr(rmap.InstrumentContext, "get_best_references", counted)
+    bestrefs = heavy_client.getrecommendations_many(
+        COS_HEADERS, reftypes=["flatfile"], context="hst_cos.imap", observatory="hst")
+    assert bestrefs == expected
+    assert [refs["flatfile"] for refs in bestrefs] == [
+        "v3n1816ml_flat.fits", "v4s17227l_flat.fits", "v3n1816ml_flat.fits",
+        "v2e20129l_flat.fits", "NOT FOUND n/a", "v3n1816ml_flat.fits"]
+    assert len(computed) == 5
+
+
+@mark.hst
+@mark.core
+@mark.heavy_client
+def test_getreferences_many(hst_offline_state, tmp_path, monkeypatch):
+    monkeypatch.setenv("CRDS_REFPATH_SINGLE", str(tmp_path / "references"))
+    paths = {}
+    for name in ["v3n1816ml_flat.fits", "v4s17227l_flat.fits", "v2e20129l_flat.fits"]:
+        paths[name] = crds_config.locate_file(name, "hst")
+        utils.ensure_dir_exists(paths[name])
+        with open(paths[name], "w"):
+            pass
+    cached = []
+    get_local_files = api.FileCacher.get_local_files
+    def counted(self, names):
+        cached.append(names)
+        return get_local_files(self, names)
+    monkeypatch.setattr(api.FileCacher, "get_local_files", counted)
+    checked = []
+    check_parameters = heavy_client.check_parameters
+    def counted_check(parameters):
+        checked.append(parameters)
+        return check_parameters(parameters)
+    monkeypatch.setattr(heavy_client, "check_parameters", counted_check)
+    references = heavy_client.getreferences_many(
+        COS_HEADERS, reftypes=["flatfile"], context="hst_cos.imap", observatory="hst")
+    assert cached == [["v2e20129l_flat.fits", "v3n1816ml_flat.fits", "v4s17227l_flat.fits"]]
+    assert checked == COS_HEADERS
+    assert references[0] == { "flatfile" : paths["v3n1816ml_flat.fits"] }
+    assert references[3] == { "flatfile" : paths["v2e20129l_flat.fits"] }
+    assert references[4] == { "flatfile" : "NOT FOUND n/a" }
+    assert references[5] == references[0]
+
+
+@mark.hst
+@mark.core
+@mark.heavy_client
+def test_remote_bestrefs_many_strings(hst_offline_state, monkeypatch):
+    sent = []
+    def get_best_references_by_header_map(context, header_map, reftypes=None):
+        sent.append(header_map)
+        return { dataset : { "flatfile" : "v3n1816ml_flat.fits" } for dataset in header_map }
+    monkeypatch.setattr(api, "get_best_references_by_header_map", get_best_references_by_header_map)
+    monkeypatch.setattr(heavy_client, "get_config_info", lambda observatory: { "max_headers_per_rpc" : 2 })
+    headers = [dict(COS_HEADERS[0], LIFE_ADJ=1, EXPTIME=2.5)] * 3
+    bestrefs = heavy_client.remote_bestrefs_many("hst", "hst_cos.imap", headers, ["flatfile"])
+    assert bestrefs == [{ "flatfile" : "v3n1816ml_flat.fits" }] * 3
+    assert [len(header_map) for header_map in sent] == [2, 1]
+    assert sent[1]["0"] == { str(key) : str(value) for (key, value) in headers[0].items() }
+    assert sent[1]["0"]["LIFE_ADJ"] == "1" and sent[1]["0"]["EXPTIME"] == "2.5"
@@ -1,12 +1,17 @@
 """This module tests some of the more complex features of the basic rmap infrastructure.
 """
-from pytest import mark, fixture
+from pytest import mark, fixture, raises
 import os
+import glob
 import json
 import pickle
+import re
 import sys
+import numpy as np
 import crds
 from crds import rmap, log, utils
+from crds.core import selectors, mapping_reader
+from crds.misc import benchmarks
 from crds import config as crds_config
 from crds.core.exceptions import *
 import logging
@@ -1006,6 +1011,305 @@ def test_rmap_match_omit(default_shared_state, hst_data):
             }) is None
 
 
+@mark.hst
+@mark.core
+@mark.rmap
+def test_rmap_get_best_refs_many(default_shared_state, hst_data):
+    r = rmap.get_cached_mapping(f"{hst_data}/hst_acs_darkfile_na_omit.rmap")
+    headers = {
+        "DETECTOR" : np.array(["HRC", "HRC", "SBC", "SBC", "SBC", "SBC", "WFC"]),
+        "CCDAMP" : np.array(["AD", "AD", "A", "A", "A", "A", "A"]),
+        "CCDGAIN" : np.array(["2.0", "2.0", "1.0", "1.0", "1.0", "1.0", "1.0"]),
+        "DATE-OBS" : np.array(["2002-03-20", "1990-01-01", "1993-01-01", "2002-03-19", "2002-03-18", "2002-03-18", "2002-03-18"]),
+        "TIME-OBS" : np.array(["12:00:00", "00:00:00", "12:00:00", "00:34:32", "00:00:00", "00:00:00", "00:00:00"]),
+    }
+    bestrefs = r.get_best_refs_many(headers)
+    assert bestrefs[0] == "n3o1022hj_drk.fits"
+    assert bestrefs[1] == "NOT FOUND No match found."
+    assert bestrefs[2:6] == ["NOT FOUND n/a", None, "n3o1022ej_drk.fits", "n3o1022ej_drk.fits"]
+    assert bestrefs[6].startswith("NOT FOUND")
+    assert bestrefs == [r.get_best_ref(header) for header in selectors.batch_headers(headers)]
+
+
+@mark.hst
+@mark.core
+@mark.rmap
+def test_rmap_bestrefs_memo(default_shared_state, hst_data):
+    r = rmap.ReferenceMapping.from_file(f"{hst_data}/hst_acs_darkfile_na_omit.rmap", ignore_checksum=True)
+    headers = selectors.batch_headers({
+        "DETECTOR" : ["HRC", "HRC", "SBC", "SBC", "SBC", "SBC", "WFC"],
+        "CCDAMP" : ["AD", "AD", "A", "A", "A", "A", "A"],
+        "CCDGAIN" : ["2.0", "2.0", "1.0", "1.0", "1.0", "1.0", "1.0"],
+        "DATE-OBS" : ["2002-03-20", "1990-01-01", "1993-01-01", "2002-03-19", "2002-03-18", "2002-03-18", "2002-03-18"],
+        "TIME-OBS" : ["12:00:00", "00:00:00", "12:00:00", "00:34:32", "00:00:00", "00:00:00", "00:00:00"],
+    })
+    bestrefs = [r.get_best_ref(header) for header in headers]
+    assert bestrefs[2:6] == ["NOT FOUND n/a", None, "n3o1022ej_drk.fits", "n3o1022ej_drk.fits"]
+    assert r.get_memo_stats() == dict(hits=1, misses=6, size=4, maxsize=1000)
+    assert [r.get_best_ref(dict(header, FOO="BAR")) for header in headers] == bestrefs
+    # failed first selections,  rows 1 and 6,  go through DNR and fallback checks every time.
+    assert r.get_memo_stats() == dict(hits=6, misses=8, size=4, maxsize=1000)
+
+    deleted = r.delete("n3o1022ej_drk.fits")
+    assert deleted.get_memo_stats()["size"] == 0
+    assert deleted.get_best_ref(headers[4]) != "n3o1022ej_drk.fits"
+
+
+@mark.hst
+@mark.core
+@mark.rmap
+def test_rmap_bestrefs_memo_relevance(default_shared_state, hst_data):
+    header = {"DETECTOR" : "FUV-MAMA", "DATE-OBS" : "2002-03-18", "TIME-OBS" : "00:00:00"}
+    imaging = dict(header, OBSTYPE="IMAGING")
+    spectroscopic = dict(header, OBSTYPE="SPECTROSCOPIC")
+    for queries in [(imaging, spectroscopic), (spectroscopic, imaging)]:
+        r = rmap.ReferenceMapping.from_file(f"{hst_data}/hst_stis_disptab.rmap", ignore_checksum=True)
+        for _ in range(2):
+            assert [r.get_best_ref(query) for query in queries] == \
+                ["NOT FOUND n/a" if query is imaging else "m7p16110o_dsp.fits" for query in queries]
+        assert r.get_memo_stats()["size"] == 2
+
+
+@mark.hst
+@mark.core
+@mark.rmap
+def test_rmap_bestrefs_memo_disabled(default_shared_state, hst_data, monkeypatch):
+    monkeypatch.setenv("CRDS_BESTREFS_MEMO_SIZE", "0")
+    r = rmap.ReferenceMapping.from_file(f"{hst_data}/hst_acs_darkfile_na_omit.rmap", ignore_checksum=True)
+    header = {"DETECTOR": "SBC", "CCDAMP": "A", "CCDGAIN": "1.0", "DATE-OBS": "2002-03-18", "TIME-OBS": "00:00:00"}
+    assert r.get_best_ref(header) == r.get_best_ref(header) == "n3o1022ej_drk.fits"
+    assert r.get_memo_stats() == dict(hits=0, misses=0, size=0, maxsize=0)
+
+
+@mark.hst
+@mark.core
+@mark.rmap
+def test_rmap_lazy_selector(default_shared_state, hst_data, monkeypatch):
+    monkeypatch.setenv("CRDS_LAZY_RMAPS", "1")
+    r = rmap.ReferenceMapping.from_file(f"{hst_data}/hst_acs_darkfile_na_omit.rmap", ignore_checksum=True)
+    assert not r.selector_is_loaded()
+    assert r.get_required_parkeys() == ['DETECTOR', 'CCDAMP', 'CCDGAIN', 'DATE-OBS', 'TIME-OBS']
+    assert not pickle.loads(pickle.dumps(r)).selector_is_loaded()
+    header = {"DETECTOR": "SBC", "CCDAMP": "A", "CCDGAIN": "1.0", "DATE-OBS": "2002-03-18", "TIME-OBS": "00:00:00"}
+    assert r.get_best_ref(header) == "n3o1022ej_drk.fits"
+    assert r.selector_is_loaded()
+    assert pickle.loads(pickle.dumps(r)).selector_is_loaded()
+
+
+@mark.hst
+@mark.core
+@mark.rmap
+def test_rmap_lazy_selector_agrees(default_shared_state, hst_data, monkeypatch):
+    for path in glob.glob(f"{hst_data}/hst_*.rmap"):
+        try:
+            eager = rmap.ReferenceMapping.from_file(path, ignore_checksum=True)
+        except Exception:
+            continue
+        monkeypatch.setenv("CRDS_LAZY_RMAPS", "1")
+        lazy = rmap.ReferenceMapping.from_file(path, ignore_checksum=True)
+        monkeypatch.delenv("CRDS_LAZY_RMAPS")
+        assert lazy.header == eager.header
+        assert lazy.comment == eager.comment
+        assert str(lazy) == str(eager)
+
+
+@mark.hst
+@mark.core
+@mark.rmap
+def test_rmap_lazy_selector_errors(default_shared_state, hst_data, monkeypatch):
+    monkeypatch.setenv("CRDS_LAZY_RMAPS", "1")
+    with open(f"{hst_data}/hst_acs_darkfile_na_omit.rmap") as handle:
+        text = handle.read().replace("selector = Match({", "selector = Match({ ,")
+    r = rmap.ReferenceMapping.from_string(text, "bad.rmap", ignore_checksum=True)
+    with raises(MappingError, match="Can't load file bad.rmap"):
+        r.selector
+
+
+@mark.hst
+@mark.core
+@mark.rmap
+def test_rmap_selector_loads_old_pickle_state(default_shared_state, hst_data):
+    r = rmap.ReferenceMapping.from_file(f"{hst_data}/hst_acs_darkfile_na_omit.rmap", ignore_checksum=True)
+    state = r.__getstate__()
+    state["selector"] = state.pop("_selector")
+    old = rmap.ReferenceMapping.__new__(rmap.ReferenceMapping)
+    old.__setstate__(state)
+    assert old.selector is r.selector
+
+
+@mark.core
+@mark.rmap
+def test_rmap_store_shares_selectors(default_shared_state, hst_data, tmp_path, monkeypatch):
+    monkeypatch.setenv("CRDS_RMAP_STORE", "1")
+    rmap.RMAP_STORE.clear()
+    original = f"{hst_data}/hst_acs_darkfile_na_omit.rmap"
+    duplicate = tmp_path / "hst_acs_darkfile_duplicate.rmap"
+    with open(original) as handle:
+        duplicate.write_text(handle.read())
+    r1 = rmap.get_cached_mapping(original, ignore_checksum=True)
+    r2 = rmap.get_cached_mapping(str(duplicate), ignore_checksum=True)
+    assert r1 is not r2
+    assert r1.selector is r2.selector
+    assert rmap.RMAP_STORE.stats()["hits"] == 1
+    assert rmap.load_mapping(original, ignore_checksum=True).selector is not r1.selector
+    assert r1.copy().selector is not r1.selector
+    state = pickle.loads(pickle.dumps(r1)).__getstate__()
+    unpickled = rmap.ReferenceMapping.__new__(rmap.ReferenceMapping)
+    unpickled.__setstate__(state)
+    assert unpickled.selector is r1.selector
+
+
+@mark.core
+@mark.rmap
+def test_rmap_store_disabled(default_shared_state, hst_data, tmp_path, monkeypatch):
+    monkeypatch.setenv("CRDS_RMAP_STORE", "0")
+    rmap.RMAP_STORE.clear()
+    original = f"{hst_data}/hst_acs_darkfile_na_omit.rmap"
+    duplicate = tmp_path / "hst_acs_darkfile_duplicate.rmap"
+    with open(original) as handle:
+        duplicate.write_text(handle.read())
+    r1 = rmap.get_cached_mapping(original, ignore_checksum=True)
+    r2 = rmap.get_cached_mapping(str(duplicate), ignore_checksum=True)
+    assert r1.selector is not r2.selector
+    assert rmap.RMAP_STORE.stats()["size"] == 0
+
+
+@mark.core
+@mark.rmap
+def test_mapping_checksums_cached(default_shared_state, hst_data, tmp_path, monkeypatch):
+    monkeypatch.setenv("CRDS_CFGPATH_SINGLE", str(tmp_path / "config"))
+    monkeypatch.setenv("CRDS_CACHE_MAPPING_CHECKSUMS", "1")
+    rmap.MAPPING_CHECKSUMS.clear()
+    path = tmp_path / "hst_cos_flatfile.rmap"
+    with open(f"{hst_data}/hst_cos_flatfile.rmap") as handle:
+        path.write_text(handle.read())
+    computed = []
+    get_checksum = rmap.Mapping._get_checksum
+    def counted(text):
+        computed.append(text)
+        return get_checksum(text)
+    monkeypatch.setattr(rmap.Mapping, "_get_checksum", staticmethod(counted))
+    r1 = rmap.ReferenceMapping.from_file(str(path))
+    assert len(computed) == 1
+    r2 = rmap.ReferenceMapping.from_file(str(path))
+    assert len(computed) == 1
+    assert r2._content_checksum == r1._content_checksum == r1.header["sha1sum"]
+    rmap.MAPPING_CHECKSUMS.save()
+    rmap.MAPPING_CHECKSUMS.clear()
+    assert (tmp_path / "config" / "mapping_checksums.json").exists()
+    rmap.ReferenceMapping.from_file(str(path))
+    assert len(computed) == 1
+    monkeypatch.setenv("CRDS_FORCE_MAPPING_CHECKSUMS", "1")
+    rmap.ReferenceMapping.from_file(str(path))
+    assert len(computed) == 2
+    monkeypatch.setenv("CRDS_FORCE_MAPPING_CHECKSUMS", "0")
+    stat = path.stat()
+    os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10**9))
+    rmap.ReferenceMapping.from_file(str(path))
+    assert len(computed) == 3
+    rmap.ReferenceMapping.from_file(str(path))
+    assert len(computed) == 3
+
+
+@mark.core
+@mark.rmap
+def test_mapping_checksums_changed_file(default_shared_state, hst_data, tmp_path, monkeypatch):
+    monkeypatch.setenv("CRDS_CFGPATH_SINGLE", str(tmp_path / "config"))
+    monkeypatch.setenv("CRDS_CACHE_MAPPING_CHECKSUMS", "1")
+    rmap.MAPPING_CHECKSUMS.clear()
+    path = tmp_path / "hst_cos_flatfile.rmap"
+    with open(f"{hst_data}/hst_cos_flatfile.rmap") as handle:
+        text = handle.read()
+    path.write_text(text)
+    rmap.ReferenceMapping.from_file(str(path))
+    path.write_text(text.replace("v2e20129l_flat.fits", "v2e20129x_flat.fits"))
+    with raises(ChecksumError):
+        rmap.ReferenceMapping.from_file(str(path))
+    rmap.ReferenceMapping.from_file(str(path), ignore_checksum=True)
+    with raises(ChecksumError):
+        rmap.ReferenceMapping.from_file(str(path))
+    rmap.MAPPING_CHECKSUMS.clear()
+
+
+@mark.hst
+@mark.core
+@mark.rmap
+def test_preload_mappings(hst_temp_cache_state, hst_data, monkeypatch):
+    monkeypatch.setenv("CRDS_MAPPATH_SINGLE", hst_data)
+    monkeypatch.setenv("CRDS_IGNORE_CHECKSUM", "1")
+    utils.clear_function_caches()
+    assert rmap.preload_mappings(["hst_0001.pmap"], jobs=1) == []
+    preloaded = rmap.preload_mappings(["hst_0001.pmap"], jobs=2)
+    serial = rmap.load_mapping("hst_0001.pmap")
+    rmaps = [name for name in serial.mapping_names() if name.endswith(".rmap")]
+    assert sorted(os.path.basename(name) for name in preloaded) == sorted(rmaps)
+    cos_flat = [name for name in preloaded if name.endswith("hst_cos_flatfile.rmap")][0]
+    r = rmap.get_cached_mapping(cos_flat)
+    assert r.selector_is_loaded()
+    assert rmap.get_cached_mapping("hst_0001.pmap").get_imap("COS").get_rmap("flatfile") is r
+    assert rmap.get_cached_mapping("hst_0001.pmap").reference_names() == serial.reference_names()
+    assert rmap.preload_mappings(["hst_0001.pmap"], jobs=2) == []
+
+
+@mark.core
+@mark.rmap
+def test_mapping_reader_agrees_with_exec(default_shared_state, test_data, test_mappath):
+    paths = glob.glob(f"{test_data}/**/*.?map", recursive=True)
+    paths += glob.glob(f"{test_mappath}/**/*.?map", recursive=True)
+    paths += glob.glob(os.path.join(os.path.dirname(crds.__file__), "*", "specs", "*.?map"))
+    assert len(paths) > 400
+    for path in paths:
+        with open(path) as handle:
+            text = handle.read()
+        assert mapping_reader.MAPPING_READER.read(text) is not None, path
+        assert mapping_reader.check_reader(text) == [], path
+
+
+@mark.core
+@mark.rmap
+def test_mapping_reader_subset():
+    texts = [
+        "header = {}\nselector = Match({('A', 1, -2.5e3, None) : 'a.fits'})",
+        "header = {\r\n'a' : '''x\ny''', 'b' : r'\\d' u'\\n', 'c' : (1), 'd' : (1,), 'e' : [00, 1.]}\r\n",
+        "header = {'a' : 1}\n  \n# comment\ncomment = 'a' \"b\"\nselector = {'b' : True}\n",
+    ]
+    for text in texts:
+        assert mapping_reader.MAPPING_READER.read(text) is not None, text
+        assert mapping_reader.check_reader(text) == [], text
+    for text in ["header = {} selector = {}", " header = {}", "header = {'a' : 01}", "comment = 'a'\n'b'",
+                 "header = {'a' : b'x'}", "header = {'a' : 1_000}", "header = {'a' : Match}", "header = -5",
+                 "header = {'a' : 1}; selector = {}", "selector = Match({},)", "foo = {}", "header = {,}",
+                 "header = {'a' : 'unterminated}", "header = {[1] : 2}", "header = {'a' : 1 + 2}"]:
+        assert mapping_reader.MAPPING_READER.read(text) is None, text
+
+
+@mark.hst
+@mark.core
+@mark.rmap
+def test_mapping_reader_errors_match_verifier(default_shared_state, hst_data, monkeypatch):
+    with open(f"{hst_data}/hst_acs_darkfile_na_omit.rmap") as handle:
+        text = handle.read()
+    for bad in [text.replace("selector = Match({", "selector = Match({ ,"),
+                text.replace("selector = Match({", "import os\nselector = Match({"),
+                text.replace("selector = Match({", "selector = Foo({")]:
+        messages = []
+        for fast in ["1", "0"]:
+            monkeypatch.setenv("CRDS_FAST_MAPPING_READER", fast)
+            with raises(MappingError) as exc:
+                rmap.ReferenceMapping.from_string(bad, "bad.rmap", ignore_checksum=True)
+            messages.append(re.sub("0x[0-9a-f]+", "0x", str(exc.value)))
+        assert messages[0] == messages[1]
+
+
+@mark.hst
+@mark.core
+@mark.rmap
+def test_mapping_reader_benchmark(default_shared_state, hst_data):
+    r = rmap.ReferenceMapping.from_file(f"{hst_data}/hst_acs_darkfile_na_omit.rmap", ignore_checksum=True)
+    result = benchmarks.benchmark_parse(r, repeat=1)
+    assert result["bytes"] > 0 and result["read"] > 0 and result["exec"] > 0
+
+
 @mark.hst
 @mark.core
 @mark.rmap
@@ -2121,3 +2425,13 @@ selector = Bracket({
 
     def test_recursive_tear_down(self):
         os.remove(self.result_filename)
+
+
+@mark.core
+@mark.rmap
+def test_all_file_matches(default_shared_state, hst_data):
+    r = rmap.get_cached_mapping(f"{hst_data}/hst_acs_biasfile.rmap")
+    index = r.all_file_matches()
+    assert sorted(index) == r.reference_names()
+    for reference in r.reference_names():
+        assert index[reference] == r.file_matches(reference)
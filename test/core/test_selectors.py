@@ -0,0 +1,499 @@
+"""This module tests the lookup indices and other accelerations of crds.core.selectors
+against the reference implementations they replace.
+"""
+import glob
+import pickle
+import random
+import re
+
+import numpy as np
+
+from pytest import mark, raises
+
+from crds.core import rmap, selectors, selector_compiler, utils
+from crds.misc import benchmarks
+
+
+def _match_selectors(rmaps):
+    for path in rmaps:
+        try:
+            mapping = rmap.ReferenceMapping.from_file(path, ignore_checksum=True)
+        except Exception:   # deliberately invalid test rmaps
+            continue
+        yield from benchmarks.walk_selectors(mapping.selector, selectors.MatchSelector)
+
+
+def _random_headers(selector, count, seed=42):
+    """Return `count` headers mixing values drawn from `selector`'s match tuples
+    with wild cards,  N/A,  and values matching nothing.
+    """
+    rng = random.Random(seed)
+    columns = list(zip(*selector.keys())) or [() for _ in selector._parameters]
+    headers = []
+    for _ in range(count):
+        header = {}
+        for parameter, column in zip(selector._parameters, columns):
+            values = [selectors.glob_list(value)[0] if isinstance(value, str) else str(value)
+                      for value in column]
+            header[parameter] = rng.choice(values + ["*", "N/A", "UNMATCHED"])
+        headers.append(header)
+    return headers
+
+
+def _assert_index_agrees(selector, header):
+    weights, remaining = selector._winnow(header)
+    linear_weights, linear_remaining = selector._linear_winnow(header, dict(selector._match_selections))
+    assert list(remaining) == list(linear_remaining)
+    assert weights == {key: linear_weights[key] for key in linear_remaining}
+
+
+@mark.hst
+@mark.core
+@mark.selectors
+def test_match_index_agrees_with_linear_winnow_hst(hst_data):
+    for selector in _match_selectors(glob.glob(f"{hst_data}/*.rmap")):
+        for header in _random_headers(selector, 20):
+            _assert_index_agrees(selector, header)
+
+
+@mark.jwst
+@mark.core
+@mark.selectors
+def test_match_index_agrees_with_linear_winnow_jwst(jwst_data):
+    for selector in _match_selectors(glob.glob(f"{jwst_data}/*.rmap")):
+        for header in _random_headers(selector, 20):
+            _assert_index_agrees(selector, header)
+
+
+@mark.multimission
+@mark.core
+@mark.selectors
+def test_match_index_mixed_matchers():
+    parameters = ("DETECTOR", "CCDAMP", "GAIN")
+    selections = {
+        ("HRC", "A|B", "1.0") : "exact.fits",
+        ("HRC", "*", "N/A") : "wild.fits",
+        ("HRC|WFC", "{A.*}", "between 0.5 2.0") : "regex.fits",
+        ("WFC", "N/A", ">=2.0") : "inequality.fits",
+        ("SBC", "C", "# >1 #") : "esoteric.fits",
+    }
+    selector = selectors.MatchSelector(parameters, selections)
+    headers = [
+        dict(DETECTOR=detector, CCDAMP=ccdamp, GAIN=gain)
+        for detector in ("HRC", "WFC", "SBC", "N/A", "*", "NONE")
+        for ccdamp in ("A", "B", "AB", "C", "N/A", "*")
+        for gain in ("1.0", "2.0", "3.0", "N/A", "*")
+    ]
+    for header in headers:
+        _assert_index_agrees(selector, header)
+    assert selector.choose(dict(DETECTOR="HRC", CCDAMP="B", GAIN="1.0")) == "exact.fits"
+    assert selector.choose(dict(DETECTOR="HRC", CCDAMP="Q", GAIN="7.0")) == "wild.fits"
+
+
+@mark.multimission
+@mark.core
+@mark.selectors
+def test_match_index_rebuilt_on_modify():
+    selector = selectors.MatchSelector(("DETECTOR",), {("HRC",) : "hrc.fits"})
+    selector._add_item(("WFC",), "wfc.fits")
+    assert selector.choose(dict(DETECTOR="WFC")) == "wfc.fits"
+    selector._remove_item(("WFC",))
+    _assert_index_agrees(selector, dict(DETECTOR="WFC"))
+    assert selector._winnow(dict(DETECTOR="WFC")) == ({}, {})
+
+
+@mark.multimission
+@mark.core
+@mark.selectors
+def test_match_index_pickle():
+    selector = selectors.MatchSelector(("DETECTOR",), {("HRC|WFC",) : "hrc.fits"})
+    restored = pickle.loads(pickle.dumps(selector))
+    assert restored.choose(dict(DETECTOR="WFC")) == "hrc.fits"
+    del restored.__dict__["_match_index"]
+    restored.__setstate__(restored.__dict__)
+    assert restored.choose(dict(DETECTOR="HRC")) == "hrc.fits"
+
+
+def _useafter_selectors(rmaps):
+    for path in rmaps:
+        try:
+            mapping = rmap.ReferenceMapping.from_file(path, ignore_checksum=True)
+        except Exception:   # deliberately invalid test rmaps
+            continue
+        yield from benchmarks.walk_selectors(mapping.selector, selectors.UseAfterSelector)
+
+
+@mark.hst
+@mark.core
+@mark.selectors
+def test_useafter_bisect_agrees_with_sliced_hst(hst_data):
+    rng = random.Random(42)
+    for selector in _useafter_selectors(glob.glob(f"{hst_data}/*.rmap")):
+        keys = selector.keys()
+        for key in keys + ["1900-01-01 00:00:00", "2100-01-01 00:00:00"]:
+            date = key[:-1] + rng.choice("0123456789")
+            for lookup in (key, date):
+                try:
+                    expected = selector._sliced_bsearch(lookup, selector._selections)
+                except selectors.UseAfterError as exc:
+                    with raises(selectors.UseAfterError, match=re.escape(str(exc))):
+                        selector.bsearch(lookup)
+                else:
+                    assert selector.bsearch(lookup) == expected
+
+
+@mark.multimission
+@mark.core
+@mark.selectors
+def test_useafter_bisect_errors():
+    u = selectors.UseAfterSelector(("DATE-OBS", "TIME-OBS"), {
+        "2003-09-26 01:28:00" : "nal1503ij_bia.fits",
+        "2004-02-14 00:00:00" : "o3913216j_bia.fits",
+    })
+    assert u.choose({"DATE-OBS": "2004-02-14", "TIME-OBS": "00:00:00"}) == "o3913216j_bia.fits"
+    assert u.choose({"DATE-OBS": "2004-02-13", "TIME-OBS": "23:59:59"}) == "nal1503ij_bia.fits"
+    with raises(selectors.UseAfterError, match="No selection <= '2003-09-26 01:27:59'"):
+        u.bsearch("2003-09-26 01:27:59")
+    empty = selectors.UseAfterSelector(("DATE-OBS", "TIME-OBS"), {})
+    with raises(selectors.UseAfterError, match="No selection <= '2003-09-01 01:28:00'"):
+        empty.bsearch("2003-09-01 01:28:00")
+    v = selectors.VersionAfterSelector(("CAL_VER",), {"0.0.2" : "test_0.json", "5.2" : "test_2.json"})
+    assert v.choose({"CAL_VER": "5.1.9"}) == "test_0.json"
+    with raises(selectors.VersionAfterError, match="No selection <= \\(0, 0, 1\\)"):
+        v.bsearch(v.condition_key("0.0.1"))
+
+
+@mark.multimission
+@mark.core
+@mark.selectors
+def test_closest_time_bisect_agrees_with_linear():
+    rng = random.Random(42)
+    keys = sorted({"{:04d}-{:02d}-{:02d} {:02d}:00:00".format(
+        rng.randint(2000, 2030), rng.randint(1, 12), rng.randint(1, 28), rng.randint(0, 23))
+        for _ in range(200)})
+    selector = selectors.ClosestTimeSelector(("time",), {key: f"ref_{i}.fits" for (i, key) in enumerate(keys)})
+    lookups = keys + ["{:04d}-{:02d}-{:02d} {:02d}:{:02d}:00".format(
+        rng.randint(1995, 2035), rng.randint(1, 12), rng.randint(1, 28), rng.randint(0, 23), rng.randint(0, 59))
+        for _ in range(500)]
+    for lookup in lookups:
+        assert next(selector.get_selection(lookup)) == selector._linear_closest(lookup)
+
+
+@mark.multimission
+@mark.core
+@mark.selectors
+def test_useafter_pickle():
+    selector = selectors.UseAfterSelector(("DATE-OBS",), {"2003-09-26 01:28:00" : "nal1503ij_bia.fits"})
+    restored = pickle.loads(pickle.dumps(selector))
+    del restored.__dict__["_selection_keys"]
+    del restored.__dict__["_key_times"]
+    restored.__setstate__(restored.__dict__)
+    assert restored.choose({"DATE-OBS": "2004-01-01 00:00:00"}) == "nal1503ij_bia.fits"
+
+
+@mark.multimission
+@mark.core
+@mark.selectors
+def test_useafter_search_after_delete():
+    selector = selectors.UseAfterSelector(("DATE-OBS",), {
+        "2001-01-01 00:00:00" : "a.fits", "2002-01-01 00:00:00" : "b.fits", "2003-01-01 00:00:00" : "c.fits"})
+    assert selector.delete("b.fits") == 2
+    assert selector.choose({"DATE-OBS": "2002-06-01 00:00:00"}) == "a.fits"
+    assert selector.choose({"DATE-OBS": "2004-01-01 00:00:00"}) == "c.fits"
+
+
+@mark.multimission
+@mark.core
+@mark.selectors
+def test_closest_time_search_after_delete():
+    selector = selectors.ClosestTimeSelector(("time",), {
+        "2001-01-01 00:00:00" : "a.fits", "2002-01-01 00:00:00" : "b.fits", "2003-01-01 00:00:00" : "c.fits"})
+    assert selector.delete("b.fits") == 2
+    assert selector.choose({"time": "2002-01-01 00:00:00"}) == "a.fits"
+    assert selector.choose({"time": "2002-12-01 00:00:00"}) == "c.fits"
+    assert selector.choose({"time": "2004-01-01 00:00:00"}) == "c.fits"
+
+
+def _rmap_headers(mapping, count, seed=42):
+    """Return `count` headers for `mapping` combining values drawn from the keys of all
+    its selectors with N/A,  UNDEFINED,  and values matching nothing.
+    """
+    rng = random.Random(seed)
+    values = {}
+    for selector in benchmarks.walk_selectors(mapping.selector):
+        for key in selector.keys():
+            key = key if isinstance(key, tuple) else (key,)
+            for parameter, value in zip(selector._parameters, key):
+                if isinstance(selector, selectors.UseAfterSelector) and isinstance(value, str):
+                    parts = value.split()
+                else:
+                    parts = selectors.glob_list(value) if isinstance(value, str) else [str(value)]
+                values.setdefault(parameter, set()).update(parts)
+    values = {parameter: sorted(parts) + ["N/A", "UNDEFINED", "UNMATCHED"] for (parameter, parts) in values.items()}
+    return [{parameter: rng.choice(parts) for (parameter, parts) in values.items()} for _ in range(count)]
+
+
+def _choose(selector, header):
+    try:
+        return selector.choose(header)
+    except Exception as exc:
+        return exc
+
+
+@mark.hst
+@mark.core
+@mark.selectors
+def test_choose_many_agrees_with_choose_hst(hst_data):
+    for path in glob.glob(f"{hst_data}/hst_acs_*.rmap") + glob.glob(f"{hst_data}/hst_wfpc2_*.rmap"):
+        try:
+            mapping = rmap.ReferenceMapping.from_file(path, ignore_checksum=True)
+        except Exception:   # deliberately invalid test rmaps
+            continue
+        headers = _rmap_headers(mapping, 100)
+        for header, choice in zip(headers, mapping.selector.choose_many(headers)):
+            expected = _choose(mapping.selector, header)
+            if isinstance(expected, Exception):
+                assert (type(choice), str(choice)) == (type(expected), str(expected))
+            else:
+                assert choice == expected
+
+
+@mark.multimission
+@mark.core
+@mark.selectors
+def test_choose_many_columns():
+    selector = selectors.MatchSelector(("DETECTOR",), {
+        ("HRC",) : selectors.UseAfterSelector(("DATE-OBS",), {
+            "2003-09-26 01:28:00" : "hrc_1.fits",
+            "2004-02-14 00:00:00" : "hrc_2.fits",
+        }),
+        ("WFC",) : "wfc.fits",
+    })
+    choices = selector.choose_many({
+        "DETECTOR" : np.array(["HRC", "HRC", "HRC", "WFC", "SBC"]),
+        "DATE-OBS" : np.array(["2004-02-14 00:00:00", "2004-02-13", "2000-01-01", "2000-01-01", "2000-01-01"]),
+    })
+    assert choices[:2] == ["hrc_2.fits", "hrc_1.fits"]
+    assert isinstance(choices[2], selectors.MatchingError)
+    assert choices[3] == "wfc.fits"
+    assert isinstance(choices[4], selectors.ValidationError)
+
+
+@mark.hst
+@mark.core
+@mark.selectors
+def test_compiled_selector_agrees_with_choose_hst(hst_data):
+    for path in glob.glob(f"{hst_data}/hst_acs_*.rmap") + glob.glob(f"{hst_data}/hst_wfpc2_*.rmap"):
+        try:
+            mapping = rmap.ReferenceMapping.from_file(path, ignore_checksum=True)
+        except Exception:   # deliberately invalid test rmaps
+            continue
+        headers = benchmarks.sample_rmap_headers(mapping)
+        headers += [utils.condition_header(header) for header in _rmap_headers(mapping, 100)]
+        assert selector_compiler.check_compiled(mapping, headers) == []
+
+
+@mark.multimission
+@mark.core
+@mark.selectors
+def test_compiled_selector_fallback():
+    selector = selectors.MatchSelector(("DETECTOR",), {
+        ("HRC|WFC",) : selectors.UseAfterSelector(("DATE-OBS",), {"2003-09-26 01:28:00" : "hrc_1.fits"}),
+        ("SBC",) : "sbc.fits",
+    })
+    compiled = selector_compiler.compile_selector(selector)
+    assert compiled(dict(DETECTOR="WFC", **{"DATE-OBS": "2004-01-01 00:00:00"})) == "hrc_1.fits"
+    assert compiled(dict(DETECTOR="SBC", **{"DATE-OBS": "2004-01-01 00:00:00"})) == "sbc.fits"
+    with raises(selector_compiler.CompiledLookupFallback):
+        compiled(dict(DETECTOR="NONE", **{"DATE-OBS": "2004-01-01 00:00:00"}))
+    with raises(selector_compiler.CompiledLookupFallback):
+        compiled(dict(DETECTOR="HRC", **{"DATE-OBS": "2000-01-01 00:00:00"}))
+    with raises(selector_compiler.CompiledLookupFallback):
+        compiled(dict(DATE_OBS="2004-01-01 00:00:00"))
+
+
+@mark.hst
+@mark.core
+@mark.selectors
+def test_compiled_selector_pickle(hst_data, monkeypatch):
+    monkeypatch.setenv("CRDS_COMPILE_RMAPS", "1")
+    mapping = rmap.ReferenceMapping.from_file(f"{hst_data}/hst_acs_biasfile.rmap", ignore_checksum=True)
+    mapping.force_load()
+    restored = pickle.loads(pickle.dumps(mapping))
+    assert restored._compiled_selector is not None
+    for header in benchmarks.sample_rmap_headers(mapping, 50):
+        header = mapping._lookup_header(dict(header))
+        assert restored._compiled_selector(header) == mapping.selector.choose(header)
+    monkeypatch.setenv("CRDS_COMPILE_RMAPS", "0")
+    assert pickle.loads(pickle.dumps(mapping))._compiled_selector is None
+
+
+@mark.hst
+@mark.core
+@mark.selectors
+def test_compiled_selector_reset_on_modify(hst_data, monkeypatch):
+    monkeypatch.setenv("CRDS_COMPILE_RMAPS", "1")
+    mapping = rmap.ReferenceMapping.from_file(f"{hst_data}/hst_acs_biasfile.rmap", ignore_checksum=True)
+    mapping.force_load()
+    terminal = mapping.reference_names()[0]
+    deleted = mapping.delete(terminal)
+    assert deleted._compiled_selector is None
+    assert terminal not in deleted.compiled_selector().constants.values()
+    assert mapping._compiled_selector is not None
+
+
+@mark.hst
+@mark.core
+@mark.selectors
+def test_matchers_interned(hst_data):
+    biasfile = rmap.ReferenceMapping.from_file(f"{hst_data}/hst_acs_biasfile.rmap", ignore_checksum=True)
+    darkfile = rmap.ReferenceMapping.from_file(f"{hst_data}/hst_acs_darkfile.rmap", ignore_checksum=True)
+    matchers = {id(matcher_) : matcher_
+                for mapping in [biasfile, darkfile]
+                for selector in benchmarks.walk_selectors(mapping.selector, selectors.MatchSelector)
+                for selection in selector._match_selections.values()
+                for matcher_ in selection.key}
+    assert len({matcher_._spec for matcher_ in matchers.values()}) == len(matchers)
+    assert selectors.matcher("HRC") is selectors.matcher("HRC")
+    assert selectors.matcher("A|B")._regex is selectors.make_matcher("A|B")._regex
+    restored = pickle.loads(pickle.dumps(darkfile))
+    for old, new in zip(darkfile.selector._match_selections.values(), restored.selector._match_selections.values()):
+        assert all(matcher_ is restored_ for (matcher_, restored_) in zip(old.key, new.key))
+
+
+@mark.multimission
+@mark.core
+@mark.selectors
+def test_matchers_uninterned(monkeypatch):
+    monkeypatch.setattr(selectors, "INTERN_MATCHERS", False)
+    matcher_ = selectors.matcher("HRC|WFC")
+    assert matcher_ is not selectors.matcher("HRC|WFC")
+    restored = pickle.loads(pickle.dumps(matcher_))
+    assert restored.match("WFC") == 1 and restored.match("SBC") == -1
+
+
+@mark.hst
+@mark.core
+@mark.selectors
+def test_memory_report(hst_data):
+    paths = [f"{hst_data}/hst_acs_biasfile.rmap", f"{hst_data}/hst_acs_darkfile.rmap"]
+    report = benchmarks.memory_report(paths)
+    assert list(report) == ["uninterned", "interned"]
+    assert report["uninterned"]["matchers"] == 0 < report["interned"]["matchers"]
+    assert report["interned"]["bytes"] < report["uninterned"]["bytes"]
+    assert selectors.INTERN_MATCHERS
+    assert len(benchmarks.format_memory_report(report)) == 2
+
+
+@mark.multimission
+@mark.core
+@mark.selectors
+def test_selections_and_matchers_have_slots():
+    selector = selectors.MatchSelector(("DETECTOR", "CCDAMP", "CCDGAIN"), {
+        ("HRC", "A|B", ">1.0") : "hrc.fits",
+        ("NOT WFC", "*", "# >1 and <=20 #") : "not_wfc.fits",
+    })
+    for selection in selector._match_selections.values():
+        assert not hasattr(selection, "__dict__")
+        for matcher_ in selection.key:
+            assert not hasattr(matcher_, "__dict__")
+    selection = selectors.Selection(("HRC", "hrc.fits"))
+    assert (selection.key, selection.choice) == ("HRC", "hrc.fits")
+    restored = pickle.loads(pickle.dumps(selection))
+    assert type(restored) is selectors.Selection and restored == selection
+
+
+@mark.multimission
+@mark.core
+@mark.selectors
+def test_slots_load_dict_pickle_state():
+    # Pickles made before slots carry __dict__ state for Selections and Matchers.
+    selection = selectors.MatchSelection.__new__(selectors.MatchSelection, ((selectors.make_matcher("A|B"),), "ab.fits"))
+    selection.__setstate__(dict(key=selection[0], choice="ab.fits"))
+    assert selection.choice == "ab.fits"
+    glob_matcher = selectors.GlobMatcher.__new__(selectors.GlobMatcher)
+    glob_matcher.__setstate__(dict(_key="^(A|B)$", _regex=re.compile("^(A|B)$"), _glob="A|B"))
+    assert glob_matcher.match("B") == 1 and glob_matcher.match("C") == -1
+
+
+@mark.hst
+@mark.core
+@mark.selectors
+def test_rss_report(hst_data):
+    result = benchmarks.rss_report(f"{hst_data}/hst_acs_biasfile.rmap")
+    assert result["mappings"] == 1
+    assert result["selections"] > 100
+    assert result["seconds"] > 0 and isinstance(result["rss"], int)
+
+
+def _numeric_selectors(seed=42):
+    rng = random.Random(seed)
+    keys = sorted({round(rng.uniform(0, 1000), rng.choice([0, 1, 3])) for _ in range(300)})
+    keys += [1000.5, 1001.5]   # equidistant neighbors of 1001.0
+    choices = {key: f"ref_{i}.fits" for (i, key) in enumerate(keys)}
+    nearest = selectors.GeometricallyNearestSelector(("effective_wavelength",), choices)
+    bracket = selectors.BracketSelector(("effective_wavelength",), choices)
+    values = keys + [1001.0, -5.0, 2000.0, float("inf")] + [rng.uniform(-10, 1010) for _ in range(500)]
+    return nearest, bracket, values
+
+
+@mark.multimission
+@mark.core
+@mark.selectors
+def test_geometrically_nearest_search_agrees_with_linear():
+    nearest, _bracket, values = _numeric_selectors()
+    assert nearest.get_selections(values) == [nearest._linear_nearest(value) for value in values]
+    assert next(nearest.get_selection(1001.0)).key == "1000.5"
+    assert next(nearest.get_selection(float("nan"))) == nearest._linear_nearest(float("nan"))
+
+
+@mark.multimission
+@mark.core
+@mark.selectors
+def test_bracket_search_agrees_with_linear():
+    _nearest, bracket, values = _numeric_selectors()
+    assert bracket.get_selections(values) == [bracket._linear_bracket(value) for value in values]
+    unsearchable = selectors.BracketSelector(("effective_wavelength",), {"1.0": "a.fits", "2.0": "b.fits"})
+    assert unsearchable._key_values is None
+    with raises(TypeError):
+        unsearchable.choose({"effective_wavelength": "1.5"})
+
+
+@mark.multimission
+@mark.core
+@mark.selectors
+def test_numeric_selectors_search_after_delete():
+    bracket = selectors.BracketSelector(("effective_wavelength",), {
+        1.0 : "a.fits", 3.0 : "b.fits", 5.0 : "c.fits"})
+    assert bracket.delete("b.fits") == 2
+    assert [(less.choice, greater.choice) for (less, greater) in bracket.get_selections([4.0, 6.0])] == \
+        [("a.fits", "c.fits"), ("c.fits", "c.fits")]
+    nearest = selectors.GeometricallyNearestSelector(("effective_wavelength",), {
+        1.0 : "a.fits", 3.0 : "b.fits", 5.0 : "c.fits"})
+    assert nearest.delete("b.fits") == 2
+    assert [selection.choice for selection in nearest.get_selections([2.9, 4.0, 6.0])] == \
+        ["a.fits", "c.fits", "c.fits"]
+
+
+@mark.multimission
+@mark.core
+@mark.selectors
+def test_numeric_selectors_choose_many():
+    nearest, bracket, values = _numeric_selectors()
+    headers = {"effective_wavelength": np.array([str(value) for value in values] + ["foo"])}
+    for selector in (nearest, bracket):
+        choices = selector.choose_many(headers)
+        assert choices[:-1] == [selector.choose({"effective_wavelength": str(value)}) for value in values]
+        assert isinstance(choices[-1], selectors.ValidationError)
+
+
+@mark.multimission
+@mark.core
+@mark.selectors
+def test_numeric_selectors_pickle():
+    nearest, bracket, _values = _numeric_selectors()
+    for selector in (nearest, bracket):
+        restored = pickle.loads(pickle.dumps(selector))
+        del restored.__dict__["_key_values"]
+        restored.__setstate__(restored.__dict__)
+        assert restored.choose({"effective_wavelength": "500.0"}) == selector.choose({"effective_wavelength": "500.0"})
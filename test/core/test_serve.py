@@ -0,0 +1,136 @@
+from pytest import mark, raises
+import os
+import sys
+import time
+import socket
+import subprocess
+
+from crds.core import heavy_client, serve
+from crds.core.exceptions import CrdsError, ServeUnavailableError
+
+
+COS_HEADER = {
+    "INSTRUME" : "COS", "DETECTOR" : "FUV", "OPT_ELEM" : "G130M", "LIFE_ADJ" : "1",
+    "DATE-OBS" : "2012-01-01", "TIME-OBS" : "00:00:00",
+}
+
+
+def _start_daemon(socket_path, **environment):
+    daemon = subprocess.Popen([sys.executable, "-m", "crds.serve", "--socket", socket_path,
+                               "--contexts", "hst_cos.imap", "--hst"], env=dict(os.environ, **environment))
+    for _i in range(600):
+        try:
+            serve.ServeClient(socket_path).call("ping")
+            break
+        except ServeUnavailableError:
+            time.sleep(0.1)
+    return daemon
+
+
+@mark.core
+@mark.heavy_client
+def test_serve_getrecommendations(hst_offline_state, tmp_path, monkeypatch):
+    socket_path = str(tmp_path / "crds.sock")
+    daemon = _start_daemon(socket_path)
+    try:
+        monkeypatch.setenv("CRDS_SERVE_SOCKET", socket_path)
+        assert serve.get_client().call("ping") == "pong"
+        bestrefs = heavy_client.getrecommendations(
+            COS_HEADER, reftypes=["flatfile"], context="hst_cos.imap", observatory="hst", fast=True)
+        assert bestrefs == {"flatfile" : "v3n1816ml_flat.fits"}
+        with raises(ValueError, match="Unknown method"):
+            serve.get_client().call("bogus")
+        with raises(CrdsError):
+            heavy_client.getrecommendations(
+                COS_HEADER, reftypes=["flatfile"], context="hst_cos.imap", observatory="bogus", fast=True)
+        parent_socket = serve.get_client()._local.connection[0]
+        pid = os.fork()
+        if pid == 0:
+            child_ok = (serve.get_client().call("ping") == "pong" and
+                        serve.get_client()._local.connection[0] is not parent_socket)
+            os._exit(0 if child_ok else 1)
+        assert os.waitpid(pid, 0)[1] == 0
+        assert serve.get_client().call("ping") == "pong"
+        assert serve.get_client()._local.connection[0] is parent_socket
+    finally:
+        daemon.terminate()
+        daemon.wait()
+    assert not os.path.exists(socket_path)
+
+
+@mark.core
+@mark.heavy_client
+def test_serve_unavailable(hst_offline_state, tmp_path, monkeypatch):
+    socket_path = str(tmp_path / "missing.sock")
+    with raises(ServeUnavailableError):
+        serve.ServeClient(socket_path).call("ping")
+    monkeypatch.setenv("CRDS_SERVE_SOCKET", socket_path)
+    bestrefs = heavy_client.getrecommendations(
+        COS_HEADER, reftypes=["flatfile"], context="hst_cos.imap", observatory="hst", fast=True)
+    assert bestrefs == {"flatfile" : "v3n1816ml_flat.fits"}
+
+
+@mark.core
+@mark.heavy_client
+def test_serve_client_context(hst_offline_state, tmp_path, monkeypatch):
+    socket_path = str(tmp_path / "crds.sock")
+    daemon = _start_daemon(socket_path, CRDS_CONTEXT="hst_9999.pmap")
+    try:
+        monkeypatch.setenv("CRDS_SERVE_SOCKET", socket_path)
+        monkeypatch.setenv("CRDS_CONTEXT", "hst_0001.pmap")
+        client = serve.get_client()
+        assert client.matches_environment("hst")
+        bestrefs = heavy_client.getrecommendations(
+            COS_HEADER, reftypes=["flatfile"], observatory="hst", fast=True)
+        assert bestrefs == {"flatfile" : "v3n1816ml_flat.fits"}
+        monkeypatch.setenv("CRDS_PATH", str(tmp_path / "other_cache"))
+        assert not client.matches_environment("hst")
+    finally:
+        daemon.terminate()
+        daemon.wait()
+
+
+@mark.core
+@mark.heavy_client
+def test_serve_timeout(hst_offline_state, tmp_path, monkeypatch):
+    socket_path = str(tmp_path / "hung.sock")
+    hung = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    hung.bind(socket_path)
+    hung.listen(4)
+    try:
+        monkeypatch.setenv("CRDS_SERVE_TIMEOUT", "1")
+        with raises(ServeUnavailableError, match="did not answer within 1 seconds"):
+            serve.ServeClient(socket_path).call("ping")
+        monkeypatch.setenv("CRDS_SERVE_SOCKET", socket_path)
+        start = time.time()
+        bestrefs = heavy_client.getrecommendations(
+            COS_HEADER, reftypes=["flatfile"], context="hst_cos.imap", observatory="hst", fast=True)
+        assert bestrefs == {"flatfile" : "v3n1816ml_flat.fits"}
+        assert time.time() - start < 10
+    finally:
+        hung.close()
+
+
+@mark.core
+@mark.heavy_client
+def test_serve_daemon_restarted(hst_offline_state, tmp_path, monkeypatch):
+    socket_path = str(tmp_path / "crds.sock")
+    monkeypatch.setenv("CRDS_SERVE_SOCKET", socket_path)
+    client = serve.get_client()
+    daemon = _start_daemon(socket_path)
+    try:
+        assert client.matches_environment("hst")
+    finally:
+        daemon.terminate()
+        daemon.wait()
+    daemon = _start_daemon(socket_path, CRDS_REFPATH_SINGLE=str(tmp_path / "other_references"))
+    try:
+        bestrefs = heavy_client.getrecommendations(
+            COS_HEADER, reftypes=["flatfile"], context="hst_cos.imap", observatory="hst", fast=True)
+        assert bestrefs == {"flatfile" : "v3n1816ml_flat.fits"}
+        assert not client.matches_environment("hst")
+        client.close()
+        assert not client.matches_environment("hst")
+    finally:
+        daemon.terminate()
+        daemon.wait()
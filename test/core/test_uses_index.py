@@ -0,0 +1,101 @@
+from pytest import mark
+import os
+import shutil
+
+from crds.core import uses_index, rmap
+from crds import uses, matches
+from crds.certify import certify
+
+
+def _index_state(monkeypatch, tmp_path, mappath):
+    monkeypatch.setenv("CRDS_MAPPATH_SINGLE", str(mappath))
+    monkeypatch.setenv("CRDS_CFGPATH_SINGLE", str(tmp_path / "config"))
+    monkeypatch.setenv("CRDS_IGNORE_CHECKSUM", "1")
+    return uses_index.UsesIndex("hst")
+
+
+@mark.core
+@mark.uses
+def test_uses_index_files(default_shared_state, hst_data, tmp_path, monkeypatch):
+    index = _index_state(monkeypatch, tmp_path, hst_data)
+    assert not index.exists()
+    assert len(index.update()) == len(rmap.list_mappings("*.*map", "hst"))
+    assert index.exists()
+    assert index.update() == []
+    flatfile = rmap.get_cached_mapping(f"{hst_data}/hst_cos_flatfile.rmap")
+    assert index.files("hst_cos_flatfile.rmap") == flatfile.reference_names()
+    assert "hst_acs_biasfile_0001.rmap" in index.files("hst_acs.imap")
+
+
+@mark.core
+@mark.uses
+def test_uses_index_uses(default_shared_state, hst_data, tmp_path, monkeypatch):
+    index = _index_state(monkeypatch, tmp_path, hst_data)
+    index.update()
+    expected = uses.uses(["q9e1206kj_bia.fits"], "hst")
+    assert index.uses(["q9e1206kj_bia.fits"]) == sorted(expected)
+    monkeypatch.setenv("CRDS_USES_INDEX", "1")
+    assert uses.uses(["q9e1206kj_bia.fits"], "hst") == sorted(expected)
+    assert uses.uses(["hst_acs_biasfile_0001.rmap"], "hst") == ["hst.pmap", "hst_0001.pmap", "hst_acs.imap", "hst_acs_0001.imap"]
+
+
+@mark.core
+@mark.uses
+def test_uses_index_matches(default_shared_state, hst_data, tmp_path, monkeypatch):
+    index = _index_state(monkeypatch, tmp_path, hst_data)
+    index.update()
+    expected = matches.find_full_match_paths("hst.pmap", "q9e1206kj_bia.fits")
+    assert index.context_users("hst.pmap", "q9e1206kj_bia.fits") == ["hst_acs_biasfile_0001.rmap"]
+    assert index.context_users("hst_9999.pmap", "q9e1206kj_bia.fits") is None
+    assert "hst_acs_biasfile_0001.rmap" in index.closure("hst.pmap")
+    monkeypatch.setenv("CRDS_USES_INDEX", "1")
+    assert matches.find_full_match_paths("hst.pmap", "q9e1206kj_bia.fits") == expected
+
+
+@mark.core
+@mark.uses
+@mark.certify
+def test_uses_index_governing_rmap(default_shared_state, hst_data, tmp_path, monkeypatch):
+    index = _index_state(monkeypatch, tmp_path, hst_data)
+    index.update()
+    monkeypatch.setenv("CRDS_USES_INDEX", "1")
+    governing = certify.find_governing_rmap("hst.pmap", f"{hst_data}/acs_new_idc.fits")
+    assert governing.name == "hst_acs_idctab.rmap"
+    assert certify.find_indexed_governing_rmap("hst_9999.pmap", f"{hst_data}/acs_new_idc.fits") is None
+
+
+@mark.core
+@mark.uses
+def test_uses_index_incremental(default_shared_state, hst_data, tmp_path, monkeypatch):
+    mappath = tmp_path / "mappings"
+    mappath.mkdir()
+    for name in ["hst_cos.imap", "hst_cos_flatfile.rmap"]:
+        shutil.copy(f"{hst_data}/{name}", mappath / name)
+    index = _index_state(monkeypatch, tmp_path, mappath)
+    assert sorted(index.update()) == ["hst_cos.imap", "hst_cos_flatfile.rmap"]
+    assert index.uses(["v2e20129l_flat.fits"]) == ["hst_cos.imap", "hst_cos_flatfile.rmap"]
+    flatfile = mappath / "hst_cos_flatfile.rmap"
+    flatfile.write_text(flatfile.read_text().replace("v2e20129l_flat.fits", "v2e20129x_flat.fits"))
+    stat = flatfile.stat()
+    os.utime(flatfile, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10**9))
+    assert index.update() == ["hst_cos_flatfile.rmap"]
+    assert index.uses(["v2e20129l_flat.fits"]) == []
+    assert index.uses(["v2e20129x_flat.fits"]) == ["hst_cos.imap", "hst_cos_flatfile.rmap"]
+    os.remove(flatfile)
+    assert index.update() == []
+    assert index.uses(["v2e20129x_flat.fits"]) == []
+    assert index.files("hst_cos_flatfile.rmap") == []
+
+
+@mark.core
+@mark.uses
+def test_uses_index_added_mappings(default_shared_state, hst_data, tmp_path, monkeypatch):
+    mappath = tmp_path / "mappings"
+    mappath.mkdir()
+    shutil.copy(f"{hst_data}/hst_cos.imap", mappath / "hst_cos.imap")
+    _index_state(monkeypatch, tmp_path, mappath)
+    monkeypatch.setenv("CRDS_USES_INDEX", "1")
+    assert uses.uses(["hst_cos_flatfile.rmap"], "hst") == ["hst_cos.imap"]
+    assert uses.uses(["v2e20129l_flat.fits"], "hst") == []
+    shutil.copy(f"{hst_data}/hst_cos_flatfile.rmap", mappath / "hst_cos_flatfile.rmap")
+    assert uses.uses(["v2e20129l_flat.fits"], "hst") == ["hst_cos.imap", "hst_cos_flatfile.rmap"]
@@ -0,0 +1,78 @@
+from pytest import mark
+import threading
+
+from crds.core import utils
+
+
+@mark.core
+def test_cached_function_global_maxsize(monkeypatch):
+    monkeypatch.setenv("CRDS_CACHE_MAXSIZE", "3")
+    @utils.cached
+    def square(x):
+        return x * x
+    for x in range(10):
+        assert square(x) == x * x
+    assert sorted(square.cache) == [(7,), (8,), (9,)]
+    assert square(8) == 64
+    assert square(10) == 100
+    assert sorted(square.cache) == [(8,), (9,), (10,)]
+    stats = square.stats()
+    assert (stats["hits"], stats["misses"], stats["evictions"], stats["size"]) == (1, 11, 8, 3)
+
+
+@mark.core
+def test_cached_function_maxbytes():
+    @utils.xcached(maxbytes=20000)
+    def block(x):
+        return "x" * 5000 + str(x)
+    for x in range(10):
+        block(x)
+    stats = block.stats()
+    assert stats["size"] < 5 and stats["bytes"] <= 20000
+    assert stats["evictions"] == 10 - stats["size"]
+    assert (9,) in block.cache
+
+
+@mark.core
+def test_cached_function_cleared_directly():
+    @utils.xcached(maxbytes=20000)
+    def block(x):
+        return "x" * 5000 + str(x)
+    block(1)
+    block(2)
+    block.cache.clear()
+    block(3)
+    assert block.stats()["size"] == 1
+    assert block.stats()["bytes"] < 10000
+
+
+@mark.core
+def test_cached_function_threads():
+    @utils.xcached(maxsize=50)
+    def identity(x):
+        return x
+    def worker(offset):
+        for i in range(2000):
+            assert identity((i + offset) % 100) == (i + offset) % 100
+    threads = [threading.Thread(target=worker, args=(n,)) for n in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    stats = identity.stats()
+    assert stats["size"] <= 50
+    assert stats["hits"] + stats["misses"] == 16000
+
+
+@mark.core
+def test_cache_stats():
+    @utils.cached
+    def negate(x):
+        return -x
+    negate(1)
+    negate(1)
+    stats = utils.cache_stats()
+    assert stats[__name__ + ".test_cache_stats.<locals>.negate"]["hits"] == 1
+    assert "crds.core.rmap._load_mapping" in stats
+    utils.clear_function_caches()
+    assert negate.stats()["size"] == 0
@@ -0,0 +1,204 @@
+from pytest import mark, raises
+import os
+
+from crds.core import utils
+from crds.core.exceptions import CrdsDownloadError, ServiceError
+from crds.client import api, proxy
+
+
+REFERENCES = [f"x{i:07d}l_dark.fits" for i in range(8)]
+
+
+def _serve_references(server):
+    for i, name in enumerate(REFERENCES):
+        server.add_file(name, bytes([i]) * (1000 + i))
+
+
+@mark.sync
+def test_download_files_concurrently(hst_download_server, monkeypatch, caplog):
+    _serve_references(hst_download_server)
+    hst_download_server.delay = 0.2
+    monkeypatch.setenv("CRDS_DOWNLOAD_JOBS", "4")
+    with caplog.at_level("INFO", logger="CRDS"):
+        localpaths, downloads, n_bytes = api.FileCacher("hst.pmap").get_local_files(list(REFERENCES))
+    assert downloads == len(REFERENCES)
+    assert n_bytes == sum(1000 + i for i in range(len(REFERENCES)))
+    assert hst_download_server.max_active > 1
+    for i, name in enumerate(REFERENCES):
+        with open(localpaths[name], "rb") as handle:
+            assert handle.read() == bytes([i]) * (1000 + i)
+    assert caplog.text.count("Fetching") == len(REFERENCES)
+    assert "(8 / 8 files)" in caplog.text
+
+
+@mark.sync
+def test_download_files_failures(hst_download_server, monkeypatch):
+    _serve_references(hst_download_server)
+    hst_download_server.add_file("x9999999l_dark.fits", b"corrupted", sha1sum="0" * 40)
+    names = REFERENCES + ["x9999999l_dark.fits", "x8888888l_dark.fits"]
+    monkeypatch.setenv("CRDS_DOWNLOAD_JOBS", "3")
+    cacher = api.FileCacher("hst.pmap", raise_exceptions=False)
+    localpaths, downloads, n_bytes = cacher.get_local_files(list(names))
+    assert downloads == len(names)
+    assert n_bytes == sum(1000 + i for i in range(len(REFERENCES)))
+    assert all(os.path.exists(localpaths[name]) for name in REFERENCES)
+    assert not os.path.exists(localpaths["x9999999l_dark.fits"])
+    assert not os.path.exists(localpaths["x8888888l_dark.fits"])
+    with raises(CrdsDownloadError, match="sha1sum"):
+        api.FileCacher("hst.pmap", ignore_cache=True).get_local_files(REFERENCES + ["x9999999l_dark.fits"])
+    assert not os.path.exists(localpaths["x9999999l_dark.fits"])
+
+
+@mark.sync
+def test_http_connections_pooled(hst_download_server):
+    _serve_references(hst_download_server)
+    hst_download_server.rpc_methods["get_default_context"] = lambda observatory: observatory + ".pmap"
+    api.FileCacher("hst.pmap").get_local_files(list(REFERENCES))
+    service = proxy.CheckingProxy(hst_download_server.url + "json/")
+    for _i in range(10):
+        assert service.get_default_context("hst") == "hst.pmap"
+    assert hst_download_server.connections == 1
+
+
+@mark.sync
+def test_http_connections_idle_timeout(hst_download_server, monkeypatch):
+    hst_download_server.rpc_methods["get_default_context"] = lambda observatory: observatory + ".pmap"
+    monkeypatch.setenv("CRDS_HTTP_IDLE_TIMEOUT", "0")
+    service = proxy.CheckingProxy(hst_download_server.url + "json/")
+    for _i in range(3):
+        assert service.get_default_context("hst") == "hst.pmap"
+    assert hst_download_server.connections == 3
+
+
+LARGE = "x7777777l_dark.fits"
+LARGE_DATA = bytes(range(256)) * 40
+
+
+@mark.sync
+@mark.parametrize("ranges", [True, False])
+def test_download_resumes_after_interruption(hst_download_server, monkeypatch, ranges):
+    hst_download_server.add_file(LARGE, LARGE_DATA)
+    hst_download_server.ranges = ranges
+    hst_download_server.interrupts[LARGE] = 3000
+    monkeypatch.setenv("CRDS_CLIENT_RETRY_COUNT", "2")
+    localpaths, _downloads, n_bytes = api.FileCacher("hst.pmap").get_local_files([LARGE])
+    assert n_bytes == len(LARGE_DATA)
+    with open(localpaths[LARGE], "rb") as handle:
+        assert handle.read() == LARGE_DATA
+    assert not os.path.exists(localpaths[LARGE] + ".part")
+    assert hst_download_server.gets[-2:] == [("/" + LARGE, None), ("/" + LARGE, "bytes=3000-")]
+
+
+@mark.sync
+def test_download_resumes_partial_file(hst_download_server):
+    hst_download_server.add_file(LARGE, LARGE_DATA)
+    hst_download_server.interrupts[LARGE] = 3000
+    cacher = api.FileCacher("hst.pmap")
+    localpath = cacher.locate(LARGE)
+    with raises(CrdsDownloadError):
+        cacher.get_local_files([LARGE])
+    assert not os.path.exists(localpath)
+    assert os.path.getsize(localpath + ".part") == 3000
+    cacher.get_local_files([LARGE])
+    with open(localpath, "rb") as handle:
+        assert handle.read() == LARGE_DATA
+    assert hst_download_server.gets[-1] == ("/" + LARGE, "bytes=3000-")
+
+
+@mark.sync
+def test_download_discards_corrupt_partial_file(hst_download_server, monkeypatch):
+    hst_download_server.add_file(LARGE, LARGE_DATA)
+    cacher = api.FileCacher("hst.pmap")
+    localpath = cacher.locate(LARGE)
+    os.makedirs(os.path.dirname(localpath), exist_ok=True)
+    with open(localpath + ".part", "wb") as handle:
+        handle.write(b"x" * 3000)
+    with raises(CrdsDownloadError, match="sha1sum"):
+        cacher.get_local_files([LARGE])
+    assert not os.path.exists(localpath + ".part")
+    monkeypatch.setenv("CRDS_CLIENT_RETRY_COUNT", "2")
+    with open(localpath + ".part", "wb") as handle:
+        handle.write(b"x" * 3000)
+    cacher.get_local_files([LARGE])
+    with open(localpath, "rb") as handle:
+        assert handle.read() == LARGE_DATA
+
+
+@mark.sync
+def test_download_checksums_while_streaming(hst_download_server, monkeypatch):
+    hst_download_server.add_file(LARGE, LARGE_DATA)
+    hst_download_server.add_file("x9999999l_dark.fits", b"corrupted", sha1sum="0" * 40)
+    hst_download_server.interrupts[LARGE] = 3000
+    checksummed = []
+    monkeypatch.setattr(utils, "checksum", lambda path: checksummed.append(path))
+    cacher = api.FileCacher("hst.pmap")
+    with raises(CrdsDownloadError):
+        cacher.get_local_files([LARGE])
+    cacher.get_local_files([LARGE])
+    with open(cacher.locate(LARGE), "rb") as handle:
+        assert handle.read() == LARGE_DATA
+    with raises(CrdsDownloadError, match="sha1sum"):
+        cacher.get_local_files(["x9999999l_dark.fits"])
+    assert checksummed == []
+
+
+def _bad_instrument(instrument):
+    raise ValueError("Unknown instrument " + repr(instrument))
+
+
+@mark.sync
+def test_proxy_batch(hst_download_server):
+    hst_download_server.rpc_methods["get_default_context"] = lambda observatory: observatory + ".pmap"
+    hst_download_server.rpc_methods["get_required_parkeys"] = _bad_instrument
+    service = proxy.CheckingProxy(hst_download_server.url + "json/")
+    with service._batch() as batch:
+        hst = batch.get_default_context("hst")
+        jwst = batch.get_default_context("jwst")
+        bad = batch.get_required_parkeys("foo")
+        with raises(ServiceError, match="before its batch was sent"):
+            hst.result()
+    assert hst_download_server.posts == 1
+    assert (hst.result(), jwst.result()) == ("hst.pmap", "jwst.pmap")
+    with raises(ServiceError, match="Unknown instrument 'foo'"):
+        bad.result()
+
+
+@mark.sync
+def test_proxy_batch_rejected(hst_download_server):
+    hst_download_server.rpc_methods["get_default_context"] = lambda observatory: observatory + ".pmap"
+    hst_download_server.rpc_methods["get_required_parkeys"] = _bad_instrument
+    hst_download_server.batches = False
+    service = proxy.CheckingProxy(hst_download_server.url + "json/")
+    for posts in [4, 7]:
+        with service._batch() as batch:
+            hst = batch.get_default_context("hst")
+            jwst = batch.get_default_context("jwst")
+            bad = batch.get_required_parkeys("foo")
+        assert hst_download_server.posts == posts
+        assert (hst.result(), jwst.result()) == ("hst.pmap", "jwst.pmap")
+        with raises(ServiceError, match="Unknown instrument 'foo'"):
+            bad.result()
+
+
+@mark.sync
+def test_dataset_headers_batched(hst_download_server, monkeypatch):
+    hst_download_server.rpc_methods["get_dataset_headers_by_id"] = \
+        lambda context, ids, since: {dataset_id : {"CONTEXT" : context} for dataset_id in ids}
+    monkeypatch.setattr(api, "S", proxy.CheckingProxy(hst_download_server.url + "json/"))
+    ids = [f"J{i:07d}" for i in range(1200)]
+    headers = dict(api.get_dataset_headers_unlimited("/path/hst_0001.pmap", ids))
+    assert headers == {dataset_id : {"CONTEXT" : "hst_0001.pmap"} for dataset_id in ids}
+    assert hst_download_server.posts == 1
+    monkeypatch.setenv("CRDS_RPC_BATCH_SIZE", "2")
+    assert dict(api.get_dataset_headers_unlimited("hst_0001.pmap", ids)) == headers
+    assert hst_download_server.posts == 3
+
+
+@mark.sync
+def test_proxy_batch_transport_failure(hst_download_server, monkeypatch):
+    service = proxy.CheckingProxy("http://127.0.0.1:1/json/")
+    with service._batch() as batch:
+        context = batch.get_default_context("hst")
+    with raises(ServiceError, match="CRDS jsonrpc failure 'batch'"):
+        context.result()
+    assert "http://127.0.0.1:1/json/" not in proxy._BATCH_REJECTED
@@ -1,3 +1,5 @@
+from crds import matches
+from crds.core import rmap, utils
 from crds.matches import MatchesScript
 from pytest import mark
 
@@ -55,3 +57,25 @@ FW1OFFST='0.0' FW2OFFST='0.0' FWSOFFST='0.0' GLINCORR='UNDEFINED' INSTRUME='ACS'
 NUMCOLS='2070.0' NUMROWS='2046.0' OBSTYPE='INTERNAL' PCTECORR='OMIT' PHOTCORR='OMIT' REFTYPE='UNDEFINED' \
 SHADCORR='OMIT' SHUTRPOS='B' TIME-OBS='01:07:14.960000' XCORNER='1.0' YCORNER='2072.0'"""
     assert out_to_check in out
+
+
+@mark.hst
+@mark.matches
+def test_matches_match_index(default_shared_state, hst_data, tmp_path, monkeypatch):
+    monkeypatch.setenv("CRDS_MAPPATH_SINGLE", hst_data)
+    monkeypatch.setenv("CRDS_PICKLEPATH_SINGLE", str(tmp_path))
+    monkeypatch.setenv("CRDS_IGNORE_CHECKSUM", "1")
+    monkeypatch.setenv("CRDS_AUTO_PICKLE_CONTEXTS", "1")
+    utils.clear_function_caches()
+    ctx = rmap.get_cached_mapping("hst_acs_9999.imap")
+    index = matches.get_match_index("hst_acs_9999.imap")
+    for reference in ctx.reference_names():
+        assert index[reference] == ctx.file_matches(reference)
+    index_file = tmp_path / "hst_acs_9999.imap.matches.pkl"
+    assert index_file.exists()
+    monkeypatch.setenv("CRDS_USE_PICKLED_CONTEXTS", "1")
+    utils.clear_function_caches()
+    assert matches.get_match_index("hst_acs_9999.imap") == index
+    assert matches.find_full_match_paths("hst_acs_9999.imap", "not_a_reference.fits") == []
+    reference = ctx.reference_names()[0]
+    assert matches.find_match_paths_as_dict("hst_acs_9999.imap", reference)[0]["instrument"] == "acs"
@@ -164,3 +164,17 @@ def test_sync_latest(jwst_default_cache_state, caplog):
         out = caplog.text
     assert errors == 0
     assert "Symbolic context 'latest' resolves to" in out
+
+
+@mark.hst
+@mark.sync
+def test_sync_clear_pickles(hst_temp_cache_state):
+    picklepath = config.get_crds_picklepath("hst")
+    pickles = ["hst_0001.pmap.pkl", "hst_cos.imap.pkl", "hst_cos_flatfile.rmap.pkl",
+               "hst_0001.pmap.matches.pkl", "hst_0001.pmap.img", "rmap_store/0123.pkl"]
+    for name in pickles:
+        os.makedirs(os.path.dirname(os.path.join(picklepath, name)), exist_ok=True)
+        with open(os.path.join(picklepath, name), "wb") as handle:
+            handle.write(b"pickle")
+    SyncScript("crds.sync --hst").clear_pickles()
+    assert os.listdir(picklepath) == []